@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+"""
+End-to-end benchmarks of ecobee.Client against ecobee.fakeserver.
+
+    python benchmarks/bench_client.py --sizes 1,100,1000 --latency 0.02
+
+For each fleet size this times update(), poll(), runtimeReport() and
+setHold(), and prints the median and 95th percentile latency of each
+call and its throughput in thermostats (or report rows) per second.
+
+For fleets larger than one runtime report request allows, it also
+times a --long-report-days report of --long-report-thermostats, which is
+split into several requests fetched in parallel under --rate-limit.
+
+It also compares requests per second through the pooled Transport with
+a new requests.Session for every request, like the client used to do.
+--no-pool runs all the benchmarks that way.
+
+update() with each mix of sections in SECTION_MIXES reports the bytes
+received and the time spent decoding them.
+
+Lookups of IDs and names in the client's ThermostatRegistry are timed
+against a search of a plain list, along with get_thermostats() for the
+whole fleet.
+
+Reading sensor and thermostat properties from the parsed capability and
+equipment caches is timed against scanning the raw status for each read.
+
+Thermostat status kept as decoded JSON dicts is compared with
+compact=True snapshots: memory held per thermostat, update() time and
+the rate of reading fields from the stored status.
+
+With a server where --stall of the requests wait --stall-time seconds
+more, it compares the 99th percentile latency of thermostatSummary
+requests without hedging, hedging at the 95th percentile of recent
+latency, and hedging after --hedge-delay seconds.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import argparse
+import datetime
+import gc
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ecobee
+from ecobee.fakeserver import FakeEcobee
+from ecobee.objects import CAPABILITY_PARSERS, HEATING, COOLING
+
+
+DEFAULT_SIZES = '1,10,100,1000,10000'
+# columns of the long runtime report, few to keep the fake server quick
+LONG_REPORT_COLUMNS = ('zoneAveTemp', 'zoneHumidity', 'compCool1')
+SECTION_MIXES = (
+    ('runtime',),
+    ('runtime', 'equipmentStatus'),
+    ('runtime', 'remoteSensors'),
+    ecobee.DEFAULT_SECTIONS,
+    ecobee.STATUS_SECTIONS,
+)
+
+
+class UnpooledTransport(ecobee.Transport):
+    """A new session, and so a new connection, for every request"""
+
+    def request(self, method, url, timeout=None, **kwargs):
+        with requests.Session() as session:
+            session.headers.update(self.session.headers)
+            return session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+
+def timed(func, repeat):
+    """Seconds each of 'repeat' calls to func took"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def succeeded(result):
+    """Check an API response says it worked, so failures aren't timed"""
+    if not result or result['status']['code'] != 0:
+        raise SystemExit('request failed: {}'.format(result))
+
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(p * len(times)))]
+
+
+def report(size, name, times, items):
+    """Print one result line, items is the work done per call"""
+    total = sum(times)
+    print('{:>6} {:<16} {:>6} calls  p50 {:>8.1f} ms  p95 {:>8.1f} ms  {:>10.0f} /s'.format(
+        size, name, len(times), percentile(times, 0.5) * 1000, percentile(times, 0.95) * 1000,
+        items * len(times) / total if total else 0))
+
+
+class Received(ecobee.Observer):
+    """Bytes received and seconds spent decoding them"""
+
+    def __init__(self):
+        self.received = 0
+        self.decoding = 0.0
+
+    def request(self, method, endpoint, seconds, status, sent, received):
+        self.received += received
+
+    def decode(self, endpoint, seconds, size):
+        self.decoding += seconds
+
+
+def sections(size, args, server):
+    """Response size and decode time of update() for each section mix"""
+    for mix in SECTION_MIXES:
+        observer = Received()
+        eapi = server.client(workers=args.workers, observer=observer)
+        eapi.update(sections=list(mix))
+        observer.received = 0
+        observer.decoding = 0.0
+        times = timed(lambda: eapi.update(sections=list(mix)), args.repeat)
+        print('{:>6} sections {:>10.0f} bytes  decode {:>7.2f} ms  update p50 {:>7.1f} ms  {}'.format(
+            size, observer.received / args.repeat, observer.decoding / args.repeat * 1000,
+            percentile(times, 0.5) * 1000, ','.join(mix)))
+        eapi.transport.close()
+
+
+def transports(size, args, server):
+    """Requests per second with and without connection pooling"""
+    for name, transport in (('summary pooled', ecobee.Transport()),
+                            ('summary unpooled', UnpooledTransport())):
+        eapi = server.client(transport=transport, summary_ttl=0)
+        eapi.thermostatSummary()
+        report(size, name, timed(eapi.thermostatSummary, args.requests), 1)
+        transport.close()
+
+
+def registry(size, args, eapi):
+    """Lookups in the thermostat registry, and a plain list to compare"""
+    ids = eapi.thermostat_ids
+    plain = list(ids)
+    probe = plain[::max(1, len(plain) // args.lookups)]
+    wanted = set(probe)
+    names = list(n for n, tid in ids.names.items() if tid in wanted)
+
+    report(size, 'id in registry', timed(lambda: list(tid in ids for tid in probe), args.repeat), len(probe))
+    report(size, 'id in list', timed(lambda: list(tid in plain for tid in probe), args.repeat), len(probe))
+    report(size, 'by_name', timed(lambda: list(ids.by_name(n) for n in names), args.repeat), len(names))
+    report(size, 'get_thermostats', timed(lambda: eapi.get_thermostats(plain), args.repeat), size)
+
+
+def scan(sensor, key):
+    """Sensor capability from its raw status, without the parsed cache"""
+    for obj in sensor.get('capability', []):
+        if obj['type'] == key:
+            return CAPABILITY_PARSERS[key](obj['value'])
+
+
+def properties(size, args, eapi):
+    """Property reads from the parsed caches, and from the raw status"""
+    thermostats = eapi.list_thermostats()
+    sensors = list(s for t in thermostats for s in t.list_sensors())
+    reads = len(thermostats) * 3 + len(sensors) * 3
+
+    def cached():
+        for t in thermostats:
+            t.is_fan, t.is_heating, t.is_cooling
+        for s in sensors:
+            s.temperature, s.humidity, s.occupancy
+
+    def raw():
+        for t in thermostats:
+            running = t._status.get('equipmentStatus', '').split(',')
+            'fan' in running, any(e in running for e in HEATING), any(e in running for e in COOLING)
+        for s in sensors:
+            status = s._status
+            scan(status, 'temperature'), scan(status, 'humidity'), scan(status, 'occupancy')
+
+    cached()
+    report(size, 'properties', timed(cached, args.repeat), reads)
+    report(size, 'properties raw', timed(raw, args.repeat), reads)
+
+
+def retained(root):
+    """Bytes held by root and everything it refers to, counting objects
+    shared between them once.  Classes aren't counted, they aren't data."""
+    seen = set()
+    total = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+def snapshots(size, args, server):
+    """Memory and read time of status as dicts, and as compact snapshots"""
+    for name, compact in (('status dict', False), ('status compact', True)):
+        eapi = server.client(workers=args.workers, compact=compact)
+        eapi.update()
+        # only what the status holds on to, not what update() freed
+        held = retained(eapi._status)
+
+        status = list(eapi._status.values())
+
+        def read():
+            for t in status:
+                runtime = t['runtime']
+                runtime['actualTemperature'], runtime['desiredHeat'], runtime['desiredCool']
+                t['settings']['hvacMode'], t['equipmentStatus']
+                for sensor in t['remoteSensors'].values():
+                    sensor['capability'][0]['value']
+
+        updates = timed(eapi.update, args.repeat)
+        reads = timed(read, args.repeat)
+        print('{:>6} {:<16} {:>8.0f} bytes/thermostat  update p50 {:>8.1f} ms  read p50 {:>8.2f} ms'.format(
+            size, name, held / size, percentile(updates, 0.5) * 1000, percentile(reads, 0.5) * 1000))
+        eapi.transport.close()
+
+
+def hedging(size, args):
+    """Tail latency of summary requests to a server that sometimes
+    stalls, with and without hedging"""
+    with FakeEcobee(thermostats=size, sensors=args.sensors, latency=args.latency,
+                    stall=args.stall, stall_time=args.stall_time, seed=1) as server:
+        for name, hedge in (('summary', False), ('summary hedge95', True),
+                            ('summary hedged', args.hedge_delay)):
+            eapi = server.client(summary_ttl=0, hedge=hedge)
+            # warm up, and learn the latency to hedge after
+            timed(eapi.thermostatSummary, args.requests)
+            times = timed(eapi.thermostatSummary, args.requests)
+            print('{:>6} {:<16} {:>6} calls  p50 {:>8.1f} ms  p99 {:>8.1f} ms'.format(
+                size, name, len(times), percentile(times, 0.5) * 1000, percentile(times, 0.99) * 1000))
+            eapi.transport.close()
+
+
+def run(size, args):
+    with FakeEcobee(thermostats=size, sensors=args.sensors, latency=args.latency, seed=1) as server:
+        transports(size, args, server)
+        sections(size, args, server)
+        snapshots(size, args, server)
+
+        transport = UnpooledTransport() if args.no_pool else None
+        eapi = server.client(workers=args.workers, summary_ttl=0, transport=transport)
+        eapi.update()
+        ids = list(eapi.thermostat_ids)
+
+        report(size, 'update', timed(eapi.update, args.repeat), size)
+        registry(size, args, eapi)
+        properties(size, args, eapi)
+
+        def poll():
+            server.change(args.change)
+            eapi.poll()
+        report(size, 'poll', timed(poll, args.repeat), size)
+
+        def update_changed():
+            server.change(args.change)
+            eapi.update_changed()
+        report(size, 'update_changed', timed(update_changed, args.repeat), size)
+
+        report_ids = ids[:args.report_thermostats]
+        start = datetime.date.today() - datetime.timedelta(days=args.report_days)
+        rows = len(report_ids) * (args.report_days + 1) * 288
+
+        def runtime_report():
+            eapi.runtimeReport(report_ids, start_date=start, end_date=datetime.date.today())
+        report(size, 'runtimeReport', timed(runtime_report, args.repeat), rows)
+
+        # several months of a fleet larger than one request allows, split
+        # into requests fetched in parallel under the rate limit
+        if size > ecobee.REPORT_MAX_THERMOSTATS:
+            long_ids = ids[:args.long_report_thermostats]
+            long_start = datetime.date.today() - datetime.timedelta(days=args.long_report_days)
+            long_rows = len(long_ids) * (args.long_report_days + 1) * 288
+            # the same tokens as eapi: the server only accepts the newest pair
+            limited = ecobee.Client('fakekey', authstore=eapi.auth, url_base=server.url, lazy=True,
+                                    workers=args.workers, rate_limit=args.rate_limit, transport=transport)
+
+            def long_report():
+                limited.runtimeReport(long_ids, start_date=long_start, end_date=datetime.date.today(),
+                                      columns=LONG_REPORT_COLUMNS)
+            report(size, 'runtimeReport long', timed(long_report, args.repeat), long_rows)
+
+        hold_ids = ids[:args.holds]
+        times = []
+        for tid in hold_ids:
+            times.extend(timed(lambda: succeeded(eapi.setHold(tid, holdClimateRef='away')), 1))
+        report(size, 'setHold', times, 1)
+
+        def queued():
+            with ecobee.CommandQueue(eapi, window=0) as queue:
+                futures = list(queue.setHold(tid, holdClimateRef='home') for tid in hold_ids)
+            for future in futures:
+                succeeded(future.result())
+        report(size, 'setHold queued', timed(queued, args.repeat), len(hold_ids))
+
+        eapi.transport.close()
+
+    if args.stall:
+        hedging(size, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='fleet sizes, comma separated')
+    parser.add_argument('--repeat', type=int, default=5, help='calls to time for each benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency in seconds')
+    parser.add_argument('--sensors', type=int, default=2, help='sensors per thermostat')
+    parser.add_argument('--workers', type=int, default=ecobee.DEFAULT_WORKERS, help='client workers')
+    parser.add_argument('--change', type=float, default=0.05,
+                        help='fraction of thermostats changed before each poll')
+    parser.add_argument('--report-thermostats', type=int, default=25,
+                        help='most thermostats in the runtime report')
+    parser.add_argument('--report-days', type=int, default=1, help='days of runtime report')
+    parser.add_argument('--long-report-thermostats', type=int, default=40,
+                        help='most thermostats in the long runtime report')
+    parser.add_argument('--long-report-days', type=int, default=90, help='days of long runtime report')
+    parser.add_argument('--rate-limit', type=float, default=10,
+                        help='requests per second for the long runtime report')
+    parser.add_argument('--lookups', type=int, default=1000,
+                        help='thermostats to look up in the registry benchmark')
+    parser.add_argument('--holds', type=int, default=50, help='most thermostats to set holds on')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests to time for the pooled and unpooled comparison')
+    parser.add_argument('--stall', type=float, default=0.05,
+                        help='fraction of requests that stall, for the hedging benchmark, 0 to skip it')
+    parser.add_argument('--stall-time', type=float, default=0.3, help='seconds a stalled request waits')
+    parser.add_argument('--hedge-delay', type=float, default=0.05,
+                        help='seconds to wait before hedging, to compare with hedging at the 95th percentile')
+    parser.add_argument('--no-pool', action='store_true',
+                        help='send every request on a new session, without connection pooling')
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        run(size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+"""
+JSON decode throughput of each installed codec on large API responses.
+
+    python benchmarks/bench_codec.py --thermostats 1000 --days 31
+
+The fixtures are a /thermostat response for a fleet with every section
+included, and a full-size /runtimeReport, both from ecobee.fakeserver.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ecobee
+from ecobee import codec
+from ecobee.fakeserver import FakeThermostat
+
+
+def fixtures(thermostats, sensors, days):
+    """(name, JSON bytes) of each fixture"""
+    rand = random.Random(1)
+    fleet = list(FakeThermostat(i, sensors, rand) for i in range(thermostats))
+    selection = dict((flag, True) for flag in ecobee.SECTION_INCLUDES.values())
+    thermostat = {'thermostatList': list(t.status(selection) for t in fleet), 'status': {'code': 0}}
+
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=days - 1)
+    report = {
+        'columns':    ','.join(ecobee.REPORT_COLUMNS),
+        'reportList': list({'thermostatIdentifier': t.identifier,
+                            'rowList': t.report(start, end, ecobee.REPORT_COLUMNS)}
+                           for t in fleet[:ecobee.REPORT_MAX_THERMOSTATS]),
+        'sensorList': list(t.sensor_report(start, end) for t in fleet[:ecobee.REPORT_MAX_THERMOSTATS]),
+    }
+    return [('thermostat', json.dumps(thermostat).encode('utf-8')),
+            ('runtimeReport', json.dumps(report).encode('utf-8'))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--thermostats', type=int, default=1000, help='thermostats in the fleet')
+    parser.add_argument('--sensors', type=int, default=4, help='sensors per thermostat')
+    parser.add_argument('--days', type=int, default=ecobee.REPORT_MAX_DAYS, help='days of runtime report')
+    parser.add_argument('--repeat', type=int, default=5, help='times to decode each fixture')
+    args = parser.parse_args()
+
+    for name, data in fixtures(args.thermostats, args.sensors, args.days):
+        print('{} response, {:.1f} MB'.format(name, len(data) / 1e6))
+        for codec_name in codec.available():
+            loads = codec.get(codec_name).loads
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                loads(data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print('  {:<8} {:>8.1f} ms  {:>8.1f} MB/s'.format(codec_name, best * 1000, len(data) / 1e6 / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8
+"""
+Startup latency: importing ecobee and constructing a Client.
+
+    python benchmarks/bench_startup.py --repeat 20
+
+Each run is a fresh interpreter, as for a short-lived CLI job.  It times
+the import, then constructing a Client lazily (no storage or network) and
+eagerly (a token refresh against ecobee.fakeserver, which answers
+locally, so a real refresh round trip costs more), and the whole process
+from start to exit.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ecobee.fakeserver import FakeEcobee
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# run in a fresh interpreter, prints import and construction seconds
+SCRIPT = """
+import datetime, json, sys, time
+start = time.perf_counter()
+import ecobee
+imported = time.perf_counter()
+tokens = json.loads(sys.argv[1])
+tokens.update(required=False, expiration=datetime.datetime.now() + datetime.timedelta(hours=1))
+eapi = ecobee.Client('fakekey', authstore=ecobee.MemoryTokenStore(tokens),
+                     url_base=sys.argv[2], lazy=sys.argv[3] == 'lazy')
+constructed = time.perf_counter()
+print(imported - start, constructed - imported)
+"""
+
+
+def run(server, mode):
+    """(process, import, construction) seconds of one fresh interpreter"""
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT, json.dumps(server.issue_tokens()), server.url, mode], cwd=ROOT)
+    elapsed = time.perf_counter() - start
+    imported, constructed = (float(v) for v in output.split())
+    return elapsed, imported, constructed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10, help='interpreters to start for each mode')
+    args = parser.parse_args()
+
+    with FakeEcobee() as server:
+        for mode in ('lazy', 'eager'):
+            times = list(zip(*(run(server, mode) for _ in range(args.repeat))))
+            print('{:<6} process {:>7.1f} ms  import {:>7.1f} ms  construct {:>7.1f} ms  (medians)'.format(
+                mode, *(statistics.median(t) * 1000 for t in times)))
+        print('token requests: {}'.format(server.calls[('POST', 'token')]))
+
+
+if __name__ == '__main__':
+    main()
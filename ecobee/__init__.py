@@ -5,14 +5,33 @@ A simple library to talk to an Ecobee (https://www.ecobee.com) thermostat.
 
 __author__ = 'Michael Stella <ecobee@thismetalsky.org>'
 
+import collections
+import concurrent.futures
 import datetime
-import json
+import functools
 import logging
 import requests
 import os
-import shelve
-
+import threading
+import time
+import urllib.parse
+import urllib3
+
+from ecobee import reports, state
+from ecobee.changes import Change, diff_status
+from ecobee.codec import Payload, get as get_codec
+from ecobee.commands import CommandQueue
+from ecobee.fleet import Fleet
+from ecobee.history import History, RingBuffer
+from ecobee.metrics import Observer, Metrics
 from ecobee.objects import Thermostat
+from ecobee.ratelimit import RateLimiter
+from ecobee.registry import ThermostatRegistry
+from ecobee.reportstore import ReportStore
+from ecobee.snapshot import ThermostatSnapshot
+from ecobee.retry import RetryPolicy, CircuitBreaker, NO_RETRY
+from ecobee.tokenstore import TokenStore, MemoryTokenStore, ShelveTokenStore, SQLiteTokenStore
+from ecobee.transport import Transport, LatencyTracker, hedged, wire_size
 
 APIVERSION = '1'
 REPORT_COLUMNS = (
@@ -27,39 +46,154 @@ REPORT_COLUMNS = (
 STATUS_SECTIONS = ('device', 'equipmentStatus', 'events', 'runtime',
                    'remoteSensors', 'program', 'settings',
 )
+# sections fetched by update() unless asked otherwise
+DEFAULT_SECTIONS = ('device', 'equipmentStatus', 'runtime', 'remoteSensors', 'settings')
+# /thermostat selection flag for each section
+SECTION_INCLUDES = {
+    'device':           'includeDevice',
+    'equipmentStatus':  'includeEquipmentStatus',
+    'events':           'includeEvents',
+    'runtime':          'includeRuntime',
+    'remoteSensors':    'includeSensors',
+    'program':          'includeProgram',
+    'settings':         'includeSettings',
+}
+# revisions in the /thermostatSummary revisionList, in order after
+# identifier, name and connected, and the sections each one covers
+REVISION_SECTIONS = (
+    ('thermostat',  ('device', 'events', 'program', 'settings')),
+    ('alerts',      ()),
+    ('runtime',     ('equipmentStatus', 'runtime', 'remoteSensors')),
+    ('interval',    ('runtime', 'remoteSensors')),
+)
 UNITS_F = '°F'
 UNITS_C = '°C'
 
+# max thermostats the API returns per /thermostat page
+THERMOSTAT_PAGE_SIZE = 25
+# default size of the worker pool for parallel requests
+DEFAULT_WORKERS = 4
+# default seconds a /thermostatSummary result is shared between callers
+DEFAULT_SUMMARY_TTL = 10
+# most days and thermostats the API allows in one /runtimeReport
+REPORT_MAX_DAYS = 31
+REPORT_MAX_THERMOSTATS = 25
+# days of runtime report before today that may still change
+REPORT_MUTABLE_DAYS = 1
+# HTTP status codes that are always worth a retry
+RETRY_HTTP_CODES = (502, 503, 504)
+# Ecobee status codes worth a retry: 3 = processing error
+RETRY_STATUS_CODES = (3,)
+# HTTP status codes after which a POST wasn't applied, so it's safe
+# to retry: the others might have changed the thermostat already
+RETRY_POST_HTTP_CODES = (503,)
+# idempotent reads that may be hedged, and when: after this percentile
+# of recent latency, once there are enough samples to know it
+HEDGE_ENDPOINTS = ('thermostatSummary', 'thermostat')
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+# request payloads kept encoded, to send again without encoding them,
+# plus one for each page of thermostats so a whole update fits
+PAYLOAD_CACHE_SIZE = 256
+
 
 class EcobeeException(Exception):
     """Ecobee error"""
     pass
 
 
+class CircuitOpenException(EcobeeException):
+    """Requests to this endpoint are failing, not sending any more for now"""
+    pass
+
+
+class TimeoutException(EcobeeException):
+    """Ran out of time"""
+    pass
+
+
 class Client(object):
     """Ecobee thermostat.
 
        eapi = ecobee.Client(apikey, themostat_ids)
 
     """
-    def __init__(self, apikey, scope='smartWrite', thermostat_ids=None, authfile=None, authstore=None):
+    # API methods return coroutines
+    is_async = False
+
+    def __init__(self, apikey, scope='smartWrite', thermostat_ids=None, authfile=None, authstore=None,
+                 transport=None, workers=DEFAULT_WORKERS, summary_ttl=DEFAULT_SUMMARY_TTL,
+                 rate_limit=None, executor=None, report_store=None, lazy=False, retry=None,
+                 hedge=False, compact=False, url_base=None, observer=None, codec=None,
+                 history=None):
         """
           apikey:         your API key in the 'Developer' panel on ecobee.com
           scope:          Default: smartWrite
           thermostat_ids: IDs of your thermostats, otherwise discover
           authfile:       Store authentication in this shelve file.
                           Default=$HOME/.config/ecobee
-          authstore:      Provide your own dict-like authentication cache store
+          authstore:      Provide your own ecobee.TokenStore, or dict-like
+                          authentication cache store
+          transport:      ecobee.Transport to send requests with, may be shared
+                          between clients.  Default: a new pooled Transport
+          workers:        max parallel requests for large updates
+          executor:       concurrent.futures executor for parallel requests,
+                          may be shared.  Default: a pool of 'workers' threads
+          report_store:   ecobee.ReportStore to keep runtime reports in, so
+                          past days are only fetched once
+          lazy:           don't touch the authentication store or the network
+                          until the first API call, and keep using the cached
+                          access token until it expires
+          retry:          ecobee.RetryPolicy for failed requests.
+                          Default: ecobee.RetryPolicy()
+          hedge:          for reads in HEDGE_ENDPOINTS, send a second request
+                          if the first is slow: True to wait for the 95th
+                          percentile of recent latency, or seconds to wait
+          compact:        keep thermostat status as ecobee.snapshot records,
+                          which take less memory than the decoded JSON
+          codec:          ecobee.codec.Codec for JSON.  Default: the fastest
+                          one installed, see ecobee.codec
+          observer:       ecobee.Observer told about each request, like
+                          ecobee.Metrics
+          history:        ecobee.History to record readings in on each update
+          url_base:       API server to use, like ecobee.fakeserver.
+                          Default: https://api.ecobee.com/
+          summary_ttl:    seconds that poll() and thermostatSummary() callers
+                          share one /thermostatSummary call, 0 to disable
+          rate_limit:     max API requests per second, or an ecobee.RateLimiter
+                          to share with other clients.  Default: unlimited
 
         """
 
         self.log = logging.getLogger(__name__)
         self.scope = scope
         self.apikey = apikey
-        self.thermostat_ids = []
+        self.transport = transport or Transport()
+        self.workers = workers
+        self._executor = executor
+        if rate_limit and not isinstance(rate_limit, RateLimiter):
+            rate_limit = RateLimiter(rate_limit)
+        self.rate_limiter = rate_limit
+        self.report_store = report_store
+        self.compact = compact
+        self.observer = observer
+        self.history = history
+        self.codec = codec or get_codec()
+        # key to Payload, least recently used first
+        self._payloads = collections.OrderedDict()
+        self._payloads_lock = threading.Lock()
+        self.retry = retry or RetryPolicy()
+        # endpoint to circuit breaker
+        self._breakers = {}
+        # endpoint to LatencyTracker, for hedging
+        self.hedge = hedge
+        self._latencies = {}
+        self._hedge_pool = None
+        self.thermostat_ids = ThermostatRegistry()
 
         # Map of most recent data
         self._status = {}
+        self._status_lock = threading.RLock()
 
         if thermostat_ids:
             if isinstance(thermostat_ids, list):
@@ -68,32 +202,85 @@ class Client(object):
                 self.thermostat_ids = [thermostat_ids]
 
             # make sure we have strings here
-            self.thermostat_ids = list(str(tid) for tid in self.thermostat_ids)
+            self.thermostat_ids = (str(tid) for tid in self.thermostat_ids)
 
             # setup the stats
             for tid in self.thermostat_ids:
                 self._status[tid] = {}
 
-        self.url_base = 'https://api.ecobee.com/'
+        self.url_base = url_base or 'https://api.ecobee.com/'
         self.url_api = self.url_base + APIVERSION + '/{endpoint}'
 
         # Map of thermostat ID to the last revision seen.
         self.lastSeen = {}
 
-        # setup authentication storage
-        self.auth = {}
-        # use provided authentiation
-        if authstore:
-            self.auth = authstore
-        # use shelve - this is not thread safe!
-        else:
-            if authfile:
-                self.auth = shelve.open(authfile)
-            else:
-                self.auth = shelve.open(os.path.join(os.getenv('HOME'), '.config', 'ecobee'))
+        # most recent summary, shared for summary_ttl seconds, the poll()
+        # result for it, and the update_changed() sections done for it
+        self.summary_ttl = summary_ttl
+        self._summary = None
+        self._summary_time = 0
+        self._summary_lock = threading.RLock()
+        self._polled = (None, [], {})
+        self._delivered = None
+        self._changed = (None, {})
+
+        # Map of thermostat ID to the summary revisions of each
+        # section in _status, for update_incremental()
+        self.revisions = {}
+
+        # callables and queues given Changes after each update
+        self._listeners = []
+
+        # setup authentication storage, opened on first use
+        self._auth = None
+        # (token_type, access_token, expiration) read from the store, kept
+        # until it expires or is replaced, so requests don't lock the store
+        self._token = None
+        self._authfile = authfile
+        self._authstore = authstore
 
         # authorize on start
-        self.authorize_refresh(force=True)
+        if not lazy:
+            self.authorize_refresh(force=True)
+
+
+    @property
+    def auth(self):
+        """Authentication token store"""
+        if self._auth is None:
+            self._auth = self._open_authstore()
+        return self._auth
+
+    @auth.setter
+    def auth(self, store):
+        self._auth = store
+        self._token = None
+
+
+    @property
+    def thermostat_ids(self):
+        """IDs of known thermostats, an ecobee.registry.ThermostatRegistry"""
+        return self._thermostat_ids
+
+    @thermostat_ids.setter
+    def thermostat_ids(self, ids):
+        if not isinstance(ids, ThermostatRegistry):
+            ids = ThermostatRegistry(ids)
+        self._thermostat_ids = ids
+
+
+    def _open_authstore(self):
+        """Open the authentication store given to the constructor"""
+        # use provided authentiation
+        if isinstance(self._authstore, TokenStore):
+            return self._authstore
+        if self._authstore:
+            return MemoryTokenStore(self._authstore)
+
+        # use shelve, locked for each access
+        if self._authfile:
+            return ShelveTokenStore(self._authfile)
+        return ShelveTokenStore(os.path.join(os.getenv('HOME'), '.config', 'ecobee'))
 
 
     @property
@@ -125,10 +312,13 @@ class Client(object):
             return
 
         result = response.json()
-        self.auth['access_token'] = result['code']
-        self.auth['token_type'] = 'authorize'
-        self.auth['expiration'] = datetime.datetime.now() + datetime.timedelta(minutes=int(result['expires_in']))
-        self.auth['refresh_token'] = None
+        self.auth.update({
+            'access_token':  result['code'],
+            'token_type':    'authorize',
+            'expiration':    datetime.datetime.now() + datetime.timedelta(minutes=int(result['expires_in'])),
+            'refresh_token': None,
+        })
+        self._token = None
 
         self.log.info("""Please log onto the ecobee web portal, log in, select the menu
 in the top right (3 lines), and select MY APPS.
@@ -150,6 +340,7 @@ You have {expiry} minutes.
         # hah, timed out, try again.
         if datetime.datetime.now() > self.auth['expiration']:
             self.auth['access_token'] = None
+            self._token = None
             return self.authorize_start()
 
         self.log.info("Finalizing authorization")
@@ -161,26 +352,67 @@ You have {expiry} minutes.
         self._authorize_update(response)
 
 
-    def authorize_refresh(self, force=False):
-        """Refresh authorization"""
+    def authorize_refresh(self, force=False, stale=None):
+        """Refresh authorization.
 
-        # no refresh token means we go authorize
-        if not self.auth.get('refresh_token'):
-            self.log.info("No refresh token, authorizing.")
-            self.auth.token_type = None
-            return self.authorize_start()
+        Only one thread or process refreshes at a time, the others wait
+        and then use the new token.
+
+          force:  refresh even if the token hasn't expired
+          stale:  the access token that was rejected, if another caller
+                  has already replaced it there's nothing to do
+        """
 
         # don't refresh if not yet expired
-        if not force and ('expiration' in self.auth and
-                          self.auth['expiration'] > datetime.datetime.now()):
+        if not force and self._token_valid():
             return
 
-        self.log.info("refreshing authorization")
-        response = self._raw_post('token',
-                                  grant_type = 'refresh_token',
-                                  code       = self.auth['refresh_token'],
-                                  client_id  = self.apikey)
-        self._authorize_update(response)
+        if stale is None:
+            stale = self._access_token()[1]
+
+        with self.auth.lock():
+            # read it again, another process may have refreshed it
+            self._token = None
+
+            # no refresh token means we go authorize
+            if not self.auth.get('refresh_token'):
+                self.log.info("No refresh token, authorizing.")
+                self.auth['token_type'] = None
+                self._token = None
+                return self.authorize_start()
+
+            # someone else refreshed while we waited
+            if self._access_token()[1] != stale and self._token_valid():
+                return
+            if not force and self._token_valid():
+                return
+
+            self.log.info("refreshing authorization")
+            start = time.monotonic()
+            response = self._raw_post('token',
+                                      grant_type = 'refresh_token',
+                                      code       = self.auth['refresh_token'],
+                                      client_id  = self.apikey)
+            if self.observer is not None:
+                self.observer.refresh(time.monotonic() - start, response.ok)
+            self._authorize_update(response)
+
+
+    def _token_valid(self):
+        """Is there an access token that hasn't expired?"""
+        token_type, access_token, expiration = self._access_token()
+        return bool(access_token and expiration and expiration > datetime.datetime.now())
+
+
+    def _access_token(self):
+        """(token_type, access_token, expiration), read from the store
+        under one lock the first time and after it's changed"""
+        token = self._token
+        if token is None:
+            with self.auth.lock():
+                token = self._token = (self.auth.get('token_type'), self.auth.get('access_token'),
+                                       self.auth.get('expiration'))
+        return token
 
 
     def _authorize_update(self, response):
@@ -193,84 +425,393 @@ You have {expiry} minutes.
 
         result = response.json()
 
-        self.auth["access_token"]  = result["access_token"]
-        self.auth["token_type"]    = result["token_type"]
-        self.auth["refresh_token"] = result["refresh_token"]
-        self.auth["expiration"]    = datetime.datetime.now() + datetime.timedelta(minutes=int(result["expires_in"]))
-        self.auth["required"]      = False
+        self.auth.update({
+            "access_token":  result["access_token"],
+            "token_type":    result["token_type"],
+            "refresh_token": result["refresh_token"],
+            "expiration":    datetime.datetime.now() + datetime.timedelta(minutes=int(result["expires_in"])),
+            "required":      False,
+        })
+        self._token = None
 
 
-    def thermostatSummary(self):
-        """Summary of available thermostats.  Calls API endpoint /thermostatSummary """
+    def thermostatSummary(self, max_age=None, timeout=None, deadline=None):
+        """Summary of available thermostats.  Calls API endpoint /thermostatSummary
 
-        data = self.get("thermostatSummary", {
-                            "selection": {
-                                "selectionType": "registered",
-                                "selectionMatch": "",
-                            }
-                        })
+        max_age:    reuse a summary up to this many seconds old,
+                    default is summary_ttl
+        timeout:    give up after this many seconds, including retries
+        deadline:   give up at this time.monotonic() time
+        """
+        deadline = self._deadline(timeout, deadline)
+
+        # nothing to share, don't wait on other callers
+        if not self._summary_max_age(max_age):
+            return self._summary_result(self.get(*self._summary_request(), deadline=deadline))
+
+        # one caller fetches, the rest wait and share the result
+        with self._summary_lock:
+            data = self._cached_summary(max_age)
+            if data is None:
+                data = self._summary_result(self.get(*self._summary_request(), deadline=deadline))
+            return data
+
+
+    def _summary_max_age(self, max_age=None):
+        """Seconds a summary may be reused for, summary_ttl by default"""
+        return self.summary_ttl if max_age is None else max_age
+
+
+    def _cached_summary(self, max_age=None):
+        """Return the last summary if it is recent enough"""
+        max_age = self._summary_max_age(max_age)
+        if self._summary is not None and time.monotonic() - self._summary_time < max_age:
+            return self._summary
+
+
+    def _summary_request(self):
+        """Endpoint and data for thermostatSummary()"""
+        return "thermostatSummary", self._payload(('thermostatSummary',), lambda: {
+            "selection": {
+                "selectionType": "registered",
+                "selectionMatch": "",
+            }
+        })
+
+
+    def _summary_result(self, data):
+        """Handle the response from /thermostatSummary"""
 
         # might not have got a useful response,
         # like when we have to refresh authentication
         if not data:
             return
 
+        self._summary = data
+        self._summary_time = time.monotonic()
+
         # go through the returned thermostat IDs and add
         # to the list we've cached if we haven't seen
         # them before
-        for row in data['revisionList']:
-            tid = row.split(':', 1)[0]
-            if tid not in self.thermostat_ids:
-                self.thermostat_ids.append(tid)
-                self._status[tid] = {}
+        with self._status_lock:
+            for row in data['revisionList']:
+                tid, name = row.split(':', 2)[:2]
+                if self.thermostat_ids.add(tid):
+                    self._status[tid] = {}
+                self.thermostat_ids.set_name(tid, name)
 
         return data
 
 
-    def update(self, thermostat_ids=None, includeProgram=False, includeEvents=False):
-        """Update cached info about the thermostats.  Calls API endpoint /thermostat """
+    def update(self, thermostat_ids=None, includeProgram=False, includeEvents=False, sections=None,
+               timeout=None):
+        """Update cached info about the thermostats.  Calls API endpoint /thermostat
+
+        sections:   only fetch these parts of STATUS_SECTIONS, and merge them
+                    into the cached data, eg: ['runtime', 'remoteSensors']
+        timeout:    give up after this many seconds, for all requests
+
+        Returns the IDs of the thermostats updated, which leaves out any
+        whose request got no answer, like when authentication has to
+        start again.
+        """
+        deadline = self._deadline(timeout)
 
         # none specified, use them all
         if not thermostat_ids:
             # no ids means we have to go fetch them
             if not self.thermostat_ids:
-                self.thermostatSummary()
+                self.thermostatSummary(deadline=deadline)
             thermostat_ids = self.thermostat_ids
 
-        elif not isinstance(thermostat_ids, list):
+        if not isinstance(thermostat_ids, list):
             thermostat_ids = [thermostat_ids]
 
+        sections, merge = self._sections(sections, includeProgram, includeEvents)
+        return self._fetch_thermostats(thermostat_ids, sections, merge=merge, deadline=deadline)
+
+
+    def _sections(self, sections=None, includeProgram=False, includeEvents=False):
+        """Sections to fetch for update(), and whether to merge them
+        into the cached data"""
+
+        if sections:
+            unknown = set(sections) - set(STATUS_SECTIONS)
+            if unknown:
+                raise ValueError("unknown sections: {}".format(', '.join(sorted(unknown))))
+            sections = list(sections)
+            merge = True
+        else:
+            sections = list(DEFAULT_SECTIONS)
+            merge = False
+
+        if includeProgram and 'program' not in sections:
+            sections.append('program')
+        if includeEvents and 'events' not in sections:
+            sections.append('events')
+
+        return sections, merge
+
+
+    def update_incremental(self, sections=None):
+        """Update only the sections of each thermostat whose revision
+        has changed since it was last fetched.  Thermostats not seen
+        before get the default sections.
+
+        sections:   only consider these sections, see update()
+
+        Returns a list of the updated thermostat IDs.  This also
+        counts as a poll() of the thermostats it updated.
+        """
+        with self._summary_lock:
+            summary = self.thermostatSummary()
+            self._poll_result(summary)
+            polled = self._polled[2]
+
+        plan, revisions = self._incremental_plan(summary, sections)
+        fetched = []
+        try:
+            for sections, thermostat_ids in plan.items():
+                fetched.extend(self._fetch_thermostats(thermostat_ids, sections, merge=True))
+        except BaseException:
+            self._unpoll(polled)
+            raise
+        return self._incremental_done(revisions, fetched, polled)
+
+
+    def _incremental_plan(self, summary, sections=None):
+        """Find the sections that need updating for each thermostat.
+
+        Returns a dict of sections to thermostat IDs, and the
+        revisions to record once they have been fetched.
+        """
+        plan = {}
+        revisions = {}
+        if not summary:
+            return plan, revisions
+
+        wanted = self._sections(sections)[0]
+
+        for row in summary.get('revisionList', []):
+            parts = row.split(':')
+            tid = parts[0]
+            current = dict(zip((name for name, _ in REVISION_SECTIONS), parts[3:]))
+            previous = self.revisions.get(tid, {})
+
+            # a section's revision is that of every revision covering it
+            fetch = {}
+            for section in wanted:
+                revision = tuple(current.get(name) for name, covers in REVISION_SECTIONS
+                                 if section in covers)
+                if previous.get(section) != revision:
+                    fetch[section] = revision
+
+            if fetch:
+                plan.setdefault(tuple(fetch), []).append(tid)
+                revisions[tid] = fetch
+
+        return plan, revisions
+
+
+    def _incremental_done(self, revisions, fetched, polled):
+        """Record the revisions of the thermostats an incremental update
+        fetched.  Those it didn't get are tried again next time, and
+        found again by the next poll."""
+        updated = []
+        for tid in fetched:
+            if tid in revisions:
+                self.revisions.setdefault(tid, {}).update(revisions[tid])
+                updated.append(tid)
+
+        fetched = set(fetched)
+        self._unpoll(dict((tid, revision) for tid, revision in polled.items() if tid not in fetched))
+        return updated
+
+
+    def _fetch_thermostats(self, thermostat_ids, sections, merge=False, deadline=None):
+        """Fetch the given sections for the thermostats and store them.
+        Returns the IDs of the ones stored, which may be fewer if a
+        request got no answer."""
+
         self.log.info("Updating IDs {}".format(thermostat_ids))
 
-        data = self.get("thermostat", {
-            "selection": {
+        # fetch in API-sized chunks, all pages of each, in parallel
+        selections = list(self._update_request(chunk, sections)
+                          for chunk in self._chunks(thermostat_ids, THERMOSTAT_PAGE_SIZE))
+        results = self._map(lambda req: self._get_pages(*req, deadline=deadline), selections)
+
+        # store them all at once
+        thermostats = []
+        for result in results:
+            thermostats.extend(result)
+        return self._update_result({'thermostatList': thermostats}, merge=merge)
+
+
+    def _update_request(self, thermostat_ids, sections=DEFAULT_SECTIONS):
+        """Endpoint and data for update()"""
+
+        if not isinstance(thermostat_ids, list):
+            thermostat_ids = [thermostat_ids]
+
+        def build():
+            selection = {
                 "selectionType":  "thermostats",
                 "selectionMatch": ":".join(thermostat_ids),
-                "includeEquipmentStatus":   True,
-                "includeDevice":            True,
-                "includeSettings":          True,
-                "includeRuntime":           True,
-                'includeSensors':           True,
-                "includeProgram":           includeProgram,
-                "includeEvents":            includeEvents,
             }
-        })
+            for section in STATUS_SECTIONS:
+                selection[SECTION_INCLUDES[section]] = section in sections
+            return {"selection": selection}
+
+        return "thermostat", self._payload(('thermostat', tuple(thermostat_ids), tuple(sections)), build)
+
+
+    def _update_result(self, data, merge=False, record=True):
+        """Store the response from /thermostat.  With merge, the
+        returned sections replace those already stored.  Without
+        record, the readings aren't added to the history.
+
+        Returns the IDs of the thermostats stored."""
+
+        status = {}
         for thermostat in data['thermostatList']:
 
+            if self.compact:
+                thermostat = ThermostatSnapshot(thermostat)
+
             # remap the sensors as a dict
-            sensors = {}
-            for sensor in thermostat['remoteSensors']:
-                sensors[sensor['id']] = sensor
-            thermostat['remoteSensors'] = sensors
+            elif 'remoteSensors' in thermostat:
+                sensors = {}
+                for sensor in thermostat['remoteSensors']:
+                    sensors[sensor['id']] = sensor
+                thermostat['remoteSensors'] = sensors
+
+            status[thermostat['identifier']] = thermostat
+            self.thermostat_ids.set_name(thermostat['identifier'], thermostat.get('name'))
+
+        # store it
+        with self._status_lock:
+            if merge:
+                for tid, thermostat in status.items():
+                    old = self._status.get(tid)
+                    if isinstance(old, ThermostatSnapshot):
+                        status[tid] = old.merge(thermostat)
+                    elif not self.compact:
+                        merged = dict(old or {})
+                        merged.update(thermostat)
+                        status[tid] = merged
+
+            changes = []
+            if self._listeners:
+                for tid, thermostat in status.items():
+                    changes.extend(diff_status(tid, self._status.get(tid), thermostat))
+            self._status.update(status)
+
+        if record and self.history is not None:
+            self.history.record(status)
+        self._notify(changes)
+        return list(status)
+
+
+    def subscribe(self, listener):
+        """Report field-level changes found by each update, see
+        ecobee.changes.  listener is called with each Change, or can be
+        a queue.Queue to put them on.  Called from the thread that did
+        the update."""
+        self._listeners.append(listener)
+        return listener
+
+
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+
+
+    def _notify(self, changes):
+        """Send changes to the listeners"""
+        for listener in list(self._listeners) if changes else ():
+            send = getattr(listener, 'put_nowait', listener)
+            for change in changes:
+                try:
+                    send(change)
+                except Exception:
+                    self.log.exception("change listener failed")
+
+
+    def _get_pages(self, endpoint, data, deadline=None):
+        """GET all pages of a paged list of thermostats"""
+
+        thermostats = []
+        page = 1
+        while True:
+            if page > 1:
+                data = dict(data, page={'page': page})
+
+            result = self.get(endpoint, data, deadline=deadline)
+            # no answer, like when authentication has to start again
+            if not result:
+                return thermostats
+            thermostats.extend(result['thermostatList'])
+
+            total = result.get('page', {}).get('totalPages', 1)
+            if page >= total:
+                return thermostats
+            page += 1
+
+
+    @staticmethod
+    def _chunks(items, size):
+        """Split a list into lists of at most 'size' items"""
+        return list(items[i:i + size] for i in range(0, len(items), size))
+
+
+    def _map(self, func, items):
+        """map() over the worker pool, in order.  Runs in this
+        thread when there's only one item."""
+
+        items = list(items)
+        if len(items) <= 1 or self.workers <= 1:
+            return list(map(func, items))
+
+        return list(self.executor.map(func, items))
+
+
+    def _imap(self, func, items):
+        """Like _map(), but yield results in order as they're ready,
+        with at most 'workers' items in progress"""
+
+        items = list(items)
+        if len(items) <= 1 or self.workers <= 1:
+            yield from map(func, items)
+            return
 
-            # store it
-            self._status[thermostat['identifier']] = thermostat
+        pending = collections.deque()
+        for item in items:
+            pending.append(self.executor.submit(func, item))
+            if len(pending) >= self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
-    def runtimeReport(self, thermostat_ids=None, start_date=None, includeSensors=False, columns=[]):
+    @property
+    def executor(self):
+        """Worker pool for parallel requests"""
+        if self._executor is None:
+            with self._status_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+
+    def runtimeReport(self, thermostat_ids=None, start_date=None, includeSensors=False, columns=[],
+                      end_date=None, timeout=None):
         """ Get a full runtime report. Calls API endpoint /runtimeReport
 
-        start_date defaults to 1 day ago.
+        start_date defaults to 1 day ago, end_date defaults to today.
+        timeout gives up after that many seconds, for all requests.
+
+        Long date ranges and many thermostats are split into requests
+        the API allows, which are fetched in parallel and put back
+        together in order of thermostat, then date.
 
         Date/time is in thermostat time,  Temps are in Fahrenheit.
 
@@ -287,17 +828,205 @@ You have {expiry} minutes.
            sensorList
 
         """
+        deadline = self._deadline(timeout)
+        if self.report_store is not None:
+            return self._stored_report(thermostat_ids, start_date, end_date, includeSensors, columns, deadline)
+
+        chunks = self._report_chunks(thermostat_ids, start_date, end_date, includeSensors, columns)
+        if len(chunks) == 1:
+            return self.get(*chunks[0], deadline=deadline)
+
+        return self._report_merge(self._map(lambda req: self.get(*req, deadline=deadline), chunks))
+
+
+    def _stored_report(self, thermostat_ids=None, start_date=None, end_date=None,
+                       includeSensors=False, columns=[], deadline=None):
+        """runtimeReport() using the report store: fetch the days that
+        are missing or may have changed, then read it all from the store"""
+
+        if not thermostat_ids:
+            thermostat_ids = self.thermostat_ids
+        elif not isinstance(thermostat_ids, list):
+            thermostat_ids = [thermostat_ids]
+        if not columns:
+            columns = REPORT_COLUMNS
+
+        today = datetime.date.today()
+        if not end_date:
+            end_date = today
+        if not start_date:
+            start_date = end_date - datetime.timedelta(days=1)
+        mutable = today - datetime.timedelta(days=REPORT_MUTABLE_DAYS)
+
+        missing = self.report_store.missing(thermostat_ids, start_date, end_date, columns,
+                                            includeSensors, mutable=mutable)
+
+        # thermostats missing the same dates can be fetched together
+        groups = collections.OrderedDict()
+        for tid, dates in missing.items():
+            if dates:
+                groups.setdefault(tuple(self._date_ranges(dates)), []).append(tid)
+
+        chunks = []
+        for ranges, tids in groups.items():
+            for start, end in ranges:
+                chunks.extend(self._report_chunks(tids, start, end, includeSensors, columns))
+
+        def fetch(req):
+            endpoint, data = req
+            result = self.get(endpoint, data, deadline=deadline)
+            self.report_store.add(result,
+                                  thermostat_ids  = data['selection']['selectionMatch'].split(':'),
+                                  columns         = columns,
+                                  includeSensors  = includeSensors,
+                                  complete_before = mutable)
+            return result
+
+        # no answers, like when authentication has to start again
+        if chunks and not any(self._map(fetch, chunks)):
+            return
+
+        return self.report_store.report(thermostat_ids, start_date, end_date, columns, includeSensors)
+
+
+    @staticmethod
+    def _date_ranges(dates):
+        """Contiguous (start, end) ranges of a sorted list of dates"""
+        ranges = []
+        for date in dates:
+            if ranges and ranges[-1][1] + datetime.timedelta(days=1) == date:
+                ranges[-1][1] = date
+            else:
+                ranges.append([date, date])
+        return list(tuple(r) for r in ranges)
+
+
+    def runtimeReportRows(self, thermostat_ids=None, start_date=None, columns=[], sensors=False,
+                          end_date=None):
+        """Get a runtime report, yielding a typed row for each interval
+        of each thermostat.  See runtimeReport().
+
+        sensors:    yield ecobee.reports.SensorRow from the sensorList,
+                    instead of ecobee.reports.ReportRow from the reportList
+
+        Rows come in order of thermostat, then date, like runtimeReport().
+        Long reports are fetched REPORT_MAX_THERMOSTATS thermostats at a
+        time, so only the rows of those are held in memory at once.
+        """
+        if self.report_store is not None:
+            # not runtimeReport(), which AsyncClient makes a coroutine
+            data = self._stored_report(thermostat_ids, start_date, end_date, sensors, columns)
+            yield from self._report_rows(data, sensors)
+            return
+
+        # the date ranges of each batch of thermostats come together
+        chunks = self._report_chunks(thermostat_ids, start_date, end_date, sensors, columns)
+        batch = None
+        pending = []
+        for req, data in zip(chunks, self._imap(lambda req: self.get(*req), chunks)):
+            match = req[1]['selection']['selectionMatch']
+            if match != batch and pending:
+                yield from self._report_rows(self._report_merge(pending), sensors)
+                pending = []
+            batch = match
+            pending.append(data)
+        yield from self._report_rows(self._report_merge(pending), sensors)
+
+
+    @staticmethod
+    def _report_rows(data, sensors=False):
+        """Typed rows of a runtime report, see runtimeReportRows()"""
+        if not data:
+            return iter(())
+        if sensors:
+            return reports.iter_sensor_rows(data)
+        return reports.iter_rows(data)
+
+
+    def _report_chunks(self, thermostat_ids=None, start_date=None, end_date=None,
+                       includeSensors=False, columns=[]):
+        """Split a report into requests the API allows, returns a list of
+        endpoint and data for each."""
+
+        if not thermostat_ids:
+            thermostat_ids = self.thermostat_ids
+        elif not isinstance(thermostat_ids, list):
+            thermostat_ids = [thermostat_ids]
+
+        if not end_date:
+            end_date = datetime.date.today()
+        if not start_date:
+            start_date = end_date - datetime.timedelta(days=1)
+        if start_date > end_date:
+            raise ValueError("start_date is after end_date")
+
+        ranges = []
+        start = start_date
+        while start <= end_date:
+            end = min(end_date, start + datetime.timedelta(days=REPORT_MAX_DAYS - 1))
+            ranges.append((start, end))
+            start = end + datetime.timedelta(days=1)
+
+        return list(self._report_request(chunk, start, includeSensors, columns, end)
+                    for chunk in self._chunks(thermostat_ids, REPORT_MAX_THERMOSTATS)
+                    for start, end in ranges)
+
+
+    @staticmethod
+    def _report_merge(results):
+        """Put the reports for several chunks back together, with each
+        thermostat's rows in date order."""
+
+        results = list(r for r in results if r)
+        if not results:
+            return
+
+        merged = dict(results[0])
+        merged['endDate'] = max(r['endDate'] for r in results)
+        merged['endInterval'] = max(results, key=lambda r: r['endDate']).get('endInterval')
+
+        report = collections.OrderedDict()
+        # thermostat ID to its sensorList entries by column set, so each
+        # thermostat's entries stay together
+        sensors = collections.OrderedDict()
+        for result in results:
+            for row in result.get('reportList', []):
+                tid = row['thermostatIdentifier']
+                if tid not in report:
+                    report[tid] = {'thermostatIdentifier': tid, 'rowCount': 0, 'rowList': []}
+                report[tid]['rowList'].extend(row.get('rowList', []))
+                report[tid]['rowCount'] += row.get('rowCount', len(row.get('rowList', [])))
+
+            for row in result.get('sensorList', []):
+                # the sensors on a thermostat might change over time
+                entries = sensors.setdefault(row['thermostatIdentifier'], collections.OrderedDict())
+                key = tuple(row.get('columns', []))
+                if key not in entries:
+                    entries[key] = dict(row, data=[])
+                entries[key]['data'].extend(row.get('data', []))
+
+        merged['reportList'] = list(report.values())
+        merged['sensorList'] = list(entry for entries in sensors.values() for entry in entries.values())
+        return merged
+
+
+    def _report_request(self, thermostat_ids=None, start_date=None, includeSensors=False, columns=[],
+                        end_date=None):
+        """Endpoint and data for runtimeReport()"""
+
         if not columns:
             columns = REPORT_COLUMNS
 
         if not thermostat_ids:
             thermostat_ids = self.thermostat_ids
 
-        end_date = datetime.date.today()
+        if not end_date:
+            end_date = datetime.date.today()
         if not start_date:
             start_date = end_date - datetime.timedelta(days=1)
 
-        data = {
+        key = ('runtimeReport', tuple(thermostat_ids), start_date, end_date, bool(includeSensors), tuple(columns))
+        return 'runtimeReport', self._payload(key, lambda: {
             'startDate':      start_date.strftime('%Y-%m-%d'),
             'endDate':        end_date.strftime('%Y-%m-%d'),
             'columns':        ','.join(columns),
@@ -306,14 +1035,36 @@ You have {expiry} minutes.
                 "selectionType":  "thermostats",
                 "selectionMatch": ":".join(thermostat_ids),
             }
-        }
-        return self.get('runtimeReport', data)
+        })
+
+
+    def _payload(self, key, build):
+        """Request data for key, kept so it's only encoded once.
+        build() makes it the first time.  The least recently used are
+        dropped to make room."""
+        with self._payloads_lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                return payload
+
+            size = PAYLOAD_CACHE_SIZE + len(self.thermostat_ids) // THERMOSTAT_PAGE_SIZE
+            while len(self._payloads) >= size:
+                self._payloads.popitem(last=False)
+            payload = self._payloads[key] = Payload(build())
+            return payload
 
 
     def resumeProgram(self, thermostat_id):
         """Resumes the program"""
 
-        return self.post('thermostat', {
+        return self.post(*self._resume_request(thermostat_id))
+
+
+    def _resume_request(self, thermostat_id):
+        """Endpoint and data for resumeProgram()"""
+
+        return 'thermostat', {
             "selection": {
                 "selectionType":  "thermostats",
                 "selectionMatch": thermostat_id,
@@ -324,7 +1075,7 @@ You have {expiry} minutes.
                     "resumeAll": True,
                 }
             }]
-        })
+        }
 
 
     def setHold(self, thermostat_id, holdType='nextTransition', holdClimateRef=None,
@@ -334,6 +1085,16 @@ You have {expiry} minutes.
         such as 'hoome', 'away', 'sleep'.
         """
 
+        return self.post(*self._hold_request(thermostat_id, holdType, holdClimateRef,
+                                             heatHoldTemp, coolHoldTemp, holdHours,
+                                             startDate, endDate, startTime, endTime))
+
+
+    def _hold_request(self, thermostat_id, holdType='nextTransition', holdClimateRef=None,
+                      heatHoldTemp=None, coolHoldTemp=None, holdHours=None,
+                      startDate=None, endDate=None, startTime=None, endTime=None):
+        """Endpoint and data for setHold()"""
+
         params = {
             'holdType':     holdType,
         }
@@ -355,8 +1116,8 @@ You have {expiry} minutes.
             else:
                 coolHoldTemp = int(coolHoldTemp * 10)
 
-            params['heatHoldTemp'] = heatHoldTemp,
-            params['coolHoldTemp'] = coolHoldTemp,
+            params['heatHoldTemp'] = heatHoldTemp
+            params['coolHoldTemp'] = coolHoldTemp
 
 
         if holdType == 'holdHours':
@@ -368,7 +1129,7 @@ You have {expiry} minutes.
             params['startTime'] = startTime
             params['endTime']   = endTime
 
-        return self.post('thermostat', {
+        return 'thermostat', {
             "selection": {
                 "selectionType":  "thermostats",
                 "selectionMatch": thermostat_id,
@@ -377,7 +1138,7 @@ You have {expiry} minutes.
                 "type": "setHold",
                 "params": params,
             }]
-        })
+        }
 
 
     def poll(self):
@@ -385,16 +1146,132 @@ You have {expiry} minutes.
         Return a list of thermostat IDs that have been updated since the last poll.
         https://www.ecobee.com/home/developer/api/documentation/v1/operations/get-thermostat-summary.shtml
 
+        Polls within summary_ttl of each other share one summary, and
+        each change is only returned by the first of them.
+
         * NOTE:
             DO NOT poll at an interval quicker than once every 3 minutes,
             which is the shortest interval at which data might change.
         """
-        summary = self.thermostatSummary()
+        with self._summary_lock:
+            return self._deliver(self._poll_result(self.thermostatSummary()))
+
+
+    def update_changed(self, sections=None):
+        """Poll, then update all of the thermostats that changed in one
+        batch.  Callers within the same summary_ttl window share both
+        the poll and the update.
+
+        Returns the list of updated thermostat IDs.  If the update fails,
+        or gets no answer for some of them, those are found again by the
+        next poll.
+        """
+        with self._summary_lock:
+            # not poll(), callers share the changes it has returned
+            updated = self._poll_result(self.thermostatSummary())
+            revisions = self._polled[2]
+            done, first = self._changed_event(sections, concurrent.futures.Future)
+
+        # someone else is updating this poll, wait for them
+        if not first:
+            return done.result()
+
+        try:
+            stored = self.update(updated, sections=sections) if updated else []
+        except BaseException as e:
+            self._update_failed(sections, done, revisions)
+            done.set_exception(e)
+            raise
+        stored = self._update_missed(sections, done, updated, stored, revisions)
+        done.set_result(stored)
+        return stored
+
+
+    def _changed_event(self, sections, factory):
+        """Find the future that's resolved when update_changed() has
+        updated the current poll with these sections, creating it with
+        factory() if needed.  Returns it, and True if it was created."""
+
+        key = tuple(sections or ())
+        summary, events = self._changed
+        if summary is not self._summary:
+            events = {}
+            self._changed = (self._summary, events)
+        if key in events:
+            return events[key], False
+        events[key] = factory()
+        return events[key], True
+
+
+    def _update_failed(self, sections, done, revisions):
+        """update_changed() couldn't update what it polled: put back the
+        revisions the poll replaced, so the next poll finds the same
+        thermostats, and let the next caller try the update again"""
+
+        with self._summary_lock:
+            self._unpoll(revisions)
+
+            key = tuple(sections or ())
+            events = self._changed[1]
+            if events.get(key) is done:
+                del events[key]
+
+
+    def _unpoll(self, revisions):
+        """Put back the lastSeen revisions a poll replaced, for the
+        thermostats in 'revisions' that didn't get updated after all, so
+        the next poll finds them again"""
+        if not revisions:
+            return
+
+        with self._summary_lock:
+            for tid, (old, new) in revisions.items():
+                if self.lastSeen.get(tid) != new:
+                    continue
+                if old is None:
+                    del self.lastSeen[tid]
+                else:
+                    self.lastSeen[tid] = old
+            self._polled = (None, [], {})
+
+
+    def _update_missed(self, sections, done, updated, stored, revisions):
+        """update_changed() got no answer for some of the thermostats it
+        polled: put back their revisions, as if the update had failed.
+        Returns the ones that were updated, in polled order."""
+        stored = set(stored)
+        missed = dict((tid, revisions[tid]) for tid in updated
+                      if tid not in stored and tid in revisions)
+        if missed:
+            self.log.warning("no update for IDs {}".format(list(missed)))
+            self._update_failed(sections, done, missed)
+        return list(tid for tid in updated if tid in stored)
+
+
+    def _deliver(self, updated):
+        """poll()'s answer: the thermostats found by the latest poll,
+        unless poll() has already returned them"""
+        polled = self._polled
+        if polled is self._delivered:
+            return []
+        self._delivered = polled
+        return updated
+
+
+    def _poll_result(self, summary):
+        """Find the updated thermostats in a summary"""
+
         # may not have got a useful response
         if not summary:
             return []
 
+        # already polled this summary, give the same answer
+        if summary is self._polled[0]:
+            return list(self._polled[1])
+
         updated = []
+        # thermostat ID to its (old, new) revision
+        revisions = {}
         if 'revisionList' not in summary:
             self.log.warn("Couldn't find revisionList in the summary output")
             return []
@@ -405,69 +1282,366 @@ You have {expiry} minutes.
             intervalRevision = parts[6]
             if intervalRevision != self.lastSeen.get(identifier):
                 updated.append(identifier)
+                revisions[identifier] = (self.lastSeen.get(identifier), intervalRevision)
                 self.lastSeen[identifier] = intervalRevision
-        return updated
 
+        self._polled = (summary, updated, revisions)
+        return list(updated)
 
-    def get_thermostat(self, thermostat_id):
+
+    def get_thermostat(self, thermostat_id, sections=None):
         """return a Thermostat object for the given thermostat"""
         thermostat_id = str(thermostat_id)
         if not self.thermostat_ids:
-            self.update()
+            self.update(sections=sections)
 
         if thermostat_id in self.thermostat_ids:
-            return Thermostat(self, thermostat_id)
+            return self._thermostat(thermostat_id, sections)
+
+    def get_thermostat_by_name(self, name, sections=None):
+        """return a Thermostat object for the thermostat with this name"""
+        if not self.thermostat_ids.names:
+            self.thermostatSummary()
+
+        tid = self.thermostat_ids.by_name(name)
+        if tid is not None:
+            return self._thermostat(tid, sections)
+
+    def get_thermostats(self, thermostat_ids, sections=None):
+        """return Thermostat objects for the given thermostats, skipping
+        any that aren't known"""
+        if not self.thermostat_ids:
+            self.update(sections=sections)
+
+        return list(self._thermostat(tid, sections)
+                    for tid in (str(t) for t in thermostat_ids)
+                    if tid in self.thermostat_ids)
 
-    def list_thermostats(self):
+    def list_thermostats(self, sections=None):
         """Return list of thermostats"""
         if not self.thermostat_ids:
-            self.update()
+            self.update(sections=sections)
+
+        return list(self._thermostat(tid, sections) for tid in self.thermostat_ids)
+
+    def _thermostat(self, thermostat_id, sections=None):
+        """The Thermostat object for this ID, the same one each time.
+        It's shared, so 'sections' are only its defaults if it's new:
+        other callers asking for other sections don't change them."""
+        objects = self.thermostat_ids.objects
+        thermostat = objects.get(thermostat_id)
+        if thermostat is None:
+            thermostat = objects.setdefault(thermostat_id,
+                                            Thermostat(self, thermostat_id, sections=sections))
+        return thermostat
 
-        return list(Thermostat(self, tid) for tid in self.thermostat_ids)
+
+    def save_state(self, path, format=None):
+        """Save the cached thermostat status, IDs and revisions to a
+        file, see ecobee.state"""
+        state.save(self, path, format)
+
+    def load_state(self, path):
+        """Load what save_state() saved.  Returns False if there was
+        nothing to load."""
+        return state.load(self, path)
 
 
     @property
     def _headers(self):
+        token_type, access_token, expiration = self._access_token()
         return {
             'Content-Type': 'application/json;charset=UTF-8',
-            'Authorization': '{} {}'.format(self.auth['token_type'], self.auth['access_token']),
+            'Authorization': '{} {}'.format(token_type, access_token),
         }
 
 
-    def get(self, endpoint, data):
-        """Ecobee API-specific wrapper for requests.get"""
-        self.authorize_refresh()
+    def get(self, endpoint, data, timeout=None, deadline=None, hedge=None):
+        """Ecobee API-specific wrapper for requests.get
 
-        url = self.url_api.format(endpoint=endpoint)
-        try:
-            r = requests.get(url, params = {'json': json.dumps(data)}, headers=self._headers)
-            if not r.ok:
-                self._handle_error(r)
-            else:
-                return r.json()
+          timeout:    give up after this many seconds, including retries
+          deadline:   give up at this time.monotonic() time
+          hedge:      send a second request if the first is slow, default
+                      is the client's setting.  Only for HEDGE_ENDPOINTS.
 
-        except requests.exceptions.ConnectionError as e:
-            self.log.error(e)
-            raise EcobeeException("Connection error: {}".format(e)) from None
+        Raises TimeoutException when out of time.
+        """
+        return self._request('GET', endpoint, data, self._deadline(timeout, deadline), hedge)
+
+
+    def post(self, endpoint, data, timeout=None, deadline=None):
+        """Ecobee API-specific wrapper for requests.post
+
+          timeout:    give up after this many seconds, including retries
+          deadline:   give up at this time.monotonic() time
+
+        Raises TimeoutException when out of time.
+        """
+        return self._request('POST', endpoint, data, self._deadline(timeout, deadline))
+
+
+    @staticmethod
+    def _deadline(timeout=None, deadline=None):
+        """The earlier of 'timeout' seconds from now and 'deadline'"""
+        if timeout is not None:
+            expires = time.monotonic() + timeout
+            if deadline is None or expires < deadline:
+                return expires
+        return deadline
+
+
+    def _request(self, method, endpoint, data, deadline=None, hedge=None):
+        """Send an API request.
+
+        The request is sent again once after its token is refreshed, and
+        retried with backoff after server and connection errors, as set
+        by the RetryPolicy.  A POST is only retried when it can't have
+        been applied: the connection wasn't made, or the HTTP status is
+        in RETRY_POST_HTTP_CODES.  If the endpoint's circuit breaker is open,
+        raises CircuitOpenException without sending anything.
+        """
+        breaker = self._breaker(endpoint)
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenException("{}: too many failures, not sending requests".format(endpoint))
+
+        try:
+            return self._send(method, endpoint, data, breaker, deadline, hedge)
+        except BaseException:
+            # out of time, or an error that's not the API's: don't leave
+            # a half-open breaker waiting on a trial that's never coming
+            if breaker is not None:
+                breaker.abandon()
+            raise
 
 
-    def post(self, endpoint, data):
-        """Ecobee API-specific wrapper for requests.post"""
-        self.authorize_refresh()
+    def _send(self, method, endpoint, data, breaker, deadline, hedge):
+        """Send a request allowed by the breaker, with retries"""
 
         url = self.url_api.format(endpoint=endpoint)
+        if isinstance(data, Payload):
+            body = data.encode(self.codec)
+        else:
+            body = self.codec.dumps(data)
+        refreshed = False
+        attempt = 0
+
+        hedge_delay = None
+        if method == 'GET' and endpoint in HEDGE_ENDPOINTS:
+            hedge_delay = self._hedge_delay(endpoint, hedge)
+
+        while True:
+            self.authorize_refresh()
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+
+            timeout = self._request_timeout(endpoint, deadline)
+            try:
+                start = time.monotonic()
+                if method == 'GET':
+                    send = functools.partial(self.transport.get, url, params = {'json': body},
+                                             headers=self._headers, timeout=timeout)
+                else:
+                    send = functools.partial(self.transport.post, url, data = body,
+                                             headers=self._headers, timeout=timeout)
+
+                if hedge_delay is not None:
+                    # the hedge counts against the rate limit too, and is
+                    # skipped rather than waited for if there's no room
+                    allow = self.rate_limiter.try_acquire if self.rate_limiter else None
+                    r = hedged(send, hedge_delay, self._hedge_executor, allow)
+                else:
+                    r = send()
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.log.error(e)
+                self._observe(method, endpoint, time.monotonic() - start, None, self._sent(method, body))
+                if breaker is not None:
+                    breaker.failure()
+                if (attempt < self.retry.retries and (method == 'GET' or self._unsent(e))
+                        and (breaker is None or breaker.allow())):
+                    self._observe_retry(endpoint, 'connection')
+                    self._retry_sleep(endpoint, attempt, deadline)
+                    attempt += 1
+                    continue
+                raise EcobeeException("Connection error: {}".format(e)) from None
+
+            elapsed = time.monotonic() - start
+            self._observe(method, endpoint, elapsed, r, self._sent(method, body))
+            if method == 'GET' and r.ok:
+                # the answering copy's own time, not the wait before a
+                # hedge, or slow requests would keep the hedge delay slow
+                self._latency(endpoint).record(
+                    r.elapsed.total_seconds() if hedge_delay is not None else elapsed)
+
+            if r.ok:
+                if breaker is not None:
+                    breaker.success()
+                return self._decode(endpoint, r)
+
+            code = self._status_code(r)
+            if self._retryable(r, code):
+                self.log.warning("{} {}: server error {}".format(method, endpoint, r.status_code))
+                if breaker is not None:
+                    breaker.failure()
+                if (attempt < self.retry.retries
+                        and (method == 'GET' or r.status_code in RETRY_POST_HTTP_CODES)
+                        and (breaker is None or breaker.allow())):
+                    self._observe_retry(endpoint, 'server')
+                    self._retry_sleep(endpoint, attempt, deadline)
+                    attempt += 1
+                    continue
+            elif breaker is not None:
+                # the API is answering, it's the request that's wrong
+                breaker.success()
+
+            self._handle_error(r)
+
+            # send it again with the refreshed token, once
+            if code == 14 and not refreshed:
+                refreshed = True
+                self._observe_retry(endpoint, 'token')
+                continue
+            return
+
+
+    def _decode(self, endpoint, response):
+        """Decode a JSON response"""
+        if self.observer is None:
+            return self.codec.loads(response.content)
+
+        start = time.monotonic()
+        data = self.codec.loads(response.content)
+        self.observer.decode(endpoint, time.monotonic() - start, len(response.content))
+        return data
+
+
+    def _observe(self, method, endpoint, seconds, response, sent):
+        """Tell the observer about a request, response is None if
+        the connection failed"""
+        if self.observer is None:
+            return
+        if response is None:
+            self.observer.request(method, endpoint, seconds, None, sent, 0)
+        else:
+            self.observer.request(method, endpoint, seconds, response.status_code,
+                                  sent, wire_size(response))
+
+
+    def _sent(self, method, body):
+        """Bytes of request data sent, for the observer: the query
+        string of a GET, or the encoded body of a POST"""
+        if self.observer is None:
+            return 0
+        if method == 'GET':
+            return len(urllib.parse.urlencode({'json': body}))
+        return len(body.encode('utf-8'))
+
+
+    def _observe_retry(self, endpoint, reason):
+        if self.observer is not None:
+            self.observer.retry(endpoint, reason)
+
+
+    def _request_timeout(self, endpoint, deadline):
+        """(connect, read) timeouts for one request, so it ends by the deadline"""
+        if deadline is None:
+            return None
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutException("{}: deadline passed".format(endpoint))
+
+        connect, read = self.transport.timeout
+        return (min(connect, remaining), min(read, remaining))
+
+
+    def _retry_sleep(self, endpoint, attempt, deadline):
+        """Wait before a retry, if there's time for it"""
+        delay = self.retry.delay(attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise TimeoutException("{}: deadline passed".format(endpoint))
+        time.sleep(delay)
+
+
+    def _latency(self, endpoint):
+        """Latency tracker for an endpoint"""
+        if endpoint not in self._latencies:
+            with self._status_lock:
+                if endpoint not in self._latencies:
+                    self._latencies[endpoint] = LatencyTracker()
+        return self._latencies[endpoint]
+
+
+    def _hedge_delay(self, endpoint, hedge=None):
+        """Seconds to wait before hedging a request, or None to not hedge"""
+        if hedge is None:
+            hedge = self.hedge
+        if hedge is None or hedge is False:
+            return None
+        if hedge is not True:
+            return float(hedge)
+
+        latency = self._latency(endpoint)
+        if len(latency) < HEDGE_MIN_SAMPLES:
+            return None
+        return latency.percentile(HEDGE_PERCENTILE)
+
+
+    @property
+    def _in_flight(self):
+        """Most requests this client sends at once"""
+        return self.workers
+
+
+    @property
+    def _hedge_executor(self):
+        """Threads for hedged requests, separate from the worker pool
+        since workers send requests themselves.  Two for each request
+        in flight, so a hedge never waits for a thread."""
+        if self._hedge_pool is None:
+            with self._status_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._in_flight * 2)
+        return self._hedge_pool
+
+
+    def _breaker(self, endpoint):
+        """Circuit breaker for an endpoint"""
+        if endpoint not in self._breakers:
+            with self._status_lock:
+                if endpoint not in self._breakers:
+                    self._breakers[endpoint] = self.retry.breaker()
+        return self._breakers[endpoint]
+
+
+    @staticmethod
+    def _status_code(response):
+        """Ecobee status code of an error response, or None"""
         try:
-            r = requests.post(url, data = json.dumps(data), headers=self._headers)
+            return response.json()['status']['code']
+        except (ValueError, KeyError, TypeError):
+            return None
 
-            if not r.ok:
-                self._handle_error(r)
-            else:
-                return r.json()
 
-        except requests.exceptions.ConnectionError as e:
-            self.log.error(e)
-            self.log.error(r.request)
-            raise EcobeeException("Connection error: {}".format(e)) from None
+    @staticmethod
+    def _retryable(response, code):
+        """Is this error worth trying again?"""
+        if response.status_code in RETRY_HTTP_CODES:
+            return True
+        if response.status_code >= 500:
+            return code is None or code in RETRY_STATUS_CODES
+        return False
+
+
+    @staticmethod
+    def _unsent(error):
+        """Did this connection error happen before the request was sent?
+        A POST is only retried if so, since the server may have already
+        applied it and just not answered."""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
 
 
     def _handle_error(self, response):
@@ -476,14 +1650,15 @@ You have {expiry} minutes.
             # code 16 = auth needs refresh
             if data['status']['code'] == 14:
                 self.log.warning("error 14: auth token needs refresh")
-                return self.authorize_refresh(force=True)
+                return self.authorize_refresh(force=True, stale=self._request_token(response))
 
             # code 16 = auth revoked, clear the token and start again
             if data['status']['code'] == 16:
                 self.log.warning("error 16: restarting authentication")
-                self.auth['refresh_token'] = None
-                self.auth['token_type'] = None
-                return self.authorize_start()
+                with self.auth.lock():
+                    self.auth.update({'refresh_token': None, 'token_type': None})
+                    self._token = None
+                    return self.authorize_start()
 
             # otherwise just raise it
             errmsg = '{}: {}'.format(data['status']['code'], data['status']['message'])
@@ -496,23 +1671,43 @@ You have {expiry} minutes.
             raise EcobeeException("Response not JSON: {}".format(response.text)) from None
 
 
+    @staticmethod
+    def _request_token(response):
+        """The access token a request was sent with"""
+        request = getattr(response, 'request', None)
+        if request is None:
+            return None
+        return request.headers.get('Authorization', '').split(' ')[-1] or None
+
+
     def _raw_get(self, endpoint, **kwargs):
         """Mostly-raw GET used for authentication API"""
-        h = {'Content-Type': 'application/json;charset=UTF-8'}
-        url = self.url_base + endpoint
-        try:
-            return requests.get(url, params=kwargs, headers=h)
-        except requests.exceptions.ConnectionError as e:
-            self.log.error(e)
-            raise EcobeeException("Connection error: {}".format(e)) from None
+        return self._raw_request('GET', endpoint, kwargs)
 
 
     def _raw_post(self, endpoint, **kwargs):
         """Mostly-raw POST used for authentication API"""
+        return self._raw_request('POST', endpoint, kwargs)
+
+
+    def _raw_request(self, method, endpoint, params):
         h = {'Content-Type': 'application/json;charset=UTF-8'}
         url = self.url_base + endpoint
+        sent = len(urllib.parse.urlencode(params))
+        start = time.monotonic()
         try:
-            return requests.post(url, params=kwargs, headers=h)
-        except requests.exceptions.ConnectionError as e:
+            response = self.transport.request(method, url, params=params, headers=h)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
             self.log.error(e)
+            self._observe(method, endpoint, time.monotonic() - start, None, sent)
             raise EcobeeException("Connection error: {}".format(e)) from None
+        self._observe(method, endpoint, time.monotonic() - start, response, sent)
+        return response
+
+
+def __getattr__(name):
+    """Import the asyncio client on first use, to keep startup fast"""
+    if name in ('aio', 'AsyncClient'):
+        import ecobee.aio
+        return getattr(ecobee.aio, name) if name == 'AsyncClient' else ecobee.aio
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,329 @@
+# vim: set fileencoding=utf-8
+"""
+asyncio interface to the Ecobee API.
+
+    eapi = ecobee.AsyncClient(apikey)
+    updated = await eapi.poll()
+    await eapi.update(updated)
+
+Requests are run on an executor using the client's pooled Transport, so
+many clients and thermostats can be refreshed concurrently from one
+event loop.  Each client has a pool of 'concurrency' threads, unless
+given an executor: clients sharing one are bounded by its size together.
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=20)
+    clients = [ecobee.AsyncClient(key, executor=pool) for key in apikeys]
+    updated = await ecobee.aio.refresh(clients)
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+
+from ecobee import Client, THERMOSTAT_PAGE_SIZE
+
+
+DEFAULT_CONCURRENCY = 10
+
+
+async def gather_bounded(coros, limit=DEFAULT_CONCURRENCY):
+    """Run the given coroutines with at most 'limit' running at once.
+    Results are returned in the same order as the coroutines."""
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def refresh(clients, limit=DEFAULT_CONCURRENCY):
+    """Poll each AsyncClient and update the thermostats that changed,
+    with at most 'limit' accounts in flight at once.
+
+    Returns a dict of client to list of updated thermostat IDs.
+    """
+    clients = list(clients)
+    results = await gather_bounded((c.refresh() for c in clients), limit)
+    return dict(zip(clients, results))
+
+
+class AsyncClient(Client):
+    """Ecobee API client with coroutine methods.
+
+       eapi = ecobee.AsyncClient(apikey, themostat_ids)
+
+    Methods that send requests are coroutines, see the README for the
+    list.  Thermostat and Sensor objects work the same way as they do
+    with ecobee.Client, except that their update() is awaited.
+    """
+    # API methods return coroutines
+    is_async = True
+
+    def __init__(self, *args, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        """
+          concurrency:    max requests in flight from this client
+
+        All other arguments are the same as ecobee.Client.  Requests
+        run on the client's executor, by default a pool of 'concurrency'
+        threads.
+        """
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._summary_alock = None
+        super().__init__(*args, **kwargs)
+
+
+    @property
+    def _in_flight(self):
+        """Most requests this client sends at once"""
+        return max(self.workers, self.concurrency)
+
+
+    @property
+    def executor(self):
+        """Worker pool for requests, a thread for each one in flight"""
+        if self._executor is None:
+            with self._status_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._in_flight)
+        return self._executor
+
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the executor"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+
+    async def aget(self, endpoint, data, timeout=None, deadline=None):
+        """Coroutine version of Client.get"""
+        return await self._run(self.get, endpoint, data, timeout, deadline)
+
+
+    async def apost(self, endpoint, data):
+        """Coroutine version of Client.post"""
+        return await self._run(self.post, endpoint, data)
+
+
+    async def thermostatSummary(self, max_age=None, timeout=None, deadline=None):
+        """Summary of available thermostats.  See Client.thermostatSummary"""
+        deadline = self._deadline(timeout, deadline)
+
+        # nothing to share, don't wait on other callers
+        if not self._summary_max_age(max_age):
+            return self._summary_result(await self.aget(*self._summary_request(), deadline=deadline))
+
+        if self._summary_alock is None:
+            self._summary_alock = asyncio.Lock()
+
+        # one caller fetches, the rest wait and share the result
+        async with self._summary_alock:
+            data = self._cached_summary(max_age)
+            if data is None:
+                data = self._summary_result(await self.aget(*self._summary_request(), deadline=deadline))
+            return data
+
+
+    async def update(self, thermostat_ids=None, includeProgram=False, includeEvents=False, sections=None,
+                     timeout=None):
+        """Update cached info about the thermostats.  See Client.update"""
+        deadline = self._deadline(timeout)
+
+        if not thermostat_ids:
+            if not self.thermostat_ids:
+                await self.thermostatSummary(deadline=deadline)
+            thermostat_ids = self.thermostat_ids
+
+        if not isinstance(thermostat_ids, list):
+            thermostat_ids = [thermostat_ids]
+
+        sections, merge = self._sections(sections, includeProgram, includeEvents)
+        return await self._fetch_thermostats_async(thermostat_ids, sections, merge=merge, deadline=deadline)
+
+
+    async def update_incremental(self, sections=None):
+        """Update only the sections whose revision has changed.
+        See Client.update_incremental"""
+
+        summary = await self.thermostatSummary()
+        self._poll_result(summary)
+        polled = self._polled[2]
+
+        plan, revisions = self._incremental_plan(summary, sections)
+        try:
+            results = await asyncio.gather(*(
+                self._fetch_thermostats_async(thermostat_ids, sections, merge=True)
+                for sections, thermostat_ids in plan.items()
+            ))
+        except BaseException:
+            self._unpoll(polled)
+            raise
+
+        return self._incremental_done(revisions, [tid for fetched in results for tid in fetched], polled)
+
+
+    async def _fetch_thermostats_async(self, thermostat_ids, sections, merge=False, deadline=None):
+        """Fetch the given sections for the thermostats and store them.
+        Returns the IDs of the ones stored."""
+
+        self.log.info("Updating IDs {}".format(thermostat_ids))
+
+        # fetch in API-sized chunks, all pages of each, concurrently
+        results = await asyncio.gather(*(
+            self._run(self._get_pages, *self._update_request(chunk, sections), deadline)
+            for chunk in self._chunks(thermostat_ids, THERMOSTAT_PAGE_SIZE)
+        ))
+
+        thermostats = []
+        for result in results:
+            thermostats.extend(result)
+        return self._update_result({'thermostatList': thermostats}, merge=merge)
+
+
+    async def runtimeReport(self, thermostat_ids=None, start_date=None, includeSensors=False, columns=[],
+                            end_date=None, timeout=None):
+        """Get a full runtime report. See Client.runtimeReport"""
+        deadline = self._deadline(timeout)
+
+        # the store fetches on the executor itself, so don't tie up a worker
+        if self.report_store is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                self._stored_report, thermostat_ids, start_date, end_date, includeSensors, columns, deadline))
+
+        chunks = self._report_chunks(thermostat_ids, start_date, end_date, includeSensors, columns)
+        if len(chunks) == 1:
+            return await self._run(self.get, *chunks[0], None, deadline)
+
+        return self._report_merge(await asyncio.gather(*(self._run(self.get, *req, None, deadline)
+                                                         for req in chunks)))
+
+
+    async def runtimeReportRows(self, thermostat_ids=None, start_date=None, columns=[], sensors=False,
+                                end_date=None):
+        """Get a runtime report, yielding a typed row for each interval
+        of each thermostat.  See Client.runtimeReportRows
+
+            async for row in eapi.runtimeReportRows():
+        """
+        if self.report_store is not None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, functools.partial(
+                self._stored_report, thermostat_ids, start_date, end_date, sensors, columns))
+            for row in self._report_rows(data, sensors):
+                yield row
+            return
+
+        # the date ranges of each batch of thermostats come together
+        batches = collections.OrderedDict()
+        for req in self._report_chunks(thermostat_ids, start_date, end_date, sensors, columns):
+            batches.setdefault(req[1]['selection']['selectionMatch'], []).append(req)
+
+        for chunks in batches.values():
+            results = await asyncio.gather(*(self._run(self.get, *req) for req in chunks))
+            for row in self._report_rows(self._report_merge(results), sensors):
+                yield row
+
+
+    async def resumeProgram(self, thermostat_id):
+        """Resumes the program"""
+        return await self.apost(*self._resume_request(thermostat_id))
+
+
+    async def setHold(self, thermostat_id, *args, **kwargs):
+        """Set a hold.  See Client.setHold"""
+        return await self.apost(*self._hold_request(thermostat_id, *args, **kwargs))
+
+
+    async def poll(self):
+        """Return a list of thermostat IDs that have been updated since the last poll."""
+        return self._deliver(self._poll_result(await self.thermostatSummary()))
+
+
+    async def update_changed(self, sections=None):
+        """Poll, then update all of the thermostats that changed in one
+        batch.  See Client.update_changed"""
+
+        # not poll(), callers share the changes it has returned
+        updated = self._poll_result(await self.thermostatSummary())
+        revisions = self._polled[2]
+        done, first = self._changed_event(sections, asyncio.get_running_loop().create_future)
+
+        # someone else is updating this poll, wait for them
+        if not first:
+            return await asyncio.shield(done)
+
+        try:
+            stored = await self.update(updated, sections=sections) if updated else []
+        except BaseException as e:
+            self._update_failed(sections, done, revisions)
+            done.set_exception(e)
+            # raised here, don't warn if nobody was waiting
+            done.exception()
+            raise
+        stored = self._update_missed(sections, done, updated, stored, revisions)
+        done.set_result(stored)
+        return stored
+
+
+    async def refresh(self):
+        """Poll, then update the thermostats that changed.
+        Returns the list of updated thermostat IDs, see update_changed()."""
+        return await self.update_changed()
+
+
+    async def save_state(self, path, format=None):
+        """Save the cached status to a file.  See Client.save_state"""
+        return await self._run(super().save_state, path, format)
+
+
+    async def load_state(self, path):
+        """Load what save_state() saved.  See Client.load_state"""
+        return await self._run(super().load_state, path)
+
+
+    async def get_thermostat(self, thermostat_id, sections=None):
+        """return a Thermostat object for the given thermostat"""
+        thermostat_id = str(thermostat_id)
+        if not self.thermostat_ids:
+            await self.update(sections=sections)
+
+        if thermostat_id in self.thermostat_ids:
+            return self._thermostat(thermostat_id, sections)
+
+
+    async def list_thermostats(self, sections=None):
+        """Return list of thermostats"""
+        if not self.thermostat_ids:
+            await self.update(sections=sections)
+
+        return list(self._thermostat(tid, sections) for tid in self.thermostat_ids)
+
+
+    async def get_thermostats(self, thermostat_ids, sections=None):
+        """return Thermostat objects for the given thermostats"""
+        if not self.thermostat_ids:
+            await self.update(sections=sections)
+
+        return list(self._thermostat(tid, sections)
+                    for tid in (str(t) for t in thermostat_ids)
+                    if tid in self.thermostat_ids)
+
+
+    async def get_thermostat_by_name(self, name, sections=None):
+        """return a Thermostat object for the thermostat with this name"""
+        if not self.thermostat_ids.names:
+            await self.thermostatSummary()
+        tid = self.thermostat_ids.by_name(name)
+        if tid is not None:
+            return self._thermostat(tid, sections)
@@ -0,0 +1,97 @@
+# vim: set fileencoding=utf-8
+"""
+Field-level changes between successive thermostat updates.
+
+    def changed(change):
+        print(change.thermostat_id, change.path, change.old, '->', change.new)
+
+    eapi.subscribe(changed)
+    eapi.update()
+
+Each Change has the path of keys to the field in the thermostat's status,
+like ('runtime', 'actualTemperature'), and its old and new values.
+Equipment turning on or off is ('equipmentStatus', name) going from False
+to True or back.  Sensor readings are ('remoteSensors', sensor_id,
+'capability', type), with sensor_id set on the Change, and a sensor
+appearing or going away is ('remoteSensors', sensor_id) from or to None.
+
+Nothing is reported for a thermostat, or a section of one, the first
+time it's fetched.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections.abc
+
+from ecobee.objects import parse_equipment
+
+
+Change = collections.namedtuple('Change', ('thermostat_id', 'sensor_id', 'path', 'old', 'new'))
+
+
+def diff_status(thermostat_id, old, new):
+    """List of Changes from one status entry for a thermostat to the next"""
+    changes = []
+    if not old or old is new:
+        return changes
+
+    for key in new:
+        if key not in old:
+            continue
+        before, after = old[key], new[key]
+        if before is after:
+            continue
+        if key == 'equipmentStatus':
+            _diff_equipment(changes, thermostat_id, before, after)
+        elif key == 'remoteSensors':
+            _diff_sensors(changes, thermostat_id, before, after)
+        else:
+            _diff(changes, thermostat_id, None, (key,), before, after)
+    return changes
+
+
+def _diff(changes, thermostat_id, sensor_id, path, old, new):
+    if old is new:
+        return
+    if isinstance(old, collections.abc.Mapping) and isinstance(new, collections.abc.Mapping):
+        for key in new:
+            _diff(changes, thermostat_id, sensor_id, path + (key,), old.get(key), new[key])
+        for key in old:
+            if key not in new:
+                changes.append(Change(thermostat_id, sensor_id, path + (key,), old[key], None))
+    elif old != new:
+        changes.append(Change(thermostat_id, sensor_id, path, old, new))
+
+
+def _diff_equipment(changes, thermostat_id, old, new):
+    old = parse_equipment(old)
+    new = parse_equipment(new)
+    for name in sorted(new - old):
+        changes.append(Change(thermostat_id, None, ('equipmentStatus', name), False, True))
+    for name in sorted(old - new):
+        changes.append(Change(thermostat_id, None, ('equipmentStatus', name), True, False))
+
+
+def _capabilities(sensor):
+    return dict((c['type'], c.get('value')) for c in sensor.get('capability', ()))
+
+
+def _diff_sensors(changes, thermostat_id, old, new):
+    for sensor_id, sensor in new.items():
+        path = ('remoteSensors', sensor_id)
+        before = old.get(sensor_id)
+        if before is None:
+            changes.append(Change(thermostat_id, sensor_id, path, None, sensor))
+            continue
+        if before is sensor:
+            continue
+        for key in sensor:
+            if key == 'capability':
+                _diff(changes, thermostat_id, sensor_id, path + (key,),
+                      _capabilities(before), _capabilities(sensor))
+            else:
+                _diff(changes, thermostat_id, sensor_id, path + (key,), before.get(key), sensor[key])
+
+    for sensor_id, sensor in old.items():
+        if sensor_id not in new:
+            changes.append(Change(thermostat_id, sensor_id, ('remoteSensors', sensor_id), sensor, None))
@@ -0,0 +1,145 @@
+# vim: set fileencoding=utf-8
+"""
+Batched thermostat writes.
+
+    queue = ecobee.CommandQueue(eapi, window=0.5)
+    futures = [queue.setHold(tid, holdClimateRef='away') for tid in tids]
+    for f in futures:
+        f.result()
+
+Commands are collected for 'window' seconds and then sent together.
+Identical commands for different thermostats go in one request with a
+multi-thermostat selection, and a newer command for a thermostat replaces
+any older one that hasn't been sent yet.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections
+import concurrent.futures
+import json
+import threading
+
+import ecobee
+
+
+DEFAULT_WINDOW = 0.5
+
+
+class CommandQueue(object):
+    """Collects setHold/resumeProgram writes and sends them in batches.
+    Each command returns a concurrent.futures.Future for the API's
+    response, or the exception if it failed or got no answer."""
+
+    def __init__(self, eapi, window=DEFAULT_WINDOW):
+        """
+          eapi:   ecobee.Client to send commands with
+          window: seconds to collect commands before sending them
+
+        """
+        self._eapi = eapi
+        self.window = window
+        self._lock = threading.Lock()
+        # thermostat ID to (function, futures waiting on it)
+        self._pending = collections.OrderedDict()
+        self._timer = None
+        self._closed = False
+
+
+    def setHold(self, thermostat_id, **kwargs):
+        """Queue a hold, see Client.setHold"""
+        _, data = self._eapi._hold_request(thermostat_id, **kwargs)
+        return self.submit(thermostat_id, data['functions'][0])
+
+
+    def resumeProgram(self, thermostat_id):
+        """Queue resuming the program, see Client.resumeProgram"""
+        _, data = self._eapi._resume_request(thermostat_id)
+        return self.submit(thermostat_id, data['functions'][0])
+
+
+    def submit(self, thermostat_id, function):
+        """Queue an API function for a thermostat.  Replaces any command
+        for it that's still waiting; the replaced command's future gets
+        the new command's result."""
+
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise ecobee.EcobeeException("command queue is closed")
+
+            futures = [future]
+            if thermostat_id in self._pending:
+                futures = self._pending.pop(thermostat_id)[1] + futures
+            self._pending[thermostat_id] = (function, futures)
+
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+
+    def flush(self):
+        """Send everything that's waiting now"""
+        with self._lock:
+            pending, self._pending = self._pending, collections.OrderedDict()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        # identical functions go together
+        batches = collections.OrderedDict()
+        for tid, (function, _) in pending.items():
+            key = json.dumps(function, sort_keys=True)
+            batches.setdefault(key, (function, []))[1].append(tid)
+
+        batched = []
+        for function, tids in batches.values():
+            for chunk in self._eapi._chunks(tids, ecobee.THERMOSTAT_PAGE_SIZE):
+                futures = list(f for tid in chunk for f in pending[tid][1])
+                batched.append((function, chunk, futures))
+
+        self._eapi._map(self._send, batched)
+
+
+    def _send(self, batch):
+        """Send one batch and resolve its futures"""
+        function, thermostat_ids, futures = batch
+        try:
+            result = self._eapi.post('thermostat', {
+                "selection": {
+                    "selectionType":  "thermostats",
+                    "selectionMatch": ":".join(thermostat_ids),
+                },
+                "functions": [function],
+            })
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        # no answer, like when authentication has to start again
+        if result is None:
+            error = ecobee.EcobeeException("{}: no answer for {}".format(
+                function.get('type'), ", ".join(thermostat_ids)))
+            for future in futures:
+                future.set_exception(error)
+            return
+
+        for future in futures:
+            future.set_result(result)
+
+
+    def close(self):
+        """Send anything waiting, and stop accepting commands"""
+        with self._lock:
+            self._closed = True
+        self.flush()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,536 @@
+# vim: set fileencoding=utf-8
+"""
+A local stand-in for the Ecobee API, for testing and benchmarks.
+
+    with ecobee.fakeserver.FakeEcobee(thermostats=100, latency=0.05) as server:
+        eapi = server.client()
+        eapi.update()
+
+It serves /authorize, /token, /1/thermostatSummary, /1/thermostat (GET,
+and POST for setHold and resumeProgram) and /1/runtimeReport for a fleet
+of simulated thermostats.  change() makes some thermostats report new
+readings and revisions, fail() injects error responses, disconnect()
+drops connections without answering, and expire_tokens() and revoke() make the API answer with error 14 or 16.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+import ecobee
+from ecobee import reports
+
+
+PAGE_SIZE = 25
+# seconds the server's access tokens are good for
+TOKEN_LIFETIME = 3600
+INTERVAL = datetime.timedelta(minutes=5)
+# time of day of each report interval, as the API formats it
+INTERVAL_TIMES = tuple((datetime.datetime(2000, 1, 1) + INTERVAL * i).strftime('%H:%M:%S')
+                       for i in range(int(datetime.timedelta(days=1) / INTERVAL)))
+# injected failure that closes the connection instead of answering
+DISCONNECT = 'disconnect'
+# connections waiting to be accepted, enough for many clients connecting
+# at once without the kernel dropping them and the client retrying later
+LISTEN_BACKLOG = 128
+
+STATUS_MESSAGES = {
+    3:  'Processing error.',
+    14: 'Authentication token has expired. Refresh your tokens.',
+    16: 'Authentication token has been deauthorized.',
+}
+
+
+class FakeThermostat(object):
+    """One simulated thermostat"""
+
+    def __init__(self, index, sensors, rand):
+        self.identifier = '{:012d}'.format(310000000000 + index)
+        self.name = 'Thermostat {}'.format(index)
+        self.temperature = rand.randint(650, 750)
+        self.humidity = rand.randint(30, 50)
+        self.heat = 680
+        self.cool = 750
+        self.running = ''
+        self.hold = None
+        self.sensors = list('rs:{}'.format(100 + i) for i in range(sensors - 1))
+        # thermostat, alerts, runtime and interval revisions
+        self.revisions = [1, 1, 1, 1]
+
+    def revision(self, i):
+        return '{:012d}'.format(self.revisions[i])
+
+    def summary(self):
+        return ':'.join([self.identifier, self.name, 'true'] + list(self.revision(i) for i in range(4)))
+
+    def change(self, rand):
+        """New readings, as if an interval went by"""
+        self.temperature += rand.randint(-5, 5)
+        self.humidity = max(0, min(100, self.humidity + rand.randint(-2, 2)))
+        if self.temperature < self.heat:
+            self.running = 'fan,heatPump'
+        elif self.temperature > self.cool:
+            self.running = 'fan,compCool1'
+        else:
+            self.running = ''
+        self.revisions[2] += 1
+        self.revisions[3] += 1
+
+    def set_hold(self, params):
+        self.hold = dict(params)
+        if 'heatHoldTemp' in params:
+            self.heat = int(params['heatHoldTemp'])
+        if 'coolHoldTemp' in params:
+            self.cool = int(params['coolHoldTemp'])
+        self.revisions[0] += 1
+        self.revisions[2] += 1
+
+    def resume(self):
+        self.hold = None
+        self.heat = 680
+        self.cool = 750
+        self.revisions[0] += 1
+        self.revisions[2] += 1
+
+    def status(self, selection):
+        """The /thermostat entry, with the sections the selection asks for"""
+        data = {
+            'identifier':    self.identifier,
+            'name':          self.name,
+            'thermostatRev': self.revision(0),
+            'isRegistered':  True,
+            'modelNumber':   'athenaSmart',
+            'brand':         'ecobee',
+        }
+        if selection.get('includeRuntime'):
+            data['runtime'] = {
+                'runtimeRev':        self.revision(2),
+                'connected':         True,
+                'actualTemperature': self.temperature,
+                'actualHumidity':    self.humidity,
+                'desiredHeat':       self.heat,
+                'desiredCool':       self.cool,
+                'desiredHumidity':   36,
+                'desiredFanMode':    'auto',
+            }
+        if selection.get('includeSettings'):
+            data['settings'] = {'hvacMode': 'auto', 'heatStages': 1, 'coolStages': 1, 'useCelsius': False}
+        if selection.get('includeEquipmentStatus'):
+            data['equipmentStatus'] = self.running
+        if selection.get('includeEvents'):
+            data['events'] = [dict(self.hold, type='hold', running=True)] if self.hold else []
+        if selection.get('includeProgram'):
+            data['program'] = {'currentClimateRef': 'home', 'climates': []}
+        if selection.get('includeDevice'):
+            data['devices'] = []
+        if selection.get('includeSensors'):
+            data['remoteSensors'] = [self._sensor('ei:0', self.name, 'thermostat', self.temperature)]
+            for i, sid in enumerate(self.sensors):
+                data['remoteSensors'].append(
+                    self._sensor(sid, 'Room {}'.format(i), 'ecobee3_remote_sensor', self.temperature + i))
+        return data
+
+    def _sensor(self, sid, name, kind, temperature):
+        capability = [
+            {'id': '1', 'type': 'temperature', 'value': str(temperature)},
+            {'id': '2', 'type': 'occupancy', 'value': 'false'},
+        ]
+        if kind == 'thermostat':
+            capability.append({'id': '3', 'type': 'humidity', 'value': str(self.humidity)})
+        return {'id': sid, 'name': name, 'type': kind, 'inUse': True, 'capability': capability}
+
+    def report(self, start, end, columns):
+        """rowList for a /runtimeReport"""
+        kinds = list(reports.COLUMN_TYPES.get(column) for column in columns)
+        floats = list('{:.1f}'.format(self.temperature / 10.0 + i / 10.0) for i in range(7))
+        rows = []
+        n = 0
+        day = start
+        while day <= end:
+            date = day.strftime('%Y-%m-%d')
+            for clock in INTERVAL_TIMES:
+                values = []
+                for kind in kinds:
+                    if kind is float:
+                        values.append(floats[n % 7])
+                    elif kind is int:
+                        values.append(str((n * 37) % 301))
+                    else:
+                        values.append('')
+                rows.append('{},{},{}'.format(date, clock, ','.join(values)))
+                n += 1
+            day += datetime.timedelta(days=1)
+        return rows
+
+    def sensor_report(self, start, end):
+        """sensorList entry for a /runtimeReport"""
+        sensors = list({'sensorId': '{}:1'.format(sid), 'sensorName': sid,
+                        'sensorType': 'temperature', 'sensorUsage': 'monitor'}
+                       for sid in self.sensors)
+        values = ','.join('{:.1f}'.format(self.temperature / 10.0) for _ in sensors)
+        data = []
+        day = start
+        while day <= end:
+            date = day.strftime('%Y-%m-%d')
+            data.extend(','.join((date, clock, values)) if values else '{},{}'.format(date, clock)
+                        for clock in INTERVAL_TIMES)
+            day += datetime.timedelta(days=1)
+        return {
+            'thermostatIdentifier': self.identifier,
+            'sensors':  sensors,
+            'columns':  ['date', 'time'] + list(s['sensorId'] for s in sensors),
+            'data':     data,
+        }
+
+
+class FakeEcobee(object):
+    """The fake API server, running in a background thread"""
+
+    def __init__(self, thermostats=1, sensors=1, latency=0.0, jitter=0.0, stall=0.0, stall_time=0.0,
+                 token_lifetime=TOKEN_LIFETIME, host='127.0.0.1', port=0, seed=None):
+        """
+          thermostats:    number of thermostats in the fleet
+          sensors:        sensors per thermostat, including its own
+          latency:        seconds to wait before answering each API request
+          jitter:         up to this many more seconds, at random
+          stall:          chance, from 0 to 1, of a request stalling
+          stall_time:     seconds more that a stalled request waits
+          token_lifetime: seconds before an access token gets error 14
+          host, port:     address to listen on, default any free local port
+          seed:           random seed, for repeatable readings
+
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.stall = stall
+        self.stall_time = stall_time
+        self.token_lifetime = token_lifetime
+        self.address = (host, port)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.thermostats = collections.OrderedDict()
+        for i in range(thermostats):
+            thermostat = FakeThermostat(i, sensors, self._random)
+            self.thermostats[thermostat.identifier] = thermostat
+
+        # current tokens, and the time the access token was issued
+        self.access_token = None
+        self.refresh_token = None
+        self.issued = 0
+        self.revoked = False
+        self._serial = 0
+        self._pin_code = None
+        # (endpoint or None, status code or DISCONNECT) of injected failures
+        self._failures = []
+        # requests seen, by (method, path)
+        self.calls = collections.Counter()
+        self._server = None
+
+
+    @property
+    def url(self):
+        """Base URL of the server, to use as Client's url_base"""
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+
+    def start(self):
+        server = self
+
+        class Handler(RequestHandler):
+            fake = server
+
+        self._server = HTTPServer(self.address, Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def client(self, apikey='fakekey', cls=None, **kwargs):
+        """An ecobee.Client already authorized with this server"""
+        cls = cls or ecobee.Client
+        tokens = self.issue_tokens()
+        authstore = ecobee.MemoryTokenStore(dict(tokens, required=False, expiration=(
+            datetime.datetime.now() + datetime.timedelta(seconds=self.token_lifetime))))
+        return cls(apikey, authstore=authstore, url_base=self.url, lazy=True, **kwargs)
+
+
+    def issue_tokens(self):
+        """New access and refresh tokens, replacing the current ones"""
+        with self._lock:
+            self._serial += 1
+            self.access_token = 'access{}'.format(self._serial)
+            self.refresh_token = 'refresh{}'.format(self._serial)
+            self.issued = time.monotonic()
+            self.revoked = False
+            return {
+                'access_token':  self.access_token,
+                'token_type':    'Bearer',
+                'refresh_token': self.refresh_token,
+                'expires_in':    self.token_lifetime,
+                'scope':         'smartWrite',
+            }
+
+
+    def expire_tokens(self):
+        """Answer requests using the current access token with error 14"""
+        with self._lock:
+            self.issued = time.monotonic() - self.token_lifetime
+
+
+    def revoke(self):
+        """Answer all requests with error 16 until the app is authorized again"""
+        with self._lock:
+            self.revoked = True
+            self.refresh_token = None
+
+
+    def fail(self, code, count=1, endpoint=None):
+        """Answer the next 'count' API requests, to endpoint if given,
+        with this Ecobee status code"""
+        with self._lock:
+            self._failures.extend([(endpoint, code)] * count)
+
+
+    def disconnect(self, count=1, endpoint=None):
+        """Close the connection without answering the next 'count' API
+        requests, to endpoint if given"""
+        self.fail(DISCONNECT, count, endpoint)
+
+
+    def change(self, fraction=0.1):
+        """Give a random fraction of the thermostats new readings and
+        revisions.  Returns the IDs of the ones changed."""
+        with self._lock:
+            ids = list(self.thermostats)
+            count = max(1, int(len(ids) * fraction)) if ids and fraction else 0
+            changed = self._random.sample(ids, count)
+            for tid in changed:
+                self.thermostats[tid].change(self._random)
+        return changed
+
+
+    def _check_token(self, header):
+        """Status code for a request with this Authorization header"""
+        if self.revoked:
+            return 16
+        token = (header or '').split(' ')[-1]
+        if token != self.access_token or time.monotonic() - self.issued > self.token_lifetime:
+            return 14
+        return 0
+
+
+    def _failure(self, endpoint):
+        for i, (match, code) in enumerate(self._failures):
+            if match is None or match == endpoint:
+                del self._failures[i]
+                return code
+        return 0
+
+
+    def _select(self, selection):
+        """Thermostats matching a selection"""
+        if selection.get('selectionType') == 'registered':
+            return list(self.thermostats.values())
+        ids = (selection.get('selectionMatch') or '').split(':')
+        return list(self.thermostats[tid] for tid in ids if tid in self.thermostats)
+
+
+    def api(self, method, endpoint, body, authorization):
+        """Answer an API request, returns (HTTP status, response dict),
+        or (None, None) to close the connection without answering"""
+        if self.latency or self.jitter or self.stall:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self.stall and self._random.random() < self.stall:
+                delay += self.stall_time
+            time.sleep(delay)
+
+        with self._lock:
+            self.calls[(method, endpoint)] += 1
+            code = self._check_token(authorization) or self._failure(endpoint)
+            if code == DISCONNECT:
+                return None, None
+            if code:
+                return 500, status(code)
+
+            if endpoint == 'thermostatSummary' and method == 'GET':
+                return 200, self._summary(body)
+            if endpoint == 'thermostat' and method == 'GET':
+                return 200, self._thermostat(body)
+            if endpoint == 'thermostat' and method == 'POST':
+                return self._functions(body)
+            if endpoint == 'runtimeReport' and method == 'GET':
+                return self._report(body)
+        return 404, status(3, 'Unknown endpoint: {}'.format(endpoint))
+
+
+    def _summary(self, body):
+        selection = body.get('selection', {})
+        thermostats = self._select(selection)
+        result = {
+            'thermostatCount': len(thermostats),
+            'revisionList':    list(t.summary() for t in thermostats),
+            'status':          status(0),
+        }
+        if selection.get('includeEquipmentStatus'):
+            result['statusList'] = list('{}:{}'.format(t.identifier, t.running) for t in thermostats)
+        return result
+
+
+    def _thermostat(self, body):
+        selection = body.get('selection', {})
+        thermostats = self._select(selection)
+        page = body.get('page', {}).get('page', 1)
+        pages = max(1, (len(thermostats) + PAGE_SIZE - 1) // PAGE_SIZE)
+        start = (page - 1) * PAGE_SIZE
+        return {
+            'page': {'page': page, 'totalPages': pages, 'pageSize': PAGE_SIZE, 'total': len(thermostats)},
+            'thermostatList': list(t.status(selection) for t in thermostats[start:start + PAGE_SIZE]),
+            'status': status(0),
+        }
+
+
+    def _functions(self, body):
+        thermostats = self._select(body.get('selection', {}))
+        for function in body.get('functions', []):
+            if function.get('type') == 'setHold':
+                for t in thermostats:
+                    t.set_hold(function.get('params', {}))
+            elif function.get('type') == 'resumeProgram':
+                for t in thermostats:
+                    t.resume()
+            else:
+                return 500, status(3, 'Unknown function: {}'.format(function.get('type')))
+        return 200, status(0)
+
+
+    def _report(self, body):
+        thermostats = self._select(body.get('selection', {}))
+        start = datetime.datetime.strptime(body['startDate'], '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(body['endDate'], '%Y-%m-%d').date()
+        if len(thermostats) > ecobee.REPORT_MAX_THERMOSTATS or (end - start).days >= ecobee.REPORT_MAX_DAYS:
+            return 500, status(3, 'Report is too large.')
+
+        columns = list(c for c in body.get('columns', '').split(',') if c)
+        result = {
+            'startDate':  body['startDate'],
+            'endDate':    body['endDate'],
+            'columns':    ','.join(columns),
+            'reportList': [],
+            'sensorList': [],
+            'status':     status(0),
+        }
+        for t in thermostats:
+            rows = t.report(start, end, columns)
+            result['reportList'].append({'thermostatIdentifier': t.identifier,
+                                         'rowCount': len(rows), 'rowList': rows})
+            if body.get('includeSensors'):
+                result['sensorList'].append(t.sensor_report(start, end))
+        return 200, result
+
+
+    def authorize(self, params):
+        """GET /authorize, the user approves the app straight away"""
+        with self._lock:
+            self.calls[('GET', 'authorize')] += 1
+            self._serial += 1
+            self._pin_code = 'code{}'.format(self._serial)
+        return 200, {'ecobeePin': 'ABCD', 'code': self._pin_code, 'scope': params.get('scope', 'smartWrite'),
+                     'expires_in': 9, 'interval': 30}
+
+
+    def token(self, params):
+        """POST /token"""
+        with self._lock:
+            self.calls[('POST', 'token')] += 1
+            grant = params.get('grant_type')
+            code = params.get('code')
+            ok = ((grant == 'ecobeePin' and code == self._pin_code) or
+                  (grant == 'refresh_token' and code and code == self.refresh_token))
+        if not ok:
+            return 400, {'error': 'invalid_grant', 'error_description': 'The authorization grant is invalid.'}
+        return 200, self.issue_tokens()
+
+
+def status(code, message=None):
+    """API status block"""
+    return {'status': {'code': code, 'message': message or STATUS_MESSAGES.get(code, '')}}
+
+
+class HTTPServer(http.server.ThreadingHTTPServer):
+    """Thread per request, with room for many connections at once"""
+    request_queue_size = LISTEN_BACKLOG
+    daemon_threads = True
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Routes requests to the FakeEcobee in 'fake'"""
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, don't let them wait on ACKs
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, data):
+        if code is None:
+            self.close_connection = True
+            return
+        body = json.dumps(data).encode('utf-8')
+        try:
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json;charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out, or took a hedged answer
+            self.close_connection = True
+
+    def _route(self, method, body):
+        url = urllib.parse.urlparse(self.path)
+        params = dict((k, v[0]) for k, v in urllib.parse.parse_qs(url.query).items())
+        path = url.path.strip('/').split('/')
+
+        if path == ['authorize'] and method == 'GET':
+            return self._send(*self.fake.authorize(params))
+        if path == ['token'] and method == 'POST':
+            return self._send(*self.fake.token(params))
+        if len(path) == 2 and path[0] == ecobee.APIVERSION:
+            if method == 'GET':
+                body = params.get('json') or '{}'
+            try:
+                data = json.loads(body or '{}')
+            except ValueError:
+                return self._send(400, status(4, 'Serialization error.'))
+            return self._send(*self.fake.api(method, path[1], data, self.headers.get('Authorization')))
+        self._send(404, status(3, 'Unknown endpoint: {}'.format(url.path)))
+
+    def do_GET(self):
+        self._route('GET', None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._route('POST', self.rfile.read(length).decode('utf-8'))
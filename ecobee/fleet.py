@@ -0,0 +1,269 @@
+# vim: set fileencoding=utf-8
+"""
+Many Ecobee accounts in one process.
+
+    fleet = ecobee.Fleet(workers=16, concurrency=8)
+    for customer in customers:
+        fleet.add(customer.apikey, authstore=customer.tokens, name=customer.id)
+    fleet.run()
+
+All the clients share one connection pool and one worker pool.  Each
+account is polled, and its changed thermostats updated, at most once
+every min_interval seconds (the API asks for no more than every three
+minutes), and accounts take turns in the order they fall due.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import ecobee
+
+
+# seconds between polls of one account, the API's documented minimum
+MIN_POLL_INTERVAL = 180
+DEFAULT_CONCURRENCY = 4
+
+
+class Fleet(object):
+    """Owns a Client per account, and schedules their polling"""
+
+    def __init__(self, workers=None, concurrency=DEFAULT_CONCURRENCY,
+                 min_interval=MIN_POLL_INTERVAL, rate_limit=None, transport=None,
+                 executor=None, sections=None, stagger=True, observer=None):
+        """
+          workers:      size of the worker pool the clients share for
+                        requests.  Default: ecobee.DEFAULT_WORKERS
+          concurrency:  max accounts polled at once
+          min_interval: seconds between polls of one account
+          rate_limit:   max API requests per second for each account
+          transport:    ecobee.Transport for all clients.  Default: a new one
+                        big enough for workers and concurrency
+          executor:     worker pool to share, instead of one with 'workers'
+          sections:     sections to update changed thermostats with
+          stagger:      spread the first poll of new accounts over
+                        min_interval, instead of polling them all at once
+          observer:     ecobee.Observer for all the clients
+
+        """
+        self.log = logging.getLogger(__name__)
+        self.workers = workers = workers or ecobee.DEFAULT_WORKERS
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.rate_limit = rate_limit
+        self.sections = sections
+        self.stagger = stagger
+        self.observer = observer
+        # close what we create, leave what we're given
+        self._owned = []
+        if transport is None:
+            transport = ecobee.Transport(pool_size=workers + concurrency)
+            self._owned.append(transport.close)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            self._owned.append(executor.shutdown)
+        self.transport = transport
+        self.executor = executor
+        # account polls run here, not in the clients' pool, which they wait on
+        self._polls = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+        # name to Client
+        self.clients = {}
+        self._lock = threading.Lock()
+        # (due time, sequence, name) of each account that isn't being polled,
+        # and the sequence of each name's current entry; entries left behind
+        # by remove() don't match it, and are skipped
+        self._queue = []
+        self._due = {}
+        self._sequence = itertools.count()
+        # thermostat ID to account name, and how many of each account's
+        # thermostat IDs are in it
+        self._where = {}
+        self._indexed = {}
+
+
+    def add(self, apikey, name=None, **kwargs):
+        """Add an account, and return its Client.  kwargs are given to
+        ecobee.Client, it's created lazily so nothing is sent until
+        it's first polled.
+
+          name:   what to call the account, default apikey
+
+        """
+        name = name or apikey
+        with self._lock:
+            if name in self.clients:
+                raise ValueError("account {!r} is already in the fleet".format(name))
+
+        kwargs.setdefault('transport', self.transport)
+        kwargs.setdefault('executor', self.executor)
+        kwargs.setdefault('workers', self.workers)
+        kwargs.setdefault('rate_limit', self.rate_limit)
+        kwargs.setdefault('observer', self.observer)
+        kwargs.setdefault('lazy', True)
+        client = ecobee.Client(apikey, **kwargs)
+
+        with self._lock:
+            if name in self.clients:
+                raise ValueError("account {!r} is already in the fleet".format(name))
+            self.clients[name] = client
+            delay = random.uniform(0, self.min_interval) if self.stagger else 0
+            self._schedule(name, time.monotonic() + delay)
+        self._index(name, client)
+        return client
+
+
+    def remove(self, name):
+        """Remove an account, returns its Client"""
+        with self._lock:
+            client = self.clients.pop(name)
+            self._due.pop(name, None)
+            self._indexed.pop(name, None)
+            for tid in list(client.thermostat_ids):
+                if self._where.get(tid) == name:
+                    del self._where[tid]
+        return client
+
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __contains__(self, name):
+        return name in self.clients
+
+
+    def _schedule(self, name, due):
+        sequence = next(self._sequence)
+        self._due[name] = sequence
+        heapq.heappush(self._queue, (due, sequence, name))
+
+
+    def next_due(self):
+        """Seconds until the next account is due, None if there are none"""
+        with self._lock:
+            self._drop_removed()
+            if not self._queue:
+                return None
+            return max(0.0, self._queue[0][0] - time.monotonic())
+
+
+    def _drop_removed(self):
+        """Pop entries off the top of the queue that are no longer
+        current, because their account was removed"""
+        while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][1]:
+            heapq.heappop(self._queue)
+
+
+    def run_pending(self, wait=True):
+        """Poll each account that's due.  With wait, returns a dict of
+        account name to updated thermostat IDs, or the exception if it
+        failed.  Otherwise returns the futures."""
+
+        now = time.monotonic()
+        futures = {}
+        with self._lock:
+            self._drop_removed()
+            while self._queue and self._queue[0][0] <= now:
+                _, _, name = heapq.heappop(self._queue)
+                del self._due[name]
+                futures[name] = self._polls.submit(self._poll, name, self.clients[name])
+                self._drop_removed()
+
+        if not wait:
+            return futures
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
+
+
+    def _poll(self, name, client):
+        """Poll one account, then schedule its next poll, unless it was
+        removed meanwhile"""
+        started = time.monotonic()
+        try:
+            updated = client.update_changed(self.sections)
+            self._index(name, client)
+            return updated
+        except Exception:
+            self.log.exception("polling account {} failed".format(name))
+            raise
+        finally:
+            with self._lock:
+                if self.clients.get(name) is client:
+                    self._schedule(name, started + self.min_interval)
+
+
+    def run(self, stop=None):
+        """Poll accounts as they fall due, until the 'stop'
+        threading.Event is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.run_pending(wait=False)
+            delay = self.next_due()
+            # accounts being polled aren't in the queue, look again soon
+            stop.wait(1.0 if delay is None else min(delay, 1.0))
+
+
+    def _index(self, name, client):
+        """Add any new thermostats of an account to the lookup index"""
+        ids = client.thermostat_ids
+        with self._lock:
+            if self.clients.get(name) is not client:
+                return
+            seen = self._indexed.get(name, 0)
+            if len(ids) < seen:
+                seen = 0
+            for tid in ids[seen:]:
+                self._where[tid] = name
+            self._indexed[name] = len(ids)
+
+
+    def account(self, thermostat_id):
+        """Name of the account a thermostat is in, or None"""
+        return self._where.get(str(thermostat_id))
+
+
+    def client_for(self, thermostat_id):
+        """The Client for a thermostat, or None"""
+        name = self.account(thermostat_id)
+        if name is not None:
+            return self.clients.get(name)
+
+
+    def get_thermostat(self, thermostat_id, sections=None):
+        """The Thermostat object for a thermostat in any account, or None"""
+        client = self.client_for(thermostat_id)
+        if client is not None:
+            return client.get_thermostat(thermostat_id, sections)
+
+
+    def thermostats(self):
+        """All the Thermostat objects in all the accounts"""
+        for name, client in list(self.clients.items()):
+            for tid in list(client.thermostat_ids):
+                yield client.get_thermostat(tid)
+
+
+    def close(self):
+        """Stop the worker pools and close connections"""
+        self._polls.shutdown(wait=True)
+        for close in self._owned:
+            close()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,257 @@
+# vim: set fileencoding=utf-8
+"""
+Recent history of thermostat and sensor readings.
+
+    history = ecobee.History(capacity=288)
+    eapi = ecobee.Client(apikey, history=history)
+    ...
+    eapi.update_changed()
+    history.series(tid, 'temperature').mean(3600)
+    history.series(tid, 'temperature', sensor_id='rs:100').max(3600)
+    history.on_time(tid, 'compCool1', 24 * 3600)
+
+Each update records the thermostat's temperature and humidity, its running
+equipment when that changes, and each sensor's temperature, humidity and
+occupancy, in fixed-size ring buffers, so memory per device is bounded and the oldest
+readings are dropped first.  Buffers are arrays, or numpy arrays if
+asked for and it's installed.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import array
+import math
+import threading
+import time
+
+from ecobee import reports
+from ecobee.objects import parse_capabilities, parse_equipment
+from ecobee.snapshot import EQUIPMENT_BITS
+
+
+DEFAULT_CAPACITY = 288
+# sensor capabilities recorded, as numbers
+SENSOR_SERIES = ('temperature', 'humidity', 'occupancy')
+
+
+class RingBuffer(object):
+    """Fixed number of the most recent (time, value) readings.  Missing
+    values are NaN, and left out of min(), max() and mean()."""
+
+    __slots__ = ('capacity', '_times', '_values', '_start', '_size', '_np')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, typecode='d', numpy=False):
+        """
+          capacity: readings kept
+          typecode: array typecode of the values, 'd' for floats or 'q'
+                    for integers
+          numpy:    use numpy arrays, if it's installed
+
+        """
+        self.capacity = capacity
+        self._start = 0
+        self._size = 0
+        self._np = reports.numpy() if numpy else None
+        if self._np is not None:
+            self._times = self._np.zeros(capacity)
+            self._values = self._np.zeros(capacity, dtype=self._np.dtype(typecode))
+        else:
+            self._times = array.array('d', [0.0]) * capacity
+            self._values = array.array(typecode, [0]) * capacity
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value, when=None):
+        """Add a reading, dropping the oldest if full"""
+        if when is None:
+            when = time.time()
+        if value is None:
+            value = math.nan
+        if self._size < self.capacity:
+            i = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._times[i] = when
+        self._values[i] = value
+
+    def last(self):
+        """Most recent (time, value), or None"""
+        if not self._size:
+            return None
+        i = (self._start + self._size - 1) % self.capacity
+        return (self._times[i], self._values[i])
+
+    def before(self, since):
+        """The last (time, value) before 'since', or None"""
+        first = self._first(since)
+        if not first:
+            return None
+        i = (self._start + first - 1) % self.capacity
+        return (self._times[i], self._values[i])
+
+    def _first(self, since):
+        """Position, from oldest, of the first reading at or after 'since'"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._times[(self._start + mid) % self.capacity] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _slices(self, seconds, now):
+        """(start, end) index ranges of the readings in the window, in order"""
+        first = 0
+        if seconds is not None:
+            first = self._first((time.time() if now is None else now) - seconds)
+        start = (self._start + first) % self.capacity
+        count = self._size - first
+        if start + count <= self.capacity:
+            return [(start, start + count)]
+        return [(start, self.capacity), (0, start + count - self.capacity)]
+
+    def _window(self, data, seconds, now):
+        parts = list(data[a:b] for a, b in self._slices(seconds, now))
+        if self._np is not None:
+            return self._np.concatenate(parts)
+        result = parts[0]
+        for part in parts[1:]:
+            result += part
+        return result
+
+    def times(self, seconds=None, now=None):
+        """Times of the readings in the last 'seconds', oldest first"""
+        return self._window(self._times, seconds, now)
+
+    def values(self, seconds=None, now=None):
+        """Readings in the last 'seconds', or all of them, oldest first"""
+        return self._window(self._values, seconds, now)
+
+    def _present(self, seconds, now):
+        values = self.values(seconds, now)
+        if self._np is not None:
+            if values.dtype.kind == 'f':
+                values = values[~self._np.isnan(values)]
+            return values
+        return list(v for v in values if v == v)
+
+    def min(self, seconds=None, now=None):
+        values = self._present(seconds, now)
+        return min(values) if len(values) else None
+
+    def max(self, seconds=None, now=None):
+        values = self._present(seconds, now)
+        return max(values) if len(values) else None
+
+    def mean(self, seconds=None, now=None):
+        values = self._present(seconds, now)
+        if not len(values):
+            return None
+        return float(sum(values)) / len(values)
+
+
+class History(object):
+    """Ring buffers of readings for each thermostat and sensor, filled
+    by a Client given history=this"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, numpy=False):
+        """
+          capacity: readings kept for each series
+          numpy:    use numpy arrays, if it's installed
+
+        """
+        self.capacity = capacity
+        self.numpy = numpy
+        # (thermostat ID, sensor ID or None, name) to RingBuffer
+        self._series = {}
+        # thermostat ID to the (runtime, remoteSensors, equipmentStatus)
+        # last recorded
+        self._recorded = {}
+        self._lock = threading.Lock()
+
+
+    def series(self, thermostat_id, name, sensor_id=None):
+        """RingBuffer of one series: 'temperature', 'humidity' or
+        'equipment' (a bitset of ecobee.snapshot.EQUIPMENT) for a
+        thermostat, 'temperature', 'humidity' or 'occupancy' for a sensor.
+        None if nothing has been recorded."""
+        return self._series.get((thermostat_id, sensor_id, name))
+
+
+    def _append(self, key, value, when, typecode='d'):
+        buf = self._series.get(key)
+        if buf is None:
+            buf = self._series[key] = RingBuffer(self.capacity, typecode, self.numpy)
+        buf.append(value, when)
+
+
+    def record(self, status, when=None):
+        """Record readings from a dict of thermostat ID to status, as
+        stored by the Client.  Sections that haven't changed since they
+        were last recorded are skipped, and so is running equipment that's
+        the same as last time."""
+        if when is None:
+            when = time.time()
+
+        with self._lock:
+            for tid, thermostat in status.items():
+                runtime = thermostat.get('runtime')
+                sensors = thermostat.get('remoteSensors')
+                equipment = thermostat.get('equipmentStatus')
+                last_runtime, last_sensors, last_equipment = self._recorded.get(tid, (None, None, None))
+
+                if runtime is not None and runtime is not last_runtime:
+                    temperature = runtime.get('actualTemperature')
+                    self._append((tid, None, 'temperature'),
+                                 None if temperature is None else temperature / 10.0, when)
+                    self._append((tid, None, 'humidity'), runtime.get('actualHumidity'), when)
+
+                if equipment is not None and equipment != last_equipment:
+                    bits = 0
+                    for name in parse_equipment(equipment):
+                        bits |= EQUIPMENT_BITS.get(name, 0)
+                    self._append((tid, None, 'equipment'), bits, when, 'q')
+
+                if sensors is not None and sensors is not last_sensors:
+                    for sid, sensor in sensors.items():
+                        capabilities = parse_capabilities(sensor)
+                        for name in SENSOR_SERIES:
+                            if name in capabilities:
+                                value = capabilities[name]
+                                if isinstance(value, bool):
+                                    value = float(value)
+                                self._append((tid, sid, name), value, when)
+
+                if equipment is None:
+                    equipment = last_equipment
+                self._recorded[tid] = (runtime, sensors, equipment)
+
+
+    def on_time(self, thermostat_id, equipment, seconds, now=None):
+        """Seconds 'equipment' (like 'compCool1') was running in the last
+        'seconds', counting each reading as lasting until the next one, so
+        the one before the window covers its start"""
+        buf = self.series(thermostat_id, 'equipment')
+        if buf is None:
+            return 0.0
+        if now is None:
+            now = time.time()
+
+        bit = EQUIPMENT_BITS[equipment]
+        start = now - seconds
+        readings = list(zip(buf.times(seconds, now), buf.values(seconds, now)))
+        before = buf.before(start)
+        if before is not None:
+            readings.insert(0, before)
+        total = 0.0
+        for i, (when, value) in enumerate(readings):
+            if when >= now:
+                break
+            if int(value) & bit:
+                end = readings[i + 1][0] if i + 1 < len(readings) else now
+                total += min(end, now) - max(when, start)
+        return total
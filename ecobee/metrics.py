@@ -0,0 +1,239 @@
+# vim: set fileencoding=utf-8
+"""
+Instrumentation of API calls.
+
+Give a Client an observer, and it's told about every request it sends,
+every response it decodes, retries and token refreshes:
+
+    metrics = ecobee.Metrics()
+    eapi = ecobee.Client(apikey, observer=metrics)
+    ...
+    print(metrics.prometheus())
+
+Metrics keeps counts and latency histograms per endpoint in memory, and
+writes them in the Prometheus text format.  Subclass Observer to send
+them somewhere else.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import bisect
+import collections
+import threading
+
+
+# histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Observer(object):
+    """Told about a Client's API calls.  The methods do nothing, override
+    the ones you want.  They're called from whichever thread made the
+    call, so must be thread safe."""
+
+    def request(self, method, endpoint, seconds, status, sent, received):
+        """A request was sent.
+
+          method:   'GET' or 'POST'
+          endpoint: API endpoint, like 'thermostat' or 'token'
+          seconds:  time until the response arrived
+          status:   HTTP status code, None if the connection failed
+          sent:     bytes of request data
+          received: bytes of response body as sent, maybe compressed
+
+        """
+        pass
+
+    def decode(self, endpoint, seconds, size):
+        """A 'size' byte JSON response, after decompression, took this
+        long to decode"""
+        pass
+
+    def retry(self, endpoint, reason):
+        """A request is being sent again, reason is 'connection',
+        'server' or 'token'"""
+        pass
+
+    def refresh(self, seconds, ok):
+        """The access token was refreshed, or failed to be"""
+        pass
+
+
+class Histogram(object):
+    """Counts of observations at or below each bucket's bound"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(bound, count) pairs as Prometheus wants them, ending with +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(Observer):
+    """Observer keeping totals and histograms in memory"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='ecobee'):
+        """
+          buckets:  histogram bucket bounds in seconds
+          prefix:   start of the Prometheus metric names
+
+        """
+        self.buckets = buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self._lock:
+            # (method, endpoint) to Histogram
+            self.latency = {}
+            # (method, endpoint, status) to count
+            self.responses = collections.Counter()
+            # (method, endpoint) to bytes
+            self.sent = collections.Counter()
+            self.received = collections.Counter()
+            # endpoint to Histogram
+            self.decoding = {}
+            # endpoint to bytes decoded
+            self.decoded = collections.Counter()
+            # (endpoint, reason) to count
+            self.retries = collections.Counter()
+            # 'ok' or 'failed' to count
+            self.refreshes = collections.Counter()
+            self.refresh_seconds = 0.0
+
+
+    def request(self, method, endpoint, seconds, status, sent, received):
+        key = (method, endpoint)
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(self.buckets)
+            self.latency[key].observe(seconds)
+            self.responses[(method, endpoint, status)] += 1
+            self.sent[key] += sent
+            self.received[key] += received
+
+
+    def decode(self, endpoint, seconds, size):
+        with self._lock:
+            if endpoint not in self.decoding:
+                self.decoding[endpoint] = Histogram(self.buckets)
+            self.decoding[endpoint].observe(seconds)
+            self.decoded[endpoint] += size
+
+
+    def retry(self, endpoint, reason):
+        with self._lock:
+            self.retries[(endpoint, reason)] += 1
+
+
+    def refresh(self, seconds, ok):
+        with self._lock:
+            self.refreshes['ok' if ok else 'failed'] += 1
+            self.refresh_seconds += seconds
+
+
+    def totals(self):
+        """Calls, seconds, bytes sent and bytes received, per endpoint.
+        Compare two of these to find what a poll cycle cost."""
+        with self._lock:
+            return dict(
+                ('{} {}'.format(*key), {
+                    'calls':    histogram.count,
+                    'seconds':  histogram.sum,
+                    'sent':     self.sent[key],
+                    'received': self.received[key],
+                })
+                for key, histogram in self.latency.items()
+            )
+
+
+    def prometheus(self):
+        """All the metrics in the Prometheus text exposition format"""
+        lines = []
+        name = (self.prefix + '_{}').format
+
+        with self._lock:
+            _metric(lines, name('request_seconds'), 'histogram', 'API request latency')
+            for (method, endpoint), histogram in sorted(self.latency.items()):
+                _write_histogram(lines, name('request_seconds'), histogram,
+                                method=method, endpoint=endpoint)
+
+            _metric(lines, name('responses_total'), 'counter', 'API responses by HTTP status')
+            for (method, endpoint, status), count in sorted(self.responses.items(), key=str):
+                _sample(lines, name('responses_total'), count, method=method, endpoint=endpoint,
+                       status='error' if status is None else status)
+
+            _metric(lines, name('request_bytes_total'), 'counter', 'Bytes of request data sent')
+            for (method, endpoint), count in sorted(self.sent.items()):
+                _sample(lines, name('request_bytes_total'), count, method=method, endpoint=endpoint)
+
+            _metric(lines, name('response_bytes_total'), 'counter',
+                    'Bytes of response body received, before decompression')
+            for (method, endpoint), count in sorted(self.received.items()):
+                _sample(lines, name('response_bytes_total'), count, method=method, endpoint=endpoint)
+
+            _metric(lines, name('decode_seconds'), 'histogram', 'JSON response decoding time')
+            for endpoint, histogram in sorted(self.decoding.items()):
+                _write_histogram(lines, name('decode_seconds'), histogram, endpoint=endpoint)
+
+            _metric(lines, name('decode_bytes_total'), 'counter', 'Bytes of JSON responses decoded')
+            for endpoint, count in sorted(self.decoded.items()):
+                _sample(lines, name('decode_bytes_total'), count, endpoint=endpoint)
+
+            _metric(lines, name('retries_total'), 'counter', 'API requests sent again')
+            for (endpoint, reason), count in sorted(self.retries.items()):
+                _sample(lines, name('retries_total'), count, endpoint=endpoint, reason=reason)
+
+            _metric(lines, name('token_refreshes_total'), 'counter', 'Access token refreshes')
+            for result, count in sorted(self.refreshes.items()):
+                _sample(lines, name('token_refreshes_total'), count, result=result)
+
+            _metric(lines, name('token_refresh_seconds_total'), 'counter', 'Time spent refreshing tokens')
+            _sample(lines, name('token_refresh_seconds_total'), self.refresh_seconds)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _metric(lines, name, kind, help):
+    lines.append('# HELP {} {}'.format(name, help))
+    lines.append('# TYPE {} {}'.format(name, kind))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample(lines, name, value, **labels):
+    lines.append('{}{} {}'.format(name, _labels(labels), _number(value)))
+
+
+def _write_histogram(lines, name, histogram, **labels):
+    for bound, count in histogram.cumulative():
+        _sample(lines, name + '_bucket', count, le=_number(bound), **labels)
+    _sample(lines, name + '_sum', histogram.sum, **labels)
+    _sample(lines, name + '_count', histogram.count, **labels)
@@ -5,6 +5,50 @@ A simple library to talk to an Ecobee (https://www.ecobee.com) thermostat.
 
 __author__ = 'Michael Stella <ecobee@thismetalsky.org>'
 
+HEATING = frozenset(('heatPump', 'heatPump2', 'heatPump3', 'auxHeat1', 'auxHeat2', 'auxHeat3'))
+COOLING = frozenset(('compCool1', 'compCool2'))
+
+
+def _tenths(val):
+    return int(val) / 10.0
+
+def _true(val):
+    return val == 'true'
+
+# how to parse each sensor capability's value, others are left as strings
+CAPABILITY_PARSERS = {
+    'temperature':  _tenths,
+    'humidity':     int,
+    'occupancy':    _true,
+}
+
+
+def parse_capabilities(sensor):
+    """Map of capability type to parsed value for a sensor's status dict,
+    the value is None if it's empty or can't be parsed"""
+    capabilities = {}
+    for obj in sensor.get('capability', []):
+        val = obj.get('value')
+        parser = CAPABILITY_PARSERS.get(obj['type'])
+        if not val:
+            val = None
+        elif parser is not None:
+            try:
+                val = parser(val)
+            except ValueError:
+                val = None
+        capabilities[obj['type']] = val
+    return capabilities
+
+
+def parse_equipment(running):
+    """Set of running equipment, from the API's comma separated string"""
+    if not running:
+        return frozenset()
+    if isinstance(running, str):
+        running = running.split(',')
+    return frozenset(running)
+
 
 class Thermostat(object):
     """Ecobee thermostat.
@@ -12,17 +56,59 @@ class Thermostat(object):
     This class is a thin wrapper around the data in
     eapi._status[thermostat_id].
 
+    Running equipment and sensor capabilities are parsed once for each
+    status dict stored by the client, update() stores new ones.
+
     """
+    __slots__ = ('_eapi', 'id', 'lastSeen', 'sections',
+                 '_parsed', '_equipment', '_capabilities', '_sensor_objects', '__weakref__')
 
-    def __init__(self, eapi, thermostat_id):
+    def __init__(self, eapi, thermostat_id, sections=None):
+        """
+          eapi:           ecobee.Client
+          thermostat_id:  ID of this thermostat
+          sections:       default sections for update(), see Client.update()
+
+        """
         self._eapi = eapi
         self.id = thermostat_id
         self.lastSeen = None
+        self.sections = sections
+        # status dict the parsed values below came from
+        self._parsed = None
+        self._equipment = frozenset()
+        self._capabilities = None
+        self._sensor_objects = {}
 
     @property
     def _status(self):
         return self._eapi._status[self.id]
 
+    def _parse(self):
+        """Reparse if the client has stored a new status dict"""
+        status = self._eapi._status[self.id]
+        if status is not self._parsed:
+            self._equipment = parse_equipment(status.get('equipmentStatus'))
+            self._capabilities = None
+            self._parsed = status
+        return status
+
+    @property
+    def equipment(self):
+        """Set of running equipment"""
+        self._parse()
+        return self._equipment
+
+    def _sensor_capabilities(self, sensor_id):
+        """Parsed capabilities of one of this thermostat's sensors"""
+        status = self._parse()
+        if self._capabilities is None:
+            self._capabilities = dict(
+                (sid, parse_capabilities(sensor))
+                for sid, sensor in status.get('remoteSensors', {}).items()
+            )
+        return self._capabilities.get(sensor_id, {})
+
     @property
     def name(self):
         """Thermostat name"""
@@ -58,7 +144,7 @@ class Thermostat(object):
                 return True
 
         # updated
-        elif self.lastSeen < self._eapi.lastSeen[self.id]:
+        elif self.lastSeen < self._eapi.lastSeen.get(self.id, self.lastSeen):
             self.lastSeen = self._eapi.lastSeen[self.id]
             return True
 
@@ -81,29 +167,23 @@ class Thermostat(object):
     @property
     def is_fan(self):
         """Is the fan on ?"""
-        if not self.runtime:
+        if not self._parse().get('runtime'):
             return None
-        return 'fan' in self.running
+        return 'fan' in self._equipment
 
     @property
     def is_heating(self):
         """Is this thing currently heating?"""
-        if not self.runtime:
+        if not self._parse().get('runtime'):
             return None
-        for key in ('heatPump', 'heatPump2', 'heatPump3', 'auxHeat1', 'auxHeat2', 'auxHeat3'):
-            if key in self.running:
-                return True
-        return False
+        return not HEATING.isdisjoint(self._equipment)
 
     @property
     def is_cooling(self):
         """Is this thing currently cooling?"""
-        if not self.runtime:
+        if not self._parse().get('runtime'):
             return None
-        for key in ('compCool1', 'compCool2'):
-            if key in self.running:
-                return True
-        return False
+        return not COOLING.isdisjoint(self._equipment)
 
 
     @property
@@ -138,15 +218,29 @@ class Thermostat(object):
             return None
         return self.runtime.get('actualHumidity')
 
+    def history(self, name):
+        """ecobee.RingBuffer of recent 'temperature', 'humidity' or
+        'equipment' readings, or None if the client has no history"""
+        history = self._eapi.history
+        if history is not None:
+            return history.series(self.id, name)
+
 
     def get_sensor(self, id):
         """Return a sensor object given the ID"""
         if id in self.sensors:
-            return Sensor(self, id)
+            return self._sensor(id)
 
     def list_sensors(self):
         """Return a list of sensor objects"""
-        return list(Sensor(self, k) for k in self.sensors.keys())
+        return list(self._sensor(k) for k in self.sensors.keys())
+
+    def _sensor(self, sensor_id):
+        """The Sensor object for this ID, the same one each time"""
+        sensor = self._sensor_objects.get(sensor_id)
+        if sensor is None:
+            sensor = self._sensor_objects.setdefault(sensor_id, Sensor(self, sensor_id))
+        return sensor
 
 
     def poll(self):
@@ -154,31 +248,47 @@ class Thermostat(object):
         return self._eapi.poll()
 
 
-    def update(self):
-        """Calls update() on this thermostat"""
-        if self.id in self.poll():
-            return self._eapi.update(self.id)
+    def update(self, sections=None):
+        """Updates this thermostat if it has changed.  All thermostats
+        that changed are updated together, so calling this on each
+        thermostat costs one poll and one update per poll window.
+
+          sections:   fetch these, see Client.update().  Default: the
+                      sections this Thermostat was created with
+
+        Returns True if this thermostat was updated.
+        """
+        if sections is None:
+            sections = self.sections
+        if self._eapi.is_async:
+            return self._update_async(sections)
+
+        return self.id in self._eapi.update_changed(sections)
+
+    async def _update_async(self, sections):
+        """update() for an AsyncClient"""
+        return self.id in await self._eapi.update_changed(sections)
 
 
     def setHold(self, **kwargs):
         """Set a hold"""
-        self._eapi.setHold(self.id, **kwargs)
+        return self._eapi.setHold(self.id, **kwargs)
 
     def setClimate(self, holdClimateRef, **kwargs):
         """Shortcut to setClimate"""
-        self._eapi.setHold(self.id, holdClimateRef=holdClimateRef, **kwargs)
+        return self._eapi.setHold(self.id, holdClimateRef=holdClimateRef, **kwargs)
 
     def setHome(self, **kwargs):
         """Shortcut to set 'home' climate"""
-        self.setClimate('home', **kwargs)
+        return self.setClimate('home', **kwargs)
 
     def setAway(self, **kwargs):
         """Shortcut to set 'away' climate"""
-        self.setClimate('away', **kwargs)
+        return self.setClimate('away', **kwargs)
 
     def resumeProgram(self):
         """Shortcut to resume program"""
-        self._eapi.resumeProgram(self.id)
+        return self._eapi.resumeProgram(self.id)
 
 
 class Sensor(object):
@@ -188,6 +298,7 @@ class Sensor(object):
     eapi._status[thermostat.id]['remoteSensors'][sensor_id].
 
     """
+    __slots__ = ('thermostat', 'id', '__weakref__')
 
     def __init__(self, thermostat, sensor_id):
         self.thermostat = thermostat
@@ -211,32 +322,25 @@ class Sensor(object):
         """Sensor type"""
         return self._status.get('type')
 
+    @property
+    def capabilities(self):
+        """Map of capability type to parsed value"""
+        return self.thermostat._sensor_capabilities(self.id)
+
     @property
     def temperature(self):
         """Return temperature (float) or None if not supported"""
-        val = self._get_capability('temperature').get('value')
-        if val:
-            try:
-                return int(val) / 10.0
-            except ValueError:
-                return None
+        return self.thermostat._sensor_capabilities(self.id).get('temperature')
 
     @property
     def humidity(self):
         """Return humidity (float) or None if not supported"""
-        val = self._get_capability('humidity').get('value')
-        if val:
-            try:
-                return int(val)
-            except ValueError:
-                return None
+        return self.thermostat._sensor_capabilities(self.id).get('humidity')
 
     @property
     def occupancy(self):
         """Return occupancy (boolean) or None if not supported"""
-        val = self._get_capability('occupancy').get('value')
-        if val:
-            return val == 'true'
+        return self.thermostat._sensor_capabilities(self.id).get('occupancy')
 
     @property
     def updated(self):
@@ -244,23 +348,20 @@ class Sensor(object):
 
     def can(self, key):
         """Can this sensor do that?"""
-        for obj in self._status.get('capability', []):
-            if obj['type'] == key:
-                return True
-        return False
+        return key in self.thermostat._sensor_capabilities(self.id)
 
-    def _get_capability(self, key):
-        """Get a capability from the array"""
-        for obj in self._status.get('capability', []):
-            if obj['type'] == key:
-                return obj
-        return {}
+    def history(self, name):
+        """ecobee.RingBuffer of recent 'temperature', 'humidity' or
+        'occupancy' readings, or None if the client has no history"""
+        history = self._eapi.history
+        if history is not None:
+            return history.series(self.thermostat.id, name, sensor_id=self.id)
 
     def poll(self):
         """Calls the parent's poll()"""
         return self.thermostat.poll()
 
-    def update(self):
+    def update(self, sections=None):
         """Calls the parent's update()"""
-        self.thermostat.update()
+        return self.thermostat.update(sections)
 
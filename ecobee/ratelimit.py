@@ -0,0 +1,65 @@
+# vim: set fileencoding=utf-8
+"""
+Request rate limiting.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import threading
+import time
+
+
+class RateLimiter(object):
+    """Token bucket rate limiter, safe to share between threads.
+
+       limiter = RateLimiter(rate=5, burst=10)
+       limiter.wait()      # blocks until a request may be sent
+
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+          rate:   requests per second
+          burst:  requests that may be sent at once after an idle period
+
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+    def delay(self):
+        """Take a token, returning the seconds to wait before using it"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+    def try_acquire(self):
+        """Take a token if one is available now, returns True if so"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+    def wait(self):
+        """Block until a request may be sent"""
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
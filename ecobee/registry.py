@@ -0,0 +1,112 @@
+# vim: set fileencoding=utf-8
+"""
+Indexed list of thermostat IDs.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+
+class ThermostatRegistry(list):
+    """List of thermostat IDs, with hash indexes so membership and
+    lookups by name are O(1), and a cache of Thermostat objects so each
+    thermostat keeps one object.
+
+    It is a list, so it can be used anywhere a list of IDs was.
+    """
+
+    def __init__(self, ids=()):
+        super().__init__()
+        self._index = set()
+        # thermostat name to ID, and ID to its current name
+        self.names = {}
+        self._name_of = {}
+        # thermostat ID to Thermostat
+        self.objects = {}
+        self.extend(ids)
+
+    def __contains__(self, tid):
+        return tid in self._index
+
+    def _added(self, tids):
+        self._index.update(tids)
+
+    def _removed(self):
+        """Rebuild the indexes after IDs were removed"""
+        self._index = set(self)
+        for name, tid in list(self.names.items()):
+            if tid not in self._index:
+                del self.names[name]
+        for tid in list(self._name_of):
+            if tid not in self._index:
+                del self._name_of[tid]
+        for tid in list(self.objects):
+            if tid not in self._index:
+                del self.objects[tid]
+
+    def append(self, tid):
+        super().append(tid)
+        self._added((tid,))
+
+    def add(self, tid):
+        """Append the ID if it isn't already here, returns True if added"""
+        if tid in self._index:
+            return False
+        self.append(tid)
+        return True
+
+    def extend(self, tids):
+        tids = list(tids)
+        super().extend(tids)
+        self._added(tids)
+
+    def __iadd__(self, tids):
+        self.extend(tids)
+        return self
+
+    def insert(self, i, tid):
+        super().insert(i, tid)
+        self._added((tid,))
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self._removed()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self._removed()
+
+    def remove(self, tid):
+        super().remove(tid)
+        self._removed()
+
+    def pop(self, i=-1):
+        tid = super().pop(i)
+        self._removed()
+        return tid
+
+    def clear(self):
+        super().clear()
+        self._removed()
+
+    def set_name(self, tid, name):
+        """Record a thermostat's name, forgetting any name it had before"""
+        if not name or tid not in self._index:
+            return
+        old = self._name_of.get(tid)
+        if old is not None and old != name and self.names.get(old) == tid:
+            del self.names[old]
+        self.names[name] = tid
+        self._name_of[tid] = name
+
+    def by_name(self, name):
+        """ID of the thermostat with this name, or None"""
+        return self.names.get(name)
+
+    def __reduce__(self):
+        # the IDs go to __init__, so the indexes are built before the
+        # names are set.  Thermostat objects belong to their client.
+        return self.__class__, (list(self),), dict(self.names)
+
+    def __setstate__(self, names):
+        for name, tid in names.items():
+            self.set_name(tid, name)
@@ -0,0 +1,296 @@
+# vim: set fileencoding=utf-8
+"""
+Typed access to the output of /runtimeReport.
+
+    data = eapi.runtimeReport(includeSensors=True)
+    for row in ecobee.reports.iter_rows(data):
+        print(row.thermostat_id, row.timestamp, row.values['zoneAveTemp'])
+
+Rows are produced lazily, one at a time, from the comma-separated strings
+in the report.  Date/time is in thermostat time, temps are in Fahrenheit.
+
+ReportColumns holds a whole report as one numeric array per column,
+using numpy if it's installed.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import array
+import collections
+import datetime
+
+import ecobee
+
+# optional numpy for ReportColumns, imported on first use since it's slow
+_numpy = []
+
+
+def numpy():
+    """The numpy module, or None if it's not installed"""
+    if not _numpy:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        _numpy.append(module)
+    return _numpy[0]
+
+
+ReportRow = collections.namedtuple('ReportRow', 'thermostat_id timestamp values')
+ReportRow.__doc__ = """One interval of a thermostat's runtime report.
+values is a dict of column name to value, None where there's no data."""
+
+SensorRow = collections.namedtuple('SensorRow', 'thermostat_id timestamp values')
+SensorRow.__doc__ = """One interval of a thermostat's sensor report.
+values is a dict of sensor column ID (eg: 'rs:100:1') to value,
+None where there's no data."""
+
+
+# type of each report column, anything not listed is a string
+COLUMN_TYPES = {
+    'auxHeat1':         int,
+    'auxHeat2':         int,
+    'auxHeat3':         int,
+    'compCool1':        int,
+    'compCool2':        int,
+    'compHeat1':        int,
+    'compHeat2':        int,
+    'dehumidifier':     int,
+    'dmOffset':         float,
+    'economizer':       int,
+    'fan':              int,
+    'humidifier':       int,
+    'outdoorHumidity':  int,
+    'outdoorTemp':      float,
+    'sky':              int,
+    'ventilator':       int,
+    'wind':             int,
+    'zoneAveTemp':      float,
+    'zoneCoolTemp':     float,
+    'zoneHeatTemp':     float,
+    'zoneHumidity':     int,
+    'zoneHumidityHigh': int,
+    'zoneHumidityLow':  int,
+    'zoneOccupancy':    int,
+}
+
+# type of each sensor column by sensorType
+SENSOR_TYPES = {
+    'temperature':  float,
+    'humidity':     int,
+    'occupancy':    int,
+}
+
+
+def parse_value(text, kind=str):
+    """Convert one report value, blanks and junk become None"""
+    if text == '':
+        return None
+    if kind is str:
+        return text
+    try:
+        return kind(text)
+    except ValueError:
+        # ints are sometimes sent as '12.0'
+        if kind is int:
+            try:
+                return int(float(text))
+            except ValueError:
+                pass
+        return None
+
+
+def parse_timestamp(date, time):
+    """Convert report date and time strings to a datetime"""
+    return datetime.datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                             int(time[0:2]), int(time[3:5]), int(time[6:8]))
+
+
+def _iter_lines(thermostat_id, columns, lines, row_type):
+    """Parse 'date,time,value,...' lines into rows"""
+    kinds = list(kind for _, kind in columns)
+    names = list(name for name, _ in columns)
+    for line in lines:
+        parts = line.split(',')
+        values = dict(zip(names, map(parse_value, parts[2:], kinds)))
+        # short lines are missing trailing blank values
+        for name in names[len(parts) - 2:]:
+            values[name] = None
+        yield row_type(thermostat_id, parse_timestamp(parts[0], parts[1]), values)
+
+
+def report_columns(report):
+    """(name, type) of each column in the reportList rows"""
+    columns = report.get('columns') or ''
+    if isinstance(columns, str):
+        columns = columns.split(',')
+    return list((name, COLUMN_TYPES.get(name, str)) for name in columns if name)
+
+
+def sensor_columns(sensors):
+    """(id, type) of each data column in one sensorList entry"""
+    types = dict((s['sensorId'], SENSOR_TYPES.get(s.get('sensorType'), str))
+                 for s in sensors.get('sensors', []))
+    return list((name, types.get(name, str)) for name in sensors.get('columns', [])[2:])
+
+
+def iter_rows(report):
+    """Yield a ReportRow for each interval of each thermostat in
+    the report's reportList"""
+    columns = report_columns(report)
+    for thermostat in report.get('reportList', []):
+        yield from _iter_lines(thermostat['thermostatIdentifier'], columns,
+                               thermostat.get('rowList', []), ReportRow)
+
+
+def iter_sensor_rows(report):
+    """Yield a SensorRow for each interval of each thermostat in
+    the report's sensorList"""
+    for sensors in report.get('sensorList', []):
+        yield from _iter_lines(sensors['thermostatIdentifier'], sensor_columns(sensors),
+                               sensors.get('data', []), SensorRow)
+
+
+class ReportColumns(object):
+    """Column-oriented runtime report.
+
+       cols = ecobee.reports.ReportColumns.from_report(eapi.runtimeReport())
+       temps = cols.temperature('zoneAveTemp', units=ecobee.UNITS_C)
+       fan = cols.view('fan', thermostat_id)
+
+    Numeric columns are stored in contiguous buffers of doubles with NaN
+    for gaps, and returned as numpy arrays when numpy is installed, or
+    array.array / memoryview otherwise.  Other columns are lists.
+    Rows of each thermostat are contiguous, so per-thermostat views
+    share memory with the column.
+    """
+
+    def __init__(self):
+        # column name to buffer, in the order they were first seen
+        self.columns = collections.OrderedDict()
+        # seconds since the epoch of each row, in thermostat time
+        self.timestamps = array.array('d')
+        # thermostat ID to (start, stop) of its rows
+        self.thermostats = collections.OrderedDict()
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @classmethod
+    def from_report(cls, report):
+        """Build from the reportList of a runtimeReport()"""
+        self = cls()
+        columns = report_columns(report)
+        for thermostat in report.get('reportList', []):
+            self._add(thermostat['thermostatIdentifier'], columns, thermostat.get('rowList', []))
+        return self
+
+    @classmethod
+    def from_sensors(cls, report):
+        """Build from the sensorList of a runtimeReport(includeSensors=True).
+        Columns are named by sensor column ID, eg: 'rs:100:1'.  Several
+        entries in a row for one thermostat, from its sensors changing,
+        are joined."""
+        self = cls()
+        for sensors in report.get('sensorList', []):
+            self._add(sensors['thermostatIdentifier'], sensor_columns(sensors), sensors.get('data', []))
+        return self
+
+    def _buffer(self, name, kind):
+        """Get the buffer for a column, creating and back-filling
+        it if this is the first we've seen of it"""
+        buf = self.columns.get(name)
+        if buf is None:
+            if kind is str:
+                buf = [None] * self._length
+            else:
+                buf = array.array('d', _NAN_ROW * self._length)
+            self.columns[name] = buf
+        return buf
+
+    def _add(self, thermostat_id, columns, lines):
+        """Append the rows of one thermostat, after any rows it already
+        has if they're the last ones, eg: when its sensors changed"""
+        start = self._length
+        if thermostat_id in self.thermostats:
+            start, stop = self.thermostats[thermostat_id]
+            if stop != self._length:
+                raise ValueError("rows for thermostat {} are not contiguous".format(thermostat_id))
+
+        buffers = list((self._buffer(name, kind), kind) for name, kind in columns)
+        others = list(buf for name, buf in self.columns.items()
+                      if name not in dict(columns))
+
+        for line in lines:
+            parts = line.split(',')
+            self.timestamps.append(_epoch(parse_timestamp(parts[0], parts[1])))
+            values = parts[2:]
+            for i, (buf, kind) in enumerate(buffers):
+                value = parse_value(values[i], kind) if i < len(values) else None
+                if kind is not str and value is None:
+                    value = NAN
+                buf.append(value)
+            for buf in others:
+                buf.append(None if isinstance(buf, list) else NAN)
+            self._length += 1
+
+        self.thermostats[thermostat_id] = (start, self._length)
+
+    def column(self, name):
+        """Whole column, as a numpy array if available"""
+        buf = self.columns[name]
+        np = numpy()
+        if np is not None and not isinstance(buf, list):
+            return np.frombuffer(buf, dtype=np.float64)
+        return buf
+
+    def view(self, name, thermostat_id):
+        """One thermostat's part of a column, without copying"""
+        start, stop = self.thermostats[thermostat_id]
+        buf = self.columns[name]
+        if isinstance(buf, list):
+            return buf[start:stop]
+        if numpy() is not None:
+            return self.column(name)[start:stop]
+        return memoryview(buf)[start:stop]
+
+    def mask(self, name):
+        """True for each row that has no data in the column"""
+        buf = self.columns[name]
+        if isinstance(buf, list):
+            return list(v is None for v in buf)
+        np = numpy()
+        if np is not None:
+            return np.isnan(self.column(name))
+        return list(v != v for v in buf)
+
+    def temperature(self, name, units=None, tenths=False):
+        """Temperature column converted to the given units.
+
+          units:  ecobee.UNITS_F (default) or ecobee.UNITS_C
+          tenths: the column is in tenths of a degree F
+
+        Returns a new array, gaps stay NaN.
+        """
+        scale = 0.1 if tenths else 1.0
+        offset = 0.0
+        if units == ecobee.UNITS_C:
+            scale = scale * 5.0 / 9.0
+            offset = -32.0 * 5.0 / 9.0
+        elif units not in (None, ecobee.UNITS_F):
+            raise ValueError("unknown units: {}".format(units))
+
+        if numpy() is not None:
+            return self.column(name) * scale + offset
+        return array.array('d', (v * scale + offset for v in self.columns[name]))
+
+
+def _epoch(timestamp):
+    """Seconds since the epoch of a naive datetime"""
+    return (timestamp - _EPOCH).total_seconds()
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+NAN = float('nan')
+_NAN_ROW = [NAN]
@@ -0,0 +1,234 @@
+# vim: set fileencoding=utf-8
+"""
+Local SQLite store for runtime reports.
+
+    store = ecobee.ReportStore('/var/lib/ecobee/reports.db')
+    eapi = ecobee.Client(apikey, report_store=store)
+    report = eapi.runtimeReport(start_date=datetime.date(2023, 1, 1))
+
+Past intervals of a runtime report never change, so once a day has been
+fetched it is served from the store.  Recent days are always fetched
+again, and so are days that came back empty until they've settled: a
+thermostat that was offline uploads its readings when it reconnects.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections
+import datetime
+import json
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_rows (
+    thermostat  TEXT NOT NULL,
+    columns     TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    interval    INTEGER NOT NULL,
+    line        TEXT NOT NULL,
+    PRIMARY KEY (thermostat, columns, date, interval)
+);
+CREATE TABLE IF NOT EXISTS sensor_rows (
+    thermostat  TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    interval    INTEGER NOT NULL,
+    columns     TEXT NOT NULL,
+    sensors     TEXT NOT NULL,
+    line        TEXT NOT NULL,
+    PRIMARY KEY (thermostat, date, interval)
+);
+CREATE TABLE IF NOT EXISTS complete_days (
+    thermostat  TEXT NOT NULL,
+    columns     TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    empty       INTEGER NOT NULL,
+    fetched     TEXT NOT NULL,
+    PRIMARY KEY (thermostat, columns, date)
+);
+"""
+
+# complete_days.columns for sensor data
+SENSORS_KEY = '*sensors*'
+
+# a day with no rows is fetched again, unless it was fetched at least
+# this long after it
+EMPTY_DAY_SETTLE = datetime.timedelta(days=7)
+
+
+def interval_of(time):
+    """5-minute interval of the day for an 'HH:MM:SS' time"""
+    return (int(time[0:2]) * 60 + int(time[3:5])) // 5
+
+
+def _parse_date(text):
+    """datetime.date from a 'YYYY-MM-DD' string"""
+    return datetime.date(*map(int, text.split('-')))
+
+
+def date_range(start_date, end_date):
+    """All dates from start_date to end_date inclusive"""
+    day = datetime.timedelta(days=1)
+    while start_date <= end_date:
+        yield start_date
+        start_date += day
+
+
+class ReportStore(object):
+    """SQLite-backed store of runtime report intervals, indexed by
+    thermostat, date and interval.  Safe to share between threads."""
+
+    def __init__(self, path=':memory:'):
+        """
+          path:   SQLite database file, default is in memory
+
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+
+    def close(self):
+        self._db.close()
+
+
+    def missing(self, thermostat_ids, start_date, end_date, columns, includeSensors=False, mutable=None,
+                settle=EMPTY_DAY_SETTLE):
+        """Dates each thermostat has no complete data for.
+
+          mutable:    dates on or after this are always missing
+          settle:     dates that came back with no rows are missing, unless
+                      they were fetched at least this long after
+
+        Returns a dict of thermostat ID to list of dates.
+        """
+        keys = [','.join(columns)]
+        if includeSensors:
+            keys.append(SENSORS_KEY)
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT thermostat, date, empty, fetched FROM complete_days"
+                " WHERE columns IN ({}) AND date BETWEEN ? AND ?".format(','.join('?' * len(keys))),
+                keys + [start_date.isoformat(), end_date.isoformat()]).fetchall()
+
+        counts = collections.Counter(
+            (tid, date) for tid, date, empty, fetched in rows
+            if not empty or _parse_date(fetched) - _parse_date(date) >= settle
+        )
+        complete = set(day for day, count in counts.items() if count == len(keys))
+
+        missing = {}
+        for tid in thermostat_ids:
+            missing[tid] = list(
+                date for date in date_range(start_date, end_date)
+                if (mutable is not None and date >= mutable)
+                or (tid, date.isoformat()) not in complete
+            )
+        return missing
+
+
+    def add(self, report, thermostat_ids=None, columns=None, includeSensors=False, complete_before=None,
+            fetched=None):
+        """Store a /runtimeReport response.
+
+          thermostat_ids: the thermostats that were requested
+          columns:        the columns that were requested
+          includeSensors: sensor data was requested
+          complete_before: mark the requested days before this date as
+                          complete, so they won't be fetched again.  Days a
+                          thermostat got no rows for are marked as empty, see
+                          missing().
+          fetched:        date the report was fetched, default today
+
+        """
+        if not report:
+            return
+
+        if columns is None:
+            columns = report.get('columns', '').split(',')
+        key = ','.join(columns)
+
+        report_rows = []
+        for thermostat in report.get('reportList', []):
+            tid = thermostat['thermostatIdentifier']
+            for line in thermostat.get('rowList', []):
+                report_rows.append((tid, key, line[0:10], interval_of(line[11:19]), line))
+
+        sensor_rows = []
+        for sensors in report.get('sensorList', []):
+            tid = sensors['thermostatIdentifier']
+            cols = json.dumps(sensors.get('columns', []))
+            meta = json.dumps(sensors.get('sensors', []))
+            for line in sensors.get('data', []):
+                sensor_rows.append((tid, line[0:10], interval_of(line[11:19]), cols, meta, line))
+
+        complete = []
+        if complete_before is not None and thermostat_ids:
+            # (thermostat, date) that rows came back for, for each key
+            returned = {key: set((row[0], row[2]) for row in report_rows)}
+            if includeSensors:
+                returned[SENSORS_KEY] = set((row[0], row[1]) for row in sensor_rows)
+            fetched = (fetched or datetime.date.today()).isoformat()
+            start = _parse_date(report['startDate'])
+            end = min(_parse_date(report['endDate']), complete_before - datetime.timedelta(days=1))
+            for date in date_range(start, end):
+                for tid in thermostat_ids:
+                    for k, days in returned.items():
+                        empty = (tid, date.isoformat()) not in days
+                        complete.append((tid, k, date.isoformat(), empty, fetched))
+
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO report_rows VALUES (?, ?, ?, ?, ?)", report_rows)
+            self._db.executemany("INSERT OR REPLACE INTO sensor_rows VALUES (?, ?, ?, ?, ?, ?)", sensor_rows)
+            self._db.executemany("INSERT OR REPLACE INTO complete_days VALUES (?, ?, ?, ?, ?)", complete)
+
+
+    def report(self, thermostat_ids, start_date, end_date, columns, includeSensors=False):
+        """Build a report from stored data, in the same form as
+        /runtimeReport returns, ordered by thermostat then date."""
+
+        key = ','.join(columns)
+        dates = [start_date.isoformat(), end_date.isoformat()]
+
+        report = {
+            'startDate':        start_date.isoformat(),
+            'startInterval':    0,
+            'endDate':          end_date.isoformat(),
+            'endInterval':      287,
+            'columns':          key,
+            'reportList':       [],
+        }
+
+        with self._lock:
+            for tid in thermostat_ids:
+                lines = list(row[0] for row in self._db.execute(
+                    "SELECT line FROM report_rows WHERE thermostat = ? AND columns = ?"
+                    " AND date BETWEEN ? AND ? ORDER BY date, interval", [tid, key] + dates))
+                report['reportList'].append({
+                    'thermostatIdentifier': tid,
+                    'rowCount':             len(lines),
+                    'rowList':              lines,
+                })
+
+            if includeSensors:
+                sensors = collections.OrderedDict()
+                for tid in thermostat_ids:
+                    for cols, meta, line in self._db.execute(
+                            "SELECT columns, sensors, line FROM sensor_rows WHERE thermostat = ?"
+                            " AND date BETWEEN ? AND ? ORDER BY date, interval", [tid] + dates):
+                        # the sensors on a thermostat might change over time
+                        if (tid, cols) not in sensors:
+                            sensors[(tid, cols)] = {
+                                'thermostatIdentifier': tid,
+                                'sensors':              json.loads(meta),
+                                'columns':              json.loads(cols),
+                                'data':                 [],
+                            }
+                        sensors[(tid, cols)]['data'].append(line)
+                report['sensorList'] = list(sensors.values())
+
+        return report
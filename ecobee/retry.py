@@ -0,0 +1,136 @@
+# vim: set fileencoding=utf-8
+"""
+Retry and circuit breaker settings for API requests.
+
+    policy = ecobee.RetryPolicy(retries=3, backoff=1.0, breaker_failures=10)
+    eapi = ecobee.Client(apikey, retry=policy)
+
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """How to retry failed requests.
+
+    Server errors and connection errors are retried with exponential
+    backoff and jitter, for POSTs only if they can't have been applied.
+    Each endpoint gets a circuit breaker, which
+    opens after breaker_failures failures in a row, and then fails
+    requests straight away for breaker_reset seconds.
+    """
+
+    def __init__(self, retries=2, backoff=0.5, max_backoff=10.0, jitter=0.5,
+                 breaker_failures=5, breaker_reset=30.0):
+        """
+          retries:          times to retry a failed request, 0 to disable
+          backoff:          seconds to wait before the first retry, doubled
+                            for each retry after that
+          max_backoff:      most seconds to wait before a retry
+          jitter:           randomize each wait by up to this fraction of it
+          breaker_failures: failures in a row to open the circuit breaker,
+                            0 to disable
+          breaker_reset:    seconds the breaker stays open before letting
+                            a request try again
+
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number 'attempt', from 0"""
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+
+    def breaker(self):
+        """New circuit breaker for an endpoint, or None if disabled"""
+        if not self.breaker_failures:
+            return None
+        return CircuitBreaker(self.breaker_failures, self.breaker_reset)
+
+
+# never retry
+NO_RETRY = RetryPolicy(retries=0, breaker_failures=0)
+
+
+class CircuitBreaker(object):
+    """Fails fast after too many failures in a row.
+
+    Closed: requests go through.  Open: requests are refused until
+    reset_timeout has passed.  Half open: one request is let through,
+    and closes the breaker if it succeeds or opens it again if not.
+
+    Each request allow() lets through ends with success(), failure() or,
+    if it stopped for some other reason, abandon().
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=5, reset_timeout=30.0):
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        # thread sending the half-open trial request
+        self._trial = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+
+    def allow(self):
+        """May a request be sent now?"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._trial is None:
+                self._trial = threading.get_ident()
+                return True
+            return False
+
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trial = None
+
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial is not None or self.failures >= self.threshold:
+                self.opened = time.monotonic()
+            self._trial = None
+
+
+    def abandon(self):
+        """The calling thread's request ended without success() or
+        failure(), eg: it ran out of time.  If it was the half-open
+        trial, the breaker opens again, so another trial can go later."""
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self.opened = time.monotonic()
+                self._trial = None
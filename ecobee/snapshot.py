@@ -0,0 +1,210 @@
+# vim: set fileencoding=utf-8
+"""
+Compact thermostat status.
+
+With Client(compact=True), each thermostat's status is kept as a
+ThermostatSnapshot rather than the decoded JSON.  Snapshots are read-only
+mappings with the same keys and values as the JSON, so Thermostat, Sensor
+and code reading eapi._status work the same, but known fields are kept in
+slots, strings are interned and equipmentStatus is kept as a bitset.
+Fields the API adds that aren't listed here are kept too, in a dict.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections.abc
+import sys
+
+
+_MISSING = object()
+
+# equipment that can be running, one bit each in order
+EQUIPMENT = (
+    'heatPump', 'heatPump2', 'heatPump3', 'compCool1', 'compCool2',
+    'auxHeat1', 'auxHeat2', 'auxHeat3', 'fan', 'humidifier', 'dehumidifier',
+    'ventilator', 'economizer', 'compHotWater', 'auxHotWater',
+)
+EQUIPMENT_BITS = dict((name, 1 << i) for i, name in enumerate(EQUIPMENT))
+
+
+def encode_equipment(running):
+    """equipmentStatus string as a bitset, or the string if there's
+    equipment the bitset doesn't know"""
+    bits = 0
+    for name in running.split(','):
+        if not name:
+            continue
+        bit = EQUIPMENT_BITS.get(name)
+        if bit is None:
+            return sys.intern(running)
+        bits |= bit
+    return bits
+
+
+def decode_equipment(bits):
+    """equipmentStatus string from encode_equipment()"""
+    if isinstance(bits, str):
+        return bits
+    return ','.join(name for name in EQUIPMENT if bits & EQUIPMENT_BITS[name])
+
+
+def _compact(value):
+    """Intern strings and turn lists into tuples"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return tuple(_compact(v) for v in value)
+    return value
+
+
+class Record(collections.abc.Mapping):
+    """Read-only mapping with its known keys in slots.  Subclasses set
+    __slots__ to their fields, and converters maps fields to functions
+    decoding their JSON values."""
+
+    __slots__ = ('_extra',)
+    converters = {}
+    _fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __init__(self, data=None):
+        self._extra = None
+        converters = self.converters
+        for key, value in (data or {}).items():
+            self._set(key, converters.get(key, _compact)(value))
+
+    def _set(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[sys.intern(key)] = value
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, dict(self))
+
+    def merge(self, other):
+        """New record with other's values replacing this one's"""
+        new = self.__class__.__new__(self.__class__)
+        new._extra = None
+        for record in (self, other):
+            for key in record.__slots__:
+                value = getattr(record, key, _MISSING)
+                if value is not _MISSING:
+                    setattr(new, key, value)
+            if record._extra:
+                new._extra = dict(new._extra or {}, **record._extra)
+        return new
+
+
+class Runtime(Record):
+    __slots__ = (
+        'runtimeRev', 'connected', 'firstConnected', 'connectDateTime',
+        'disconnectDateTime', 'lastModified', 'lastStatusModified', 'runtimeDate',
+        'runtimeInterval', 'actualTemperature', 'actualHumidity', 'rawTemperature',
+        'showIconMode', 'desiredHeat', 'desiredCool', 'desiredHumidity',
+        'desiredDehumidity', 'desiredFanMode', 'desiredHeatRange', 'desiredCoolRange',
+        'actualAQAccuracy', 'actualAQScore', 'actualCO2', 'actualVOC',
+    )
+
+
+class Settings(Record):
+    __slots__ = (
+        'hvacMode', 'lastServiceDate', 'serviceRemindMe', 'monthsBetweenService',
+        'remindMeDate', 'vent', 'ventilatorMinOnTime', 'serviceRemindTechnician',
+        'eiLocation', 'coldTempAlert', 'coldTempAlertEnabled', 'hotTempAlert',
+        'hotTempAlertEnabled', 'coolStages', 'heatStages', 'maxSetBack', 'maxSetForward',
+        'quickSaveSetBack', 'quickSaveSetForward', 'hasHeatPump', 'hasForcedAir',
+        'hasBoiler', 'hasHumidifier', 'hasErv', 'hasHrv', 'condensationAvoid',
+        'useCelsius', 'useTimeFormat12', 'locale', 'humidity', 'humidifierMode',
+        'backlightOnIntensity', 'backlightSleepIntensity', 'backlightOffTime',
+        'soundTickVolume', 'soundAlertVolume', 'compressorProtectionMinTime',
+        'compressorProtectionMinTemp', 'stage1HeatingDifferentialTemp',
+        'stage1CoolingDifferentialTemp', 'stage1HeatingDissipationTime',
+        'stage1CoolingDissipationTime', 'heatPumpReversalOnCool', 'fanControlRequired',
+        'fanMinOnTime', 'heatCoolMinDelta', 'tempCorrection', 'holdAction',
+        'heatPumpGroundWater', 'hasElectric', 'hasDehumidifier', 'dehumidifierMode',
+        'dehumidifierLevel', 'dehumidifyWithAC', 'dehumidifyOvercoolOffset',
+        'autoHeatCoolFeatureEnabled', 'wifiOfflineAlert', 'heatMinTemp', 'heatMaxTemp',
+        'coolMinTemp', 'coolMaxTemp', 'heatRangeHigh', 'heatRangeLow', 'coolRangeHigh',
+        'coolRangeLow', 'userAccessCode', 'userAccessSetting', 'auxRuntimeAlert',
+        'auxOutdoorTempAlert', 'auxMaxOutdoorTemp', 'auxRuntimeAlertNotify',
+        'auxOutdoorTempAlertNotify', 'auxRuntimeAlertNotifyTechnician',
+        'auxOutdoorTempAlertNotifyTechnician', 'disablePreHeating', 'disablePreCooling',
+        'installerCodeRequired', 'drAccept', 'isRentalProperty', 'useZoneController',
+        'randomStartDelayCool', 'randomStartDelayHeat', 'humidityHighAlert',
+        'humidityLowAlert', 'disableHeatPumpAlerts', 'disableAlertsOnIdt',
+        'humidityAlertNotify', 'humidityAlertNotifyTechnician', 'tempAlertNotify',
+        'tempAlertNotifyTechnician', 'monthlyElectricityBillLimit',
+        'enableElectricityBillAlert', 'enableProjectedElectricityBillAlert',
+        'electricityBillingDayOfMonth', 'electricityBillCycleMonths',
+        'electricityBillStartMonth', 'ventilatorMinOnTimeHome', 'ventilatorMinOnTimeAway',
+        'backlightOffDuringSleep', 'autoAway', 'smartCirculation', 'followMeComfort',
+        'ventilatorType', 'isVentilatorTimerOn', 'ventilatorOffDateTime', 'hasUVFilter',
+        'coolingLockout', 'ventilatorFreeCooling', 'dehumidifyWhenHeating',
+        'ventilatorDehumidify', 'groupRef', 'groupName', 'groupSetting',
+    )
+
+
+class Capability(Record):
+    __slots__ = ('id', 'type', 'value')
+
+
+def _capabilities(capabilities):
+    return tuple(Capability(c) for c in capabilities)
+
+
+class SensorRecord(Record):
+    __slots__ = ('id', 'name', 'type', 'code', 'inUse', 'capability')
+    converters = {'capability': _capabilities}
+
+
+def _sensors(sensors):
+    """remoteSensors as a dict of sensor ID to SensorRecord"""
+    return dict((sys.intern(s['id']), SensorRecord(s)) for s in sensors)
+
+
+class ThermostatSnapshot(Record):
+    """One thermostat from a /thermostat response.  Sections other than
+    runtime, settings, equipment and sensors are kept as decoded."""
+
+    __slots__ = (
+        'identifier', 'name', 'thermostatRev', 'isRegistered', 'modelNumber',
+        'brand', 'features', 'lastModified', 'thermostatTime', 'utcTime',
+        'runtime', 'settings', 'equipmentStatus', 'remoteSensors',
+    )
+    converters = {
+        'runtime':          Runtime,
+        'settings':         Settings,
+        'equipmentStatus':  encode_equipment,
+        'remoteSensors':    _sensors,
+    }
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if key == 'equipmentStatus':
+            return decode_equipment(value)
+        return value
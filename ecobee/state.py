@@ -0,0 +1,151 @@
+# vim: set fileencoding=utf-8
+"""
+Saving a Client's cached state, so a restarted process carries on where
+it left off.
+
+    eapi = ecobee.Client(apikey, lazy=True)
+    eapi.load_state('/var/cache/ecobee.state')
+    while True:
+        eapi.update_changed()
+        eapi.save_state('/var/cache/ecobee.state')
+
+After loading, thermostats can be read straight away, and the first
+poll only reports thermostats that changed since the state was saved.
+
+The file is msgpack if it's installed, pickle if not.  Only load pickle
+files you wrote yourself.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections.abc
+import os
+import pickle
+import struct
+import tempfile
+import time
+
+
+MAGIC = b'ECOBEE'
+# bump when the saved data changes
+VERSION = 1
+MSGPACK = b'M'
+PICKLE = b'P'
+_HEADER = struct.Struct('>6scH')
+
+
+def _msgpack():
+    """The msgpack module, or None if it's not installed"""
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def _plain(value):
+    """Mappings and tuples as dicts and lists, which any format can hold"""
+    if isinstance(value, collections.abc.Mapping):
+        return dict((k, _plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return list(_plain(v) for v in value)
+    return value
+
+
+def _thermostat(status):
+    """A status entry as it came from /thermostat, sensors as a list"""
+    data = _plain(status)
+    if isinstance(data.get('remoteSensors'), dict):
+        data['remoteSensors'] = list(data['remoteSensors'].values())
+    return data
+
+
+def dump(client):
+    """The client's state as a dict"""
+    with client._status_lock:
+        return {
+            'version':        VERSION,
+            'saved':          time.time(),
+            'thermostat_ids': list(client.thermostat_ids),
+            'names':          dict(client.thermostat_ids.names),
+            'status':         list(_thermostat(s) for s in client._status.values() if s),
+            'lastSeen':       dict(client.lastSeen),
+            'revisions':      _plain(client.revisions),
+        }
+
+
+def restore(client, state):
+    """Load a dict from dump() into the client"""
+    client.thermostat_ids.extend(tid for tid in state['thermostat_ids']
+                                 if tid not in client.thermostat_ids)
+    for name, tid in state['names'].items():
+        client.thermostat_ids.set_name(tid, name)
+
+    with client._status_lock:
+        for tid in client.thermostat_ids:
+            client._status.setdefault(tid, {})
+        # readings from when it was saved, not new ones for the history
+        client._update_result({'thermostatList': state['status']}, record=False)
+        client.lastSeen.update(state['lastSeen'])
+        for tid, sections in state['revisions'].items():
+            client.revisions.setdefault(tid, {}).update(
+                (section, tuple(revision)) for section, revision in sections.items())
+
+
+def save(client, path, format=None):
+    """Write the client's state to path, replacing it atomically.
+
+      format:   MSGPACK or PICKLE, default msgpack if it's installed
+
+    """
+    state = dump(client)
+    msgpack = _msgpack()
+    if format is None:
+        format = MSGPACK if msgpack is not None else PICKLE
+
+    if format == MSGPACK:
+        body = msgpack.packb(state, use_bin_type=True)
+    else:
+        body = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.ecobee-state-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, format, VERSION))
+            f.write(body)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def load(client, path):
+    """Load state saved by save() into the client.  Returns False, and
+    leaves the client alone, if there's no file or it's from a different
+    version."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return False
+
+    if len(data) < _HEADER.size:
+        return False
+    magic, format, version = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return False
+
+    body = data[_HEADER.size:]
+    if format == MSGPACK:
+        msgpack = _msgpack()
+        if msgpack is None:
+            return False
+        state = msgpack.unpackb(body, raw=False)
+    elif format == PICKLE:
+        state = pickle.loads(body)
+    else:
+        return False
+
+    restore(client, state)
+    return True
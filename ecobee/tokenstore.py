@@ -0,0 +1,200 @@
+# vim: set fileencoding=utf-8
+"""
+Storage for authentication tokens.
+
+A token store is dict-like, and has a lock() that makes a block of reads
+and writes exclusive, so only one thread or process refreshes the tokens
+at a time:
+
+    with store.lock():
+        if store.get('expiration') < now:
+            store['access_token'] = ...
+
+MemoryTokenStore is for one process, ShelveTokenStore and SQLiteTokenStore
+can be shared by several processes using the same file.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import abc
+import contextlib
+import os
+import pickle
+import shelve
+import sqlite3
+import threading
+
+# file locks are only available on unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock(object):
+    """Reentrant lock that's exclusive between threads, and between
+    processes using the same lock file where the OS supports it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except Exception:
+                self._release_file()
+                self._depth -= 1
+                self._lock.release()
+                raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._release_file()
+        self._lock.release()
+
+    def _release_file(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class TokenStore(abc.ABC):
+    """Base class for token stores.  Subclasses implement _read(),
+    _write() and lock()."""
+
+    @abc.abstractmethod
+    def lock(self):
+        """Context manager making the enclosed block exclusive"""
+
+    @abc.abstractmethod
+    def _read(self, key):
+        """Return the value for key, raise KeyError if missing"""
+
+    @abc.abstractmethod
+    def _write(self, key, value):
+        """Store the value for key"""
+
+    def __getitem__(self, key):
+        with self.lock():
+            return self._read(key)
+
+    def __setitem__(self, key, value):
+        with self.lock():
+            self._write(key, value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, values):
+        """Set several values at once"""
+        with self.lock():
+            for key, value in values.items():
+                self._write(key, value)
+
+    def close(self):
+        pass
+
+
+class MemoryTokenStore(TokenStore):
+    """Tokens kept in memory, or in a dict-like object you provide.
+    Safe to share between threads."""
+
+    def __init__(self, data=None):
+        self.data = {} if data is None else data
+        self._lock = threading.RLock()
+
+    def lock(self):
+        return self._lock
+
+    def _read(self, key):
+        return self.data[key]
+
+    def _write(self, key, value):
+        self.data[key] = value
+
+    def close(self):
+        if hasattr(self.data, 'close'):
+            self.data.close()
+
+
+class ShelveTokenStore(TokenStore):
+    """Tokens kept in a shelve file, opened for each access under a file
+    lock.  Safe to share between threads and processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + '.lock')
+        self._shelf = None
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._lock:
+            # keep the shelf open for the whole locked block
+            if self._shelf is not None:
+                yield
+                return
+            self._shelf = shelve.open(self.path)
+            try:
+                yield
+            finally:
+                self._shelf.close()
+                self._shelf = None
+
+    def _read(self, key):
+        return self._shelf[key]
+
+    def _write(self, key, value):
+        self._shelf[key] = value
+
+
+class SQLiteTokenStore(TokenStore):
+    """Tokens kept in an SQLite database, under a file lock.
+    Safe to share between threads and processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + '.lock')
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, value BLOB)")
+
+    def lock(self):
+        return self._lock
+
+    def _read(self, key):
+        row = self._db.execute("SELECT value FROM tokens WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def _write(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?)", (key, pickle.dumps(value)))
+
+    def close(self):
+        self._db.close()
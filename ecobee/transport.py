@@ -0,0 +1,150 @@
+# vim: set fileencoding=utf-8
+"""
+HTTP transport used by ecobee.Client.
+
+A Transport owns a pooled, keep-alive requests.Session, so repeated calls
+to the Ecobee API reuse their TCP/TLS connections.  One Transport can be
+shared between several Client instances.
+
+hedged() sends a second copy of a slow request and takes whichever
+answer arrives first.
+"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import collections
+import concurrent.futures
+import math
+import threading
+
+import requests
+import requests.adapters
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+
+class Transport(object):
+    """Pooled HTTP transport.
+
+       transport = ecobee.Transport(pool_size=20)
+       eapi1 = ecobee.Client(apikey1, transport=transport)
+       eapi2 = ecobee.Client(apikey2, transport=transport)
+
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_connections=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 keep_alive=True, gzip=True, session=None):
+        """
+          pool_size:        max connections kept open per host
+          pool_connections: number of per-host pools to cache, default pool_size
+          connect_timeout:  seconds to wait for a connection
+          read_timeout:     seconds to wait for a response
+          keep_alive:       reuse connections between requests
+          gzip:             ask the server for gzip-compressed responses
+          session:          use this requests.Session instead of creating one
+
+        """
+        self.timeout = (connect_timeout, read_timeout)
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections = pool_connections or pool_size,
+                pool_maxsize     = pool_size,
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+        if gzip:
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+        if keep_alive:
+            session.headers['Connection'] = 'keep-alive'
+        else:
+            session.headers['Connection'] = 'close'
+
+        self.session = session
+
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Send a request, using the default timeouts unless given"""
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+
+def wire_size(response):
+    """Bytes of a response body as it came over the network, before any
+    gzip is undone: its Content-Length, or the body's size without one"""
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    return len(response.content)
+
+
+class LatencyTracker(object):
+    """Recent request latencies, for picking a hedging delay"""
+
+    def __init__(self, window=100):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """The p'th percentile (0 to 1) of the recent latencies,
+        or None if there aren't any"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        # nearest rank: the smallest sample with p of them at or below it
+        return samples[max(0, math.ceil(p * len(samples)) - 1)]
+
+
+def hedged(send, delay, executor, allow=None):
+    """Call send() on the executor, and if it hasn't finished after
+    'delay' seconds, call it again.  Returns the result of whichever
+    finishes first, or raises the error if both fail.
+
+    allow() is asked before sending the second request, like a rate
+    limiter's try_acquire(); if it says no, only the first is waited for.
+    """
+
+    first = executor.submit(send)
+    done, _ = concurrent.futures.wait([first], timeout=delay)
+    if done or (allow is not None and not allow()):
+        return first.result()
+
+    pending = {first, executor.submit(send)}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
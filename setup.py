@@ -8,6 +8,13 @@ REQUIRES = [
     'requests>=2,<3',
 ]
 
+EXTRAS = {
+    'numpy': ['numpy'],
+    'orjson': ['orjson'],
+    'ujson': ['ujson'],
+    'msgpack': ['msgpack'],
+}
+
 setup(
     name=PACKAGE_NAME,
     version='1.0.0',
@@ -19,14 +26,22 @@ setup(
     include_package_data=True,
     zip_safe=False,
     platforms='any',
+    python_requires='>=3.7',
     install_requires=REQUIRES,
+    extras_require=EXTRAS,
     keywords=['home', 'automation'],
     classifiers=[
         'Intended Audience :: End Users/Desktop',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Home Automation'
     ]
 )
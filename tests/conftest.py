@@ -0,0 +1,30 @@
+# vim: set fileencoding=utf-8
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import concurrent.futures
+import threading
+
+import pytest
+
+from ecobee.fakeserver import FakeEcobee
+
+
+@pytest.fixture
+def server():
+    """A fake Ecobee API server with a few thermostats"""
+    with FakeEcobee(thermostats=3, seed=1) as server:
+        yield server
+
+
+def run_together(func, count):
+    """Call func from 'count' threads at once, return their results"""
+    barrier = threading.Barrier(count)
+
+    def call():
+        barrier.wait()
+        return func()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as pool:
+        futures = list(pool.submit(call) for _ in range(count))
+        return list(f.result() for f in futures)
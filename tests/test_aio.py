@@ -0,0 +1,90 @@
+# vim: set fileencoding=utf-8
+"""AsyncClient runs as many requests at once as its concurrency allows"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import asyncio
+import datetime
+import gc
+import time
+import warnings
+
+import ecobee
+from ecobee.fakeserver import FakeEcobee
+
+
+def test_concurrency_beyond_workers():
+    # ten pages of 25, which four workers would fetch in three rounds
+    with FakeEcobee(thermostats=250, latency=0.2) as server:
+        client = server.client(cls=ecobee.AsyncClient, workers=4, concurrency=10)
+        asyncio.run(client.thermostatSummary())
+
+        start = time.monotonic()
+        asyncio.run(client.update())
+
+        assert time.monotonic() - start < 0.5
+        assert len(client._status) == 250
+
+
+def test_get_thermostats(server):
+    client = server.client(cls=ecobee.AsyncClient)
+
+    async def get():
+        thermostats = await client.list_thermostats()
+        return thermostats, await client.get_thermostat(thermostats[0].id)
+
+    thermostats, thermostat = asyncio.run(get())
+
+    assert len(thermostats) == 3
+    assert thermostat is thermostats[0]
+
+
+def test_no_thermostats():
+    # nothing to load: must not leave an update() coroutine unawaited
+    with FakeEcobee(thermostats=0) as server:
+        client = server.client(cls=ecobee.AsyncClient)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            assert asyncio.run(client.get_thermostat('1')) is None
+            assert asyncio.run(client.list_thermostats()) == []
+            assert asyncio.run(client.get_thermostats(['1'])) == []
+            gc.collect()
+
+        assert not list(w for w in caught if issubclass(w.category, RuntimeWarning))
+
+
+def test_report_rows(server):
+    client = server.client(cls=ecobee.AsyncClient)
+    asyncio.run(client.thermostatSummary())
+    start = datetime.date(2026, 1, 1)
+    end = start + datetime.timedelta(days=ecobee.REPORT_MAX_DAYS + 4)
+
+    async def rows():
+        return list([row async for row in client.runtimeReportRows(
+            start_date=start, end_date=end, columns=['zoneAveTemp'])])
+
+    keys = list((row.thermostat_id, row.timestamp) for row in asyncio.run(rows()))
+    assert keys == sorted(keys)
+    assert len(keys) == 3 * 36 * 288
+
+
+def test_refresh_rolls_back_after_no_answer(server):
+    client = server.client(cls=ecobee.AsyncClient, summary_ttl=0)
+    asyncio.run(client.refresh())
+
+    changed = server.change(fraction=0.5)
+    server.fail(14, count=2, endpoint='thermostat')
+    assert asyncio.run(client.refresh()) == []
+    assert asyncio.run(client.refresh()) == changed
+
+
+def test_state(server, tmp_path):
+    path = str(tmp_path / 'state')
+    client = server.client(cls=ecobee.AsyncClient)
+    asyncio.run(client.update())
+    asyncio.run(client.save_state(path))
+
+    loaded = server.client(cls=ecobee.AsyncClient)
+    assert asyncio.run(loaded.load_state(path))
+    assert loaded._status == client._status
@@ -0,0 +1,47 @@
+# vim: set fileencoding=utf-8
+"""A half-open breaker whose trial request gives up lets another try later"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import threading
+
+from ecobee.retry import CircuitBreaker
+
+
+def half_open_breaker():
+    """A breaker that has opened and waited out its reset timeout"""
+    breaker = CircuitBreaker(failures=1, reset_timeout=0.0)
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+
+def test_abandoned_trial_allows_another():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.abandon()
+
+    assert breaker.allow()
+
+
+def test_abandon_from_another_thread_keeps_trial():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+
+    other = threading.Thread(target=breaker.abandon)
+    other.start()
+    other.join()
+
+    assert not breaker.allow()
+
+
+def test_abandon_after_success_stays_closed():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.success()
+
+    breaker.abandon()
+
+    assert breaker.state == CircuitBreaker.CLOSED
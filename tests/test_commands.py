@@ -0,0 +1,57 @@
+# vim: set fileencoding=utf-8
+"""CommandQueue sends identical commands together, drops the ones that
+were replaced, and fails every future of a batch that fails"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import pytest
+
+import ecobee
+
+
+CALL = ('POST', 'thermostat')
+
+
+def test_identical_commands_merged(server):
+    client = server.client()
+    with ecobee.CommandQueue(client, window=10) as queue:
+        futures = list(queue.setHold(tid, holdClimateRef='away') for tid in server.thermostats)
+
+    assert all(f.result()['status']['code'] == 0 for f in futures)
+    assert server.calls[CALL] == 1
+    assert all(t.hold['holdClimateRef'] == 'away' for t in server.thermostats.values())
+
+
+def test_superseded_hold_collapsed(server):
+    client = server.client()
+    tid = next(iter(server.thermostats))
+    with ecobee.CommandQueue(client, window=10) as queue:
+        first = queue.setHold(tid, heatHoldTemp=65, coolHoldTemp=78)
+        second = queue.setHold(tid, heatHoldTemp=70, coolHoldTemp=75)
+
+    # the replaced command gets the result of the one that replaced it
+    assert first.result() == second.result()
+    assert server.calls[CALL] == 1
+    assert server.thermostats[tid].heat == 700
+
+
+def test_failure_reaches_every_future(server):
+    client = server.client(retry=ecobee.NO_RETRY)
+    server.fail(4, endpoint='thermostat')
+    with ecobee.CommandQueue(client, window=10) as queue:
+        futures = list(queue.resumeProgram(tid) for tid in server.thermostats)
+
+    for future in futures:
+        with pytest.raises(ecobee.EcobeeException):
+            future.result()
+
+
+def test_no_answer_is_a_failure(server):
+    client = server.client()
+    # error 14 for the request and for its replay
+    server.fail(14, count=2, endpoint='thermostat')
+    with ecobee.CommandQueue(client, window=10) as queue:
+        future = queue.resumeProgram(next(iter(server.thermostats)))
+
+    with pytest.raises(ecobee.EcobeeException):
+        future.result()
@@ -0,0 +1,73 @@
+# vim: set fileencoding=utf-8
+"""Hedged reads cut tail latency, and a timeout covers every request
+of a call"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import math
+import time
+
+import pytest
+
+import ecobee
+from ecobee.fakeserver import FakeEcobee
+
+
+REQUESTS = 100
+SUMMARY = {'selection': {'selectionType': 'registered', 'selectionMatch': ''}}
+
+
+def p99(client):
+    """99th percentile seconds of REQUESTS summary requests"""
+    times = []
+    for _ in range(REQUESTS):
+        start = time.monotonic()
+        client.get('thermostatSummary', SUMMARY)
+        times.append(time.monotonic() - start)
+    return sorted(times)[math.ceil(0.99 * REQUESTS) - 1]
+
+
+def test_hedging_cuts_p99():
+    # one request in twenty stalls for 300 ms
+    with FakeEcobee(thermostats=3, stall=0.05, stall_time=0.3, seed=1) as server:
+        assert p99(server.client()) >= 0.3
+        # hedge=True waits for the 95th percentile, which with 5% of
+        # requests stalling is often the stall itself, so set the wait
+        assert p99(server.client(hedge=0.05)) < 0.15
+
+
+def test_hedging_at_p95_cuts_p99():
+    with FakeEcobee(thermostats=3, latency=0.01, seed=1) as server:
+        plain = server.client()
+        client = server.client(hedge=True)
+        # learn the usual latency, so its 95th percentile is the wait
+        p99(client)
+        assert client._hedge_delay('thermostatSummary') < 0.05
+
+        # one request in twenty-five stalls for 300 ms, fewer than the
+        # 5% that hedging at the 95th percentile lets through
+        server.stall, server.stall_time = 0.04, 0.3
+        assert p99(plain) >= 0.3
+        assert p99(client) < 0.1
+
+
+def test_hedge_within_rate_limit():
+    with FakeEcobee(thermostats=3, stall=1, stall_time=0.2) as server:
+        # room for the first request, but not its hedge
+        client = server.client(hedge=0.05, rate_limit=ecobee.RateLimiter(0.1))
+
+        assert client.get('thermostatSummary', SUMMARY)['thermostatCount'] == 3
+        # a hedge would still be stalling, give it time to be counted
+        time.sleep(0.2)
+        assert server.calls[('GET', 'thermostatSummary')] == 1
+
+
+def test_update_timeout_covers_summary():
+    with FakeEcobee(thermostats=3, latency=0.5) as server:
+        client = server.client()
+
+        start = time.monotonic()
+        with pytest.raises(ecobee.TimeoutException):
+            client.update(timeout=0.1)
+        assert time.monotonic() - start < 0.4
+        assert server.calls[('GET', 'thermostat')] == 0
@@ -0,0 +1,112 @@
+# vim: set fileencoding=utf-8
+"""A Fleet polls each account once per interval, forgets removed
+accounts, and finds the account a thermostat is in"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import datetime
+import threading
+
+import pytest
+
+import ecobee
+from ecobee.fakeserver import FakeEcobee
+
+
+CALL = ('GET', 'thermostatSummary')
+
+
+@pytest.fixture
+def fleet():
+    with ecobee.Fleet(workers=4, concurrency=2, min_interval=60, stagger=False) as fleet:
+        yield fleet
+
+
+def add(fleet, server, name):
+    """Add an account on the fake server, with its current tokens"""
+    tokens = dict(access_token=server.access_token, refresh_token=server.refresh_token,
+                  required=False, expiration=datetime.datetime.now() + datetime.timedelta(hours=1))
+    return fleet.add('fakekey', name=name, url_base=server.url,
+                     authstore=ecobee.MemoryTokenStore(tokens), summary_ttl=0)
+
+
+def test_polls_each_account_once_per_interval(server, fleet):
+    server.issue_tokens()
+    add(fleet, server, 'a')
+    add(fleet, server, 'b')
+
+    results = fleet.run_pending()
+    assert results == {'a': list(server.thermostats), 'b': list(server.thermostats)}
+    assert server.calls[CALL] == 2
+
+    # neither is due again for a minute
+    assert fleet.run_pending() == {}
+    assert 59 < fleet.next_due() <= 60
+    assert server.calls[CALL] == 2
+
+
+def test_removed_account_is_not_polled(server, fleet):
+    server.issue_tokens()
+    add(fleet, server, 'a')
+    fleet.remove('a')
+
+    assert fleet.next_due() is None
+    assert fleet.run_pending() == {}
+    assert server.calls[CALL] == 0
+
+    # added again, it's polled once, not once for each time it was added
+    add(fleet, server, 'a')
+    assert list(fleet.run_pending()) == ['a']
+    assert server.calls[CALL] == 1
+    assert fleet.run_pending() == {}
+
+
+def test_removed_while_polling(fleet):
+    with FakeEcobee(thermostats=2, latency=0.2) as server:
+        server.issue_tokens()
+        add(fleet, server, 'a')
+        futures = fleet.run_pending(wait=False)
+        fleet.remove('a')
+
+        assert futures['a'].result() == list(server.thermostats)
+        # not scheduled again, nor indexed
+        assert fleet.next_due() is None
+        assert fleet.account(next(iter(server.thermostats))) is None
+
+
+def test_duplicate_name_creates_no_client(server, fleet, monkeypatch):
+    server.issue_tokens()
+    add(fleet, server, 'a')
+
+    created = threading.Event()
+    monkeypatch.setattr(ecobee, 'Client', lambda *args, **kwargs: created.set())
+    with pytest.raises(ValueError):
+        add(fleet, server, 'a')
+    assert not created.is_set()
+    assert len(fleet) == 1
+
+
+def test_lookup(fleet):
+    with FakeEcobee(thermostats=2, seed=1) as one, FakeEcobee(thermostats=1, seed=2) as two:
+        # give the second account's thermostat an ID of its own
+        thermostat = two.thermostats.popitem()[1]
+        thermostat.identifier = '410000000000'
+        two.thermostats[thermostat.identifier] = thermostat
+        one.issue_tokens()
+        two.issue_tokens()
+        add(fleet, one, 'one')
+        add(fleet, two, 'two')
+        assert fleet.account(next(iter(one.thermostats))) is None
+
+        fleet.run_pending()
+        for server, name in ((one, 'one'), (two, 'two')):
+            for tid in server.thermostats:
+                assert fleet.account(tid) == name
+                assert fleet.client_for(tid) is fleet.clients[name]
+                assert fleet.get_thermostat(tid).id == tid
+        assert len(list(fleet.thermostats())) == 3
+
+        fleet.remove('one')
+        assert all(fleet.account(tid) is None for tid in one.thermostats)
+        assert fleet.get_thermostat(next(iter(one.thermostats))) is None
+        assert fleet.account(next(iter(two.thermostats))) == 'two'
@@ -0,0 +1,75 @@
+# vim: set fileencoding=utf-8
+"""History keeps the most recent readings in ring buffers, and answers
+for a window of them"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import math
+
+import ecobee
+
+
+TID = '310000000000'
+
+
+def test_ring_buffer_wraps():
+    buf = ecobee.RingBuffer(capacity=4)
+    for i in range(6):
+        buf.append(float(i), when=i)
+
+    # the two oldest are dropped, and the rest are still in order
+    assert len(buf) == 4
+    assert list(buf.values()) == [2.0, 3.0, 4.0, 5.0]
+    assert list(buf.times()) == [2.0, 3.0, 4.0, 5.0]
+    assert buf.last() == (5.0, 5.0)
+    assert (buf.min(), buf.max(), buf.mean()) == (2.0, 5.0, 3.5)
+
+
+def test_ring_buffer_window():
+    buf = ecobee.RingBuffer(capacity=4)
+    for i in range(6):
+        buf.append(None if i == 4 else float(i), when=i)
+
+    # readings at or after now - seconds, across the end of the array
+    values = buf.values(2, now=5)
+    assert list(buf.times(2, now=5)) == [3.0, 4.0, 5.0]
+    assert (values[0], values[2]) == (3.0, 5.0)
+    assert math.isnan(values[1])
+    assert list(buf.values(0.5, now=5)) == [5.0]
+    assert len(buf.values(0.5, now=6)) == 0
+    # missing readings are left out
+    assert buf.mean(2, now=5) == 4.0
+    assert buf.before(3) == (2.0, 2.0)
+    assert buf.before(2) is None
+
+
+def status(runtime, equipment):
+    return {TID: {'runtime': runtime, 'equipmentStatus': equipment}}
+
+
+def test_equipment_recorded_when_it_changes():
+    history = ecobee.History()
+    runtime = {'actualTemperature': 700, 'actualHumidity': 40}
+
+    history.record(status(runtime, 'compCool1'), when=0)
+    # same runtime, but the compressor stopped
+    history.record(status(runtime, ''), when=60)
+    # new readings, still off
+    history.record(status(dict(runtime), ''), when=120)
+
+    assert list(history.series(TID, 'equipment').times()) == [0.0, 60.0]
+    assert list(history.series(TID, 'temperature').times()) == [0.0, 120.0]
+
+
+def test_on_time_counts_reading_before_window():
+    history = ecobee.History()
+    runtime = {'actualTemperature': 700, 'actualHumidity': 40}
+    history.record(status(runtime, 'compCool1'), when=0)
+    history.record(status(runtime, ''), when=100)
+    history.record(status(runtime, 'compCool1'), when=200)
+
+    # on since 0, so all of 30 to 80
+    assert history.on_time(TID, 'compCool1', 50, now=80) == 50
+    # 50 to 100, then 200 to 250
+    assert history.on_time(TID, 'compCool1', 200, now=250) == 100
+    assert history.on_time(TID, 'heatPump', 200, now=250) == 0
@@ -0,0 +1,35 @@
+# vim: set fileencoding=utf-8
+"""Metrics count bytes as they went over the network, and the bytes
+each decode took"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import requests
+
+import ecobee
+from ecobee.transport import wire_size
+
+
+def response(body, length=None):
+    r = requests.Response()
+    r._content = body
+    if length is not None:
+        r.headers['Content-Length'] = str(length)
+    return r
+
+
+def test_wire_size_before_decompression():
+    # gzip made the 1000 bytes 40 on the wire
+    assert wire_size(response(b'x' * 1000, length=40)) == 40
+    assert wire_size(response(b'x' * 1000)) == 1000
+
+
+def test_decoded_bytes(server):
+    metrics = ecobee.Metrics()
+    client = server.client(observer=metrics)
+    client.thermostatSummary()
+
+    received = metrics.received[('GET', 'thermostatSummary')]
+    assert received > 0
+    assert metrics.decoded['thermostatSummary'] == received
+    assert 'ecobee_decode_bytes_total{endpoint="thermostatSummary"} ' in metrics.prometheus()
@@ -0,0 +1,25 @@
+# vim: set fileencoding=utf-8
+"""Thermostat objects are shared, and one caller's sections don't change
+what another's update() fetches"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+
+def test_sections_not_changed_by_other_callers(server):
+    client = server.client(summary_ttl=0)
+    client.update()
+    tid = client.thermostat_ids[0]
+
+    thermostat = client.get_thermostat(tid, sections=['runtime'])
+    assert client.get_thermostat(tid, sections=['settings']) is thermostat
+    assert thermostat.sections == ['runtime']
+
+
+def test_update_takes_sections(server):
+    client = server.client(summary_ttl=0)
+    client.update()
+    thermostat = client.get_thermostat(client.thermostat_ids[0])
+
+    server.change(fraction=1)
+    assert thermostat.update(sections=['equipmentStatus'])
+    assert server.calls[('GET', 'thermostat')] == 2
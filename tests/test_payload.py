@@ -0,0 +1,44 @@
+# vim: set fileencoding=utf-8
+"""Encoded request payloads are kept for the most recent requests, the
+bytes sent are counted as bytes, and codecs implement the whole API"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import pytest
+
+import ecobee
+import ecobee.codec
+
+
+def test_payload_cache_drops_least_recent(server, monkeypatch):
+    monkeypatch.setattr(ecobee, 'PAYLOAD_CACHE_SIZE', 2)
+    client = server.client()
+
+    first = client._update_request(['a'])[1]
+    client._update_request(['b'])
+    assert client._update_request(['a'])[1] is first
+    # 'b' is the least recently used now
+    client._update_request(['c'])
+
+    assert client._update_request(['a'])[1] is first
+    assert list(key[1] for key in client._payloads) == [('c',), ('a',)]
+
+
+def test_sent_counts_bytes(server):
+    metrics = ecobee.Metrics()
+    client = server.client(observer=metrics)
+    data = {'selection': {'selectionType': 'thermostats', 'selectionMatch': ''},
+            'functions': [], 'note': 'température'}
+
+    client.post('thermostat', data)
+
+    assert metrics.sent[('POST', 'thermostat')] == len(client.codec.dumps(data).encode('utf-8'))
+
+
+def test_incomplete_codec():
+    class EncodeOnly(ecobee.codec.Codec):
+        def dumps(self, obj):
+            return ''
+
+    with pytest.raises(TypeError):
+        EncodeOnly()
@@ -0,0 +1,101 @@
+# vim: set fileencoding=utf-8
+"""Only one caller refreshes the access token, however many need it"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import datetime
+import multiprocessing
+
+import pytest
+
+import ecobee
+from ecobee.tokenstore import fcntl
+
+from tests.conftest import run_together
+
+
+THREADS = 16
+PROCESSES = 4
+SUMMARY = {'selection': {'selectionType': 'registered', 'selectionMatch': ''}}
+
+
+def expired_store(server, store=None):
+    """Token store holding tokens from the server that look expired"""
+    store = store if store is not None else ecobee.MemoryTokenStore()
+    store.update(dict(server.issue_tokens(), required=False,
+                      expiration=datetime.datetime.now() - datetime.timedelta(seconds=1)))
+    return store
+
+
+def summary(client):
+    """GET /thermostatSummary, without thermostatSummary()'s lock"""
+    return client.get('thermostatSummary', SUMMARY)
+
+
+def test_concurrent_refresh_after_error_14(server):
+    client = server.client(summary_ttl=0)
+    client.update()
+    server.expire_tokens()
+
+    run_together(client.update, THREADS)
+
+    assert server.calls[('POST', 'token')] == 1
+
+
+def test_concurrent_refresh_of_expired_token(server):
+    client = ecobee.Client('fakekey', authstore=expired_store(server), url_base=server.url,
+                           lazy=True, summary_ttl=0)
+
+    results = run_together(lambda: summary(client), THREADS)
+
+    assert all(r['thermostatCount'] == 3 for r in results)
+    assert server.calls[('POST', 'token')] == 1
+
+
+def test_clients_sharing_a_store_refresh_once(server, tmp_path):
+    store = expired_store(server, ecobee.ShelveTokenStore(str(tmp_path / 'auth')))
+    clients = list(ecobee.Client('fakekey', authstore=store, url_base=server.url,
+                                 lazy=True, summary_ttl=0) for _ in range(4))
+    turn = iter(clients * THREADS)
+
+    results = run_together(lambda: summary(next(turn)), THREADS)
+
+    assert all(r['thermostatCount'] == 3 for r in results)
+    assert server.calls[('POST', 'token')] == 1
+
+
+def summary_in_process(path, url, barrier, results):
+    client = ecobee.Client('fakekey', authfile=path, url_base=url, lazy=True, summary_ttl=0)
+    barrier.wait()
+    results.put(summary(client)['thermostatCount'])
+
+
+@pytest.mark.skipif(fcntl is None, reason="no file locks between processes")
+def test_processes_sharing_a_file_refresh_once(server, tmp_path):
+    path = str(tmp_path / 'auth')
+    expired_store(server, ecobee.ShelveTokenStore(path))
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(PROCESSES)
+    results = context.Queue()
+
+    processes = list(context.Process(target=summary_in_process, args=(path, server.url, barrier, results))
+                     for _ in range(PROCESSES))
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+
+    assert list(results.get(timeout=1) for _ in range(PROCESSES)) == [3] * PROCESSES
+    assert server.calls[('POST', 'token')] == 1
+
+
+def test_incomplete_token_store():
+    class NoLock(ecobee.TokenStore):
+        def _read(self, key):
+            raise KeyError(key)
+
+        def _write(self, key, value):
+            pass
+
+    with pytest.raises(TypeError):
+        NoLock()
@@ -0,0 +1,40 @@
+# vim: set fileencoding=utf-8
+"""ThermostatRegistry keeps its indexes through renames and pickling"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import pickle
+
+from ecobee.registry import ThermostatRegistry
+
+
+def test_rename_forgets_old_name():
+    registry = ThermostatRegistry(['1', '2'])
+    registry.set_name('1', 'Old')
+    registry.set_name('1', 'New')
+
+    assert registry.by_name('New') == '1'
+    assert registry.by_name('Old') is None
+    assert registry.names == {'New': '1'}
+
+
+def test_name_moved_to_another_thermostat():
+    registry = ThermostatRegistry(['1', '2'])
+    registry.set_name('1', 'Upstairs')
+    registry.set_name('2', 'Upstairs')
+    registry.set_name('1', 'Downstairs')
+
+    assert registry.names == {'Upstairs': '2', 'Downstairs': '1'}
+
+
+def test_pickle():
+    registry = ThermostatRegistry(['1', '2'])
+    registry.set_name('2', 'Hall')
+    registry.objects['1'] = object()
+
+    loaded = pickle.loads(pickle.dumps(registry))
+
+    assert loaded == ['1', '2']
+    assert '2' in loaded and '3' not in loaded
+    assert loaded.by_name('Hall') == '2'
+    assert loaded.objects == {}
@@ -0,0 +1,52 @@
+# vim: set fileencoding=utf-8
+"""Runtime reports split into several requests are put back together"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import datetime
+
+import ecobee
+from ecobee.reports import ReportColumns
+
+
+def sensor_entry(tid, sensor, date):
+    return {
+        'thermostatIdentifier': tid,
+        'sensors': [{'sensorId': sensor, 'sensorType': 'temperature'}],
+        'columns': ['date', 'time', sensor],
+        'data':    ['{},00:00:00,70.0'.format(date)],
+    }
+
+
+def test_merge_keeps_thermostat_sensors_together():
+    first = {'startDate': '2026-01-01', 'endDate': '2026-01-31', 'sensorList': [
+        sensor_entry('a', 'rs:1:1', '2026-01-01'),
+        sensor_entry('b', 'rs:2:1', '2026-01-01'),
+    ]}
+    # a's sensors changed, b's didn't
+    second = {'startDate': '2026-02-01', 'endDate': '2026-02-28', 'sensorList': [
+        sensor_entry('a', 'rs:3:1', '2026-02-01'),
+        sensor_entry('b', 'rs:2:1', '2026-02-01'),
+    ]}
+
+    merged = ecobee.Client._report_merge([first, second])
+
+    assert list(s['thermostatIdentifier'] for s in merged['sensorList']) == ['a', 'a', 'b']
+    assert len(merged['sensorList'][2]['data']) == 2
+    columns = ReportColumns.from_sensors(merged)
+    assert columns.thermostats == {'a': (0, 2), 'b': (2, 4)}
+
+
+def test_rows_grouped_by_thermostat_across_date_ranges(server):
+    client = server.client()
+    client.thermostatSummary()
+    # two requests' worth of days
+    start = datetime.date(2026, 1, 1)
+    end = start + datetime.timedelta(days=ecobee.REPORT_MAX_DAYS + 4)
+
+    rows = list(client.runtimeReportRows(start_date=start, end_date=end, columns=['zoneAveTemp']))
+
+    assert server.calls[('GET', 'runtimeReport')] == 2
+    keys = list((row.thermostat_id, row.timestamp) for row in rows)
+    assert keys == sorted(keys)
+    assert len(set(row.thermostat_id for row in rows)) == 3
@@ -0,0 +1,64 @@
+# vim: set fileencoding=utf-8
+"""Runtime reports kept in a ReportStore are only fetched once"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import datetime
+
+import ecobee
+
+
+START = datetime.date(2026, 1, 1)
+END = datetime.date(2026, 1, 3)
+TODAY = datetime.date(2026, 2, 1)
+COLUMNS = ('zoneAveTemp',)
+CALL = ('GET', 'runtimeReport')
+
+
+def test_past_days_fetched_once(server):
+    client = server.client(report_store=ecobee.ReportStore())
+    client.thermostatSummary()
+
+    first = client.runtimeReport(start_date=START, end_date=END, columns=COLUMNS)
+    second = client.runtimeReport(start_date=START, end_date=END, columns=COLUMNS)
+
+    assert server.calls[CALL] == 1
+    assert second['reportList'] == first['reportList']
+    assert list(r['rowCount'] for r in first['reportList']) == [3 * 288] * 3
+
+
+def test_empty_days_fetched_until_settled():
+    store = ecobee.ReportStore()
+    report = {
+        'startDate':  START.isoformat(),
+        'endDate':    END.isoformat(),
+        'reportList': [
+            {'thermostatIdentifier': 'a', 'rowList': ['2026-01-01,00:00:00,70.0']},
+            {'thermostatIdentifier': 'b', 'rowList': []},
+        ],
+    }
+
+    # fetched soon after, b might have been offline and upload them later
+    store.add(report, thermostat_ids=['a', 'b'], columns=COLUMNS, complete_before=END,
+              fetched=END)
+    missing = store.missing(['a', 'b'], START, END, COLUMNS)
+    assert missing['a'] == [datetime.date(2026, 1, 2), END]
+    assert missing['b'] == [START, datetime.date(2026, 1, 2), END]
+
+    # fetched a month later, they really are empty
+    store.add(report, thermostat_ids=['a', 'b'], columns=COLUMNS, complete_before=TODAY,
+              fetched=TODAY)
+    missing = store.missing(['a', 'b'], START, END, COLUMNS)
+    assert missing == {'a': [], 'b': []}
+    assert store.report(['b'], START, END, COLUMNS)['reportList'][0]['rowList'] == []
+
+
+def test_no_answer_same_with_store(server):
+    plain = server.client()
+    stored = server.client(report_store=ecobee.ReportStore())
+    plain.thermostatSummary()
+    stored.thermostatSummary()
+    server.revoke()
+
+    assert plain.runtimeReport(start_date=START, end_date=END, columns=COLUMNS) is None
+    assert stored.runtimeReport(start_date=START, end_date=END, columns=COLUMNS) is None
@@ -0,0 +1,131 @@
+# vim: set fileencoding=utf-8
+"""Requests are retried after token refresh, server and connection
+errors, and a circuit breaker stops them when an endpoint keeps failing"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import time
+
+import pytest
+
+import ecobee
+from ecobee.retry import CircuitBreaker
+
+
+SUMMARY = {'selection': {'selectionType': 'registered', 'selectionMatch': ''}}
+CALL = ('GET', 'thermostatSummary')
+
+
+def summary(client):
+    return client.get('thermostatSummary', SUMMARY)
+
+
+def quick_retry(**kwargs):
+    """RetryPolicy with short, predictable waits"""
+    kwargs.setdefault('backoff', 0.05)
+    kwargs.setdefault('jitter', 0)
+    return ecobee.RetryPolicy(**kwargs)
+
+
+def test_replay_after_error_14(server):
+    client = server.client(retry=quick_retry(retries=0))
+    server.expire_tokens()
+
+    assert summary(client)['thermostatCount'] == 3
+    assert server.calls[CALL] == 2
+    assert server.calls[('POST', 'token')] == 1
+
+
+def test_backoff_after_server_errors(server):
+    client = server.client(retry=quick_retry(retries=2))
+    server.fail(3, count=2)
+
+    start = time.monotonic()
+    assert summary(client)['thermostatCount'] == 3
+    # waited 0.05, then 0.1 seconds
+    assert time.monotonic() - start >= 0.15
+    assert server.calls[CALL] == 3
+
+
+def test_server_errors_after_retries(server):
+    client = server.client(retry=quick_retry(retries=2))
+    server.fail(3, count=5)
+
+    with pytest.raises(ecobee.EcobeeException):
+        summary(client)
+    assert server.calls[CALL] == 3
+
+
+def test_retry_after_connection_error(server):
+    client = server.client(retry=quick_retry(retries=1))
+    server.disconnect()
+
+    assert summary(client)['thermostatCount'] == 3
+    assert server.calls[CALL] == 2
+
+
+def test_no_retry_of_post_after_disconnect(server):
+    client = server.client(retry=quick_retry(retries=2))
+    server.disconnect(endpoint='thermostat')
+
+    # the hold may have been set, sending it again could undo a newer one
+    with pytest.raises(ecobee.EcobeeException):
+        client.resumeProgram(next(iter(server.thermostats)))
+    assert server.calls[('POST', 'thermostat')] == 1
+
+
+def test_no_retry_of_post_after_server_error(server):
+    client = server.client(retry=quick_retry(retries=2))
+    server.fail(3, endpoint='thermostat')
+
+    with pytest.raises(ecobee.EcobeeException):
+        client.resumeProgram(next(iter(server.thermostats)))
+    assert server.calls[('POST', 'thermostat')] == 1
+
+
+def test_retry_of_post_before_connecting(server):
+    client = server.client(retry=quick_retry(retries=1))
+    # nothing listening: the first attempt can't have been applied
+    server.stop()
+
+    with pytest.raises(ecobee.EcobeeException):
+        client.resumeProgram('1')
+    assert client._breaker('thermostat').failures == 2
+
+
+def test_no_retry_of_validation_error(server):
+    client = server.client(retry=quick_retry(retries=2))
+    server.fail(4)
+
+    with pytest.raises(ecobee.EcobeeException):
+        summary(client)
+    assert server.calls[CALL] == 1
+
+
+def test_breaker_opens_and_recovers(server):
+    client = server.client(retry=quick_retry(retries=0, breaker_failures=2, breaker_reset=0.2))
+    breaker = client._breaker('thermostatSummary')
+    server.fail(3, count=3)
+
+    for _ in range(2):
+        with pytest.raises(ecobee.EcobeeException):
+            summary(client)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # open: fails without sending anything
+    with pytest.raises(ecobee.CircuitOpenException):
+        summary(client)
+    assert server.calls[CALL] == 2
+
+    # half open: the trial request fails, and it opens again
+    time.sleep(0.2)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(ecobee.EcobeeException):
+        summary(client)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # half open again: the trial succeeds, and it closes
+    time.sleep(0.2)
+    assert summary(client)['thermostatCount'] == 3
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert server.calls[CALL] == 4
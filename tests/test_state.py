@@ -0,0 +1,37 @@
+# vim: set fileencoding=utf-8
+"""Saved state loads into a new client"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import ecobee
+
+
+def test_load_state(server, tmp_path):
+    path = str(tmp_path / 'state')
+    client = server.client()
+    client.poll()
+    client.update()
+    client.save_state(path)
+
+    loaded = server.client()
+    assert loaded.load_state(path)
+
+    assert list(loaded.thermostat_ids) == list(client.thermostat_ids)
+    assert loaded._status == client._status
+    assert loaded.poll() == []
+
+
+def test_load_state_leaves_history_alone(server, tmp_path):
+    path = str(tmp_path / 'state')
+    client = server.client()
+    client.update()
+    client.save_state(path)
+
+    history = ecobee.History()
+    loaded = server.client(history=history)
+    loaded.load_state(path)
+    tid = loaded.thermostat_ids[0]
+    assert history.series(tid, 'temperature') is None
+
+    loaded.update()
+    assert len(history.series(tid, 'temperature')) == 1
@@ -0,0 +1,50 @@
+# vim: set fileencoding=utf-8
+"""Callers share a recent /thermostatSummary, and don't wait on each
+other when sharing is turned off"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+import time
+
+from ecobee.fakeserver import FakeEcobee
+
+from tests.conftest import run_together
+
+
+THREADS = 8
+CALL = ('GET', 'thermostatSummary')
+
+
+def test_callers_share_summary(server):
+    client = server.client(summary_ttl=10)
+
+    results = run_together(client.thermostatSummary, THREADS)
+
+    assert all(r is results[0] for r in results)
+    assert server.calls[CALL] == 1
+
+
+def test_no_ttl_runs_concurrently():
+    with FakeEcobee(thermostats=3, latency=0.2) as server:
+        client = server.client(summary_ttl=0)
+
+        start = time.monotonic()
+        results = run_together(client.thermostatSummary, THREADS)
+
+        # one after another would take THREADS * 0.2 seconds
+        assert time.monotonic() - start < 0.2 * THREADS / 2
+        assert all(r['thermostatCount'] == 3 for r in results)
+        assert server.calls[CALL] == THREADS
+        assert list(client.thermostat_ids) == list(server.thermostats)
+
+
+def test_poll_returns_changes_once(server):
+    client = server.client(summary_ttl=10)
+
+    # all of them are new, then the shared summary has nothing newer
+    assert client.poll() == list(server.thermostats)
+    assert client.poll() == []
+    assert server.calls[CALL] == 1
+
+    # update_changed() still shares the poll
+    assert client.update_changed() == list(server.thermostats)
@@ -0,0 +1,56 @@
+# vim: set fileencoding=utf-8
+"""Updates only count the thermostats they actually fetched, so those
+that got no answer are fetched again next time"""
+
+__author__ = 'Michael Stella <ecobee@thismetalsky.org>'
+
+
+def temperature(client, tid):
+    return client._status[tid]['runtime']['actualTemperature']
+
+
+def test_incremental_retries_unanswered(server):
+    client = server.client(summary_ttl=0)
+    client.update_incremental()
+
+    changed = server.change(fraction=0.5)
+    # error 14 twice: once for the request, once for its replay
+    server.fail(14, count=2, endpoint='thermostat')
+    assert client.update_incremental() == []
+
+    assert client.update_incremental() == changed
+    for tid in changed:
+        assert temperature(client, tid) == server.thermostats[tid].temperature
+
+
+def test_changed_retries_unanswered(server):
+    client = server.client(summary_ttl=0)
+    client.update_changed()
+
+    changed = server.change(fraction=0.5)
+    server.fail(14, count=2, endpoint='thermostat')
+    assert client.update_changed() == []
+
+    assert client.update_changed() == changed
+    for tid in changed:
+        assert temperature(client, tid) == server.thermostats[tid].temperature
+
+
+def test_incremental_polls_only_what_it_fetched(server):
+    client = server.client(summary_ttl=0)
+    client.update_incremental()
+
+    # new readings, but no new settings to fetch
+    changed = server.change(fraction=0.5)
+    assert client.update_incremental(sections=['settings']) == []
+    assert client.poll() == changed
+
+
+def test_incremental_failure_leaves_poll(server):
+    client = server.client(summary_ttl=0)
+    client.update_incremental()
+
+    changed = server.change(fraction=0.5)
+    server.fail(14, count=2, endpoint='thermostat')
+    assert client.update_incremental() == []
+    assert client.poll() == changed